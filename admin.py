@@ -2,7 +2,10 @@ from django.contrib import admin
 
 from .models import Dataset, DataUseAgreement, DataAccess, DataProvider, Keyword
 from .models import MediaSubType, DataField, ConfidentialityImpact, StorageType
-from .models import Project, StorageType, RetentionRequest
+from .models import Project, StorageType, RetentionRequest, ArchiveFile, Job
+
+from .counters import invalidate_dashboard_counts
+from .versions import bump_versions
 
 # customize the look of the admin site:
 admin.site.site_header = 'Data Catalog Management Page'
@@ -12,22 +15,30 @@ admin.site.index_title = "Back end administration"
 # create custom actions:
 def make_published(modeladmin, request, queryset):
     queryset.update(published=True)
+    bump_versions(queryset.model)
+    invalidate_dashboard_counts()
 make_published.short_description = "Publish selected items"
 
 def make_unpublished(modeladmin, request, queryset):
     queryset.update(published=False)
+    bump_versions(queryset.model)
+    invalidate_dashboard_counts()
 make_unpublished.short_description = "Un-publish selected items"
 
 def make_curated(modeladmin, request, queryset):
     queryset.update(curated=True)
+    bump_versions(queryset.model)
 make_curated.short_description = "Mark selected items as curated"
 
 def make_retained(modeladmin, request, queryset):
     queryset.update(data_retained=True)
+    bump_versions(queryset.model)
 make_retained.short_description = "Mark selected items as archived"
 
 def make_locked(modeladmin, request, queryset):
     queryset.update(locked=True)
+    bump_versions(queryset.model)
+    invalidate_dashboard_counts()
 make_locked.short_description = "Mark selected items as locked"
 
 # customize the individual model views:
@@ -61,6 +72,17 @@ class DataUseAgreementAdmin(admin.ModelAdmin):
     search_fields = ('title', 'description', 'duaid')
     actions = [make_published, make_unpublished, make_curated]
 
+class ArchiveFileInline(admin.TabularInline):
+    model = ArchiveFile
+    fk_name = 'data_access'
+    fields = ('name', 'path', 'size', 'sha256', 'duplicate_of')
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
 @admin.register(DataAccess)
 class DataAccessAdmin(admin.ModelAdmin):
     list_display = ("name",
@@ -71,8 +93,15 @@ class DataAccessAdmin(admin.ModelAdmin):
                     "published",
     )
     list_filter = ('curated', 'published','storage_type', 'data_retained')
+    # storage_type is nullable, so not followed by the default select_related()
+    list_select_related = ('storage_type',)
     search_fields = ('name','unique_id', 'shareable_link')
     actions = [make_published, make_unpublished, make_curated, make_retained]
+    inlines = [ArchiveFileInline]
+
+    def get_queryset(self, request):
+        # is_requested is read from an annotation rather than counted for each row
+        return super(DataAccessAdmin, self).get_queryset(request).with_request_flags()
 
 @admin.register(Project)
 class ProjectAdmin(admin.ModelAdmin):
@@ -150,3 +179,15 @@ class ConfidentialityImpactAdmin(admin.ModelAdmin):
     )
     list_filter = ('standard',)
     search_fields = ("standard", "definition")
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ("pk",
+                    "task",
+                    "description",
+                    "status",
+                    "created",
+                    "finished",
+    )
+    list_filter = ('status', 'task')
+    readonly_fields = ('created', 'started', 'finished', 'attempts')
@@ -0,0 +1,306 @@
+from django.contrib.auth.mixins import LoginRequiredMixin
+from django.core.exceptions import PermissionDenied
+from django.db.models import Prefetch
+from django.http import Http404, JsonResponse
+from django.views import View
+
+from .models import Dataset, Keyword, DataProvider, DataField, DataUseAgreement, Project, RetentionRequest
+from .models import DataAccess, ConfidentialityImpact, MediaSubType, GovernanceType
+from .pagination import KeysetPaginationMixin, keyset_page
+from .permissions import get_permission_resolver
+
+
+class ApiError(Exception):
+    """
+    raised for invalid API requests, and returned to the client as a 400 response
+    """
+
+
+def parse_list(value):
+    """
+    splits a comma separated query parameter into a list of names
+    """
+    return [v.strip() for v in (value or '').split(',') if v.strip()]
+
+
+class Relation:
+    """
+    A related record set that can be requested with ?include=. It is fetched with one
+    prefetch query, loading only the related model's fields that are serialized.
+    """
+    def __init__(self, lookup, model, fields=None, filter=None, key=None):
+        self.lookup = lookup
+        self.model = model
+        # fields of the related records to return; None returns the id and name of each
+        self.fields = fields
+        self.filter = filter or {}
+        # for reverse foreign keys, the foreign key on the related model (needed to match
+        # the related records to their parents)
+        self.key = key
+
+    def prefetch(self, to_attr):
+        queryset = self.model.objects.filter(**self.filter)
+        if self.fields is not None:
+            queryset = queryset.only('pk', *self.fields, *([self.key] if self.key else []))
+        return Prefetch(self.lookup, queryset=queryset, to_attr=to_attr)
+
+    def serialize(self, obj):
+        data = {'id': obj.pk}
+        if self.fields is None:
+            data['name'] = str(obj)
+        else:
+            data.update({f: getattr(obj, f) for f in self.fields})
+        return data
+
+
+class Resource:
+    """
+    Describes how one model is exposed through the API: the records a user may read,
+    the fields that may be requested (foreign keys are returned as the related id), the
+    default fields, and the related records that may be included.
+    """
+    model = None
+    fields = ()
+    default_fields = ()
+    relations = {}
+    ordering = ('-record_update', '-pk')
+
+    def base_queryset(self, request):
+        return self.model.objects.filter(published=True)
+
+    def get_fields(self, requested):
+        if not requested:
+            return list(self.default_fields)
+        unknown = [f for f in requested if f not in self.fields]
+        if unknown:
+            raise ApiError(f"Unknown fields: {', '.join(unknown)}. Available fields: {', '.join(self.fields)}")
+        return ['id'] + [f for f in requested if f != 'id']
+
+    def get_relations(self, requested):
+        unknown = [r for r in requested if r not in self.relations]
+        if unknown:
+            raise ApiError(f"Unknown includes: {', '.join(unknown)}. "
+                           f"Available includes: {', '.join(self.relations) or 'none'}")
+        return requested
+
+    def get_queryset(self, request, fields, includes):
+        """
+        restricts the columns loaded to the requested fields (plus those needed for paging
+        and the includes), and adds one prefetch per include
+        """
+        columns = {f for f in fields if f not in ('id', 'url')}
+        columns.update(o.lstrip('-') for o in self.ordering if o.lstrip('-') != 'pk')
+
+        prefetches = []
+        for name in includes:
+            relation = self.relations[name]
+            if relation.lookup in self.foreign_keys():
+                # the related record is found from the foreign key column
+                columns.add(relation.lookup)
+            prefetches.append(relation.prefetch(to_attr=f'api_{name}'))
+        return self.base_queryset(request).only(*columns).prefetch_related(*prefetches)
+
+    def foreign_keys(self):
+        return {f.name for f in self.model._meta.concrete_fields if f.many_to_one}
+
+    def serialize(self, obj, fields, includes):
+        data = {}
+        for name in fields:
+            if name == 'url':
+                data['url'] = obj.get_absolute_url()
+            else:
+                field = self.model._meta.get_field(name) if name != 'id' else self.model._meta.pk
+                data[name] = getattr(obj, field.attname)
+        if includes:
+            # under a key of their own, since an include may share its name with a field
+            # (eg. publisher, returned as the provider's id)
+            data['included'] = {}
+        for name in includes:
+            relation = self.relations[name]
+            related = getattr(obj, f'api_{name}')
+            if isinstance(related, list):
+                data['included'][name] = [relation.serialize(r) for r in related]
+            else:
+                # a foreign key, prefetched as a single record
+                data['included'][name] = relation.serialize(related) if related is not None else None
+        return data
+
+
+class DatasetResource(Resource):
+    model = Dataset
+    fields = ('id', 'url', 'ds_id', 'title', 'description', 'period_start', 'period_end', 'publication_date',
+              'publisher', 'data_source', 'num_records', 'record_scale', 'landing_url', 'comments', 'curated',
+              'published', 'public', 'record_creation', 'record_update')
+    default_fields = ('id', 'url', 'ds_id', 'title', 'description', 'publisher', 'record_update')
+    relations = {
+        'publisher': Relation('publisher', DataProvider, fields=('name',)),
+        'data_source': Relation('data_source', DataProvider, fields=('name',)),
+        'keywords': Relation('keywords', Keyword, fields=('keyword',)),
+        'cil': Relation('cil', ConfidentialityImpact, fields=('standard', 'impact_level', 'impact_rank')),
+        'media_subtype': Relation('media_subtype', MediaSubType, fields=('name', 'template')),
+        'data_fields': Relation('data_fields', DataField, fields=('name', 'description')),
+        'duas': Relation('datauseagreement_set', DataUseAgreement, fields=('duaid', 'title'),
+                         filter={'published': True}),
+    }
+
+
+class KeywordResource(Resource):
+    model = Keyword
+    fields = ('id', 'url', 'keyword', 'definition', 'curated', 'published', 'record_creation', 'record_update')
+    default_fields = ('id', 'url', 'keyword', 'definition')
+    relations = {
+        'datasets': Relation('dataset_set', Dataset, fields=('title',), filter={'published': True}),
+    }
+
+
+class DataProviderResource(Resource):
+    model = DataProvider
+    fields = ('id', 'url', 'name', 'dept', 'phone', 'email', 'country', 'affiliation', 'curated', 'published',
+              'record_creation', 'record_update')
+    default_fields = ('id', 'url', 'name', 'dept', 'country', 'affiliation')
+    relations = {
+        'published_datasets': Relation('dataset_publisher', Dataset, fields=('title',), filter={'published': True},
+                                       key='publisher'),
+        'source_datasets': Relation('dataset_source', Dataset, fields=('title',), filter={'published': True},
+                                    key='data_source'),
+    }
+
+
+class DataFieldResource(Resource):
+    model = DataField
+    fields = ('id', 'url', 'name', 'description', 'scope', 'record_creation', 'record_update')
+    default_fields = ('id', 'url', 'name', 'description')
+    relations = {
+        'datasets': Relation('dataset_set', Dataset, fields=('title',), filter={'published': True}),
+    }
+
+    def base_queryset(self, request):
+        return DataField.objects.all()
+
+
+class DataUseAgreementResource(Resource):
+    model = DataUseAgreement
+    fields = ('id', 'url', 'duaid', 'title', 'description', 'governance_type', 'publisher', 'contact', 'pi',
+              'separate_attestation', 'scope', 'date_signed', 'start_date', 'end_date', 'defers_to_doc',
+              'supersedes_doc', 'destruction_required', 'mixing_allowed', 'storage_requirements',
+              'access_conditions', 'reuse_scope', 'curated', 'published', 'record_creation', 'record_update')
+    default_fields = ('id', 'url', 'duaid', 'title', 'publisher', 'start_date', 'end_date')
+    relations = {
+        'governance_type': Relation('governance_type', GovernanceType, fields=('name',)),
+        'publisher': Relation('publisher', DataProvider, fields=('name',)),
+        'datasets': Relation('datasets', Dataset, fields=('title',), filter={'published': True}),
+    }
+
+    def base_queryset(self, request):
+        # DUAs are only listed to users with permission to view them
+        if not request.user.has_perm('datacatalog.view_datauseagreement'):
+            raise PermissionDenied
+        return super(DataUseAgreementResource, self).base_queryset(request)
+
+
+class ProjectResource(Resource):
+    model = Project
+    fields = ('id', 'url', 'name', 'description', 'pi', 'admin', 'sponsor', 'funding_id', 'completion',
+              'record_creation', 'record_update')
+    default_fields = ('id', 'url', 'name', 'pi', 'completion')
+    relations = {
+        'pi': Relation('pi', Project._meta.get_field('pi').related_model),
+        'admin': Relation('admin', Project._meta.get_field('admin').related_model),
+        'other_pis': Relation('other_pis', Project._meta.get_field('other_pis').related_model),
+        'other_editors': Relation('other_editors', Project._meta.get_field('other_editors').related_model),
+        'data_access': Relation('dataaccess_set', DataAccess, fields=('name',), key='project'),
+        'retention_requests': Relation('retentionrequest_set', RetentionRequest, fields=('name',), key='project'),
+    }
+
+    def base_queryset(self, request):
+        return get_permission_resolver(request).viewable(Project.objects.all())
+
+
+class RetentionRequestResource(Resource):
+    model = RetentionRequest
+    fields = ('id', 'url', 'name', 'project', 'milestone', 'milestone_date', 'milestone_pointer', 'comments',
+              'ticket', 'locked', 'verified', 'archived', 'record_creation', 'record_update')
+    default_fields = ('id', 'url', 'name', 'project', 'milestone', 'locked', 'verified', 'archived')
+    relations = {
+        'project': Relation('project', Project, fields=('name',)),
+        'to_archive': Relation('to_archive', DataAccess, fields=('name',)),
+    }
+
+    def base_queryset(self, request):
+        return get_permission_resolver(request).viewable(RetentionRequest.objects.all())
+
+
+RESOURCES = {
+    'datasets': DatasetResource(),
+    'keywords': KeywordResource(),
+    'providers': DataProviderResource(),
+    'datafields': DataFieldResource(),
+    'duas': DataUseAgreementResource(),
+    'projects': ProjectResource(),
+    'retention': RetentionRequestResource(),
+}
+
+
+# ############################ #
+# #####    API  VIEWS    ##### #
+# ############################ #
+
+class ApiView(LoginRequiredMixin, View):
+    """
+    Base of the read-only JSON API views. ?fields= selects the fields returned (and
+    loaded from the database), and ?include= adds related records, each fetched with a
+    single query.
+    """
+    # answer with 403 instead of redirecting API clients to the login page
+    raise_exception = True
+
+    def get_resource(self):
+        resource = RESOURCES.get(self.kwargs['resource'])
+        if resource is None:
+            raise Http404()
+        return resource
+
+    def get(self, request, *args, **kwargs):
+        resource = self.get_resource()
+        try:
+            fields = resource.get_fields(parse_list(request.GET.get('fields')))
+            includes = resource.get_relations(parse_list(request.GET.get('include')))
+        except ApiError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+        queryset = resource.get_queryset(request, fields, includes)
+        return JsonResponse(self.get_data(resource, queryset, fields, includes))
+
+
+class ApiListView(KeysetPaginationMixin, ApiView):
+    """
+    returns a page of records as {"results": [...], "next": <url of the next page or null>}.
+    The page size is set with ?page_size=, and the next page is fetched with ?cursor=.
+    """
+    def get_data(self, resource, queryset, fields, includes):
+        page = keyset_page(queryset,
+                           self.get_paginate_by(queryset),
+                           cursor=self.request.GET.get(self.cursor_kwarg) or None,
+                           ordering=resource.ordering,
+                           )
+        next_url = None
+        if page.has_next:
+            params = self.request.GET.copy()
+            params[self.cursor_kwarg] = page.next_cursor
+            next_url = self.request.build_absolute_uri('?' + params.urlencode())
+
+        return {'results': [resource.serialize(obj, fields, includes) for obj in page],
+                'next': next_url,
+                'page_size': page.page_size,
+                }
+
+
+class ApiDetailView(ApiView):
+    """
+    returns a single record
+    """
+    def get_data(self, resource, queryset, fields, includes):
+        obj = queryset.filter(pk=self.kwargs['pk']).first()
+        if obj is None:
+            raise Http404()
+        return resource.serialize(obj, fields, includes)
@@ -3,3 +3,8 @@ from django.apps import AppConfig
 
 class DatacatalogConfig(AppConfig):
     name = 'datacatalog'
+
+    def ready(self):
+        # register signal receivers and background job tasks
+        from . import signals
+        from . import tasks
@@ -0,0 +1,138 @@
+import json
+import statistics
+import time
+
+from django.db.models import Count
+from django.urls import reverse
+
+from . import urls
+from .api import RESOURCES
+from .export import EXPORTS, FORMATS, supports
+from .instrumentation import RequestMetrics
+from .models import Dataset, DataUseAgreement, RetentionRequest, Project
+from .typeahead import IndexedAutocompleteMixin
+
+# model whose records fill the pk of each url (by url name) not served by a view of that model
+PK_MODELS = {'ddict-file': Dataset,
+             'dua-doc-view': DataUseAgreement,
+             'methodfile-view': RetentionRequest,
+             'inventory-view': RetentionRequest,
+             'wizard-project': RetentionRequest,
+             'wizard-data': RetentionRequest,
+             }
+
+# data posted to the views that answer POST requests only
+POST_DATA = {'full-search': {'srch_term': 'clinical record'}}
+
+# terms searched on each autocomplete: the first page of suggestions, a prefix and a word
+AUTOCOMPLETE_TERMS = ('', 'c', 'clinical')
+
+
+class BenchmarkCase:
+    """
+    one request made by the benchmark: the url name, the method, the path and the data
+    sent (query string or form data)
+    """
+    def __init__(self, name, path, method='get', data=None):
+        self.name = name
+        self.path = path
+        self.method = method
+        self.data = data or {}
+
+    @property
+    def key(self):
+        return f"{self.method.upper()} {self.path} {json.dumps(self.data, sort_keys=True)}"
+
+    def request(self, client):
+        response = getattr(client, self.method)(self.path, self.data)
+        # streamed responses run their queries as they are read
+        if response.streaming:
+            content = b''.join(response.streaming_content)
+        else:
+            content = response.content
+        return response, len(content)
+
+
+def sample_pk(model):
+    """
+    returns the primary key of a typical record of the model: the one in the middle of
+    the primary key order, or None if there are none
+    """
+    count = model.objects.count()
+    if not count:
+        return None
+    return model.objects.order_by('pk').values_list('pk', flat=True)[count // 2]
+
+
+def benchmark_cases():
+    """
+    returns a BenchmarkCase for every named url of urls.py, with each export kind and
+    format, each API resource and a few terms for each autocomplete. Urls needing a record
+    of a model that has none are left out.
+    """
+    cases = []
+    for pattern in urls.urlpatterns:
+        name = getattr(pattern, 'name', None)
+        if name is None:
+            continue
+        view_class = getattr(pattern.callback, 'view_class', None)
+        converters = set(pattern.pattern.converters)
+        url_name = f'{urls.app_name}:{name}'
+
+        if converters == {'kind', 'fmt'}:
+            cases += [BenchmarkCase(name, reverse(url_name, kwargs={'kind': kind, 'fmt': fmt}))
+                      for kind in EXPORTS for fmt in FORMATS if supports(kind, fmt)]
+        elif converters == {'resource'}:
+            cases += [BenchmarkCase(name, reverse(url_name, kwargs={'resource': resource}))
+                      for resource in RESOURCES]
+        elif converters == {'resource', 'pk'}:
+            for resource_name, resource in RESOURCES.items():
+                pk = sample_pk(resource.model)
+                if pk is not None:
+                    cases.append(BenchmarkCase(name, reverse(url_name, kwargs={'resource': resource_name, 'pk': pk})))
+        elif converters == {'pk'}:
+            pk = sample_pk(PK_MODELS.get(name) or view_class.model)
+            if pk is not None:
+                cases.append(BenchmarkCase(name, reverse(url_name, kwargs={'pk': pk})))
+        elif view_class is not None and issubclass(view_class, IndexedAutocompleteMixin):
+            data = {}
+            if name == 'autocomplete-access-byproject':
+                # the project with the most data locations
+                project = Project.objects.annotate(n=Count('dataaccess')).order_by('-n', 'pk').first()
+                data['forward'] = json.dumps({'project': project.pk if project else None})
+            cases += [BenchmarkCase(name, reverse(url_name), data=dict(data, q=term)) for term in AUTOCOMPLETE_TERMS]
+        elif name in POST_DATA:
+            cases.append(BenchmarkCase(name, reverse(url_name), method='post', data=POST_DATA[name]))
+        else:
+            cases.append(BenchmarkCase(name, reverse(url_name)))
+    return cases
+
+
+def run_case(client, case, repeat):
+    """
+    makes the case's request repeat + 1 times, and returns the status, response size,
+    queries and timings (in ms) of the first request and of the repeats. The first
+    request fills the caches the repeats may be answered from.
+    """
+    runs = []
+    for i in range(repeat + 1):
+        metrics = RequestMetrics()
+        with metrics.wrap_connections():
+            start = time.perf_counter()
+            response, size = case.request(client)
+            elapsed = (time.perf_counter() - start) * 1000
+        runs.append((elapsed, metrics.query_count, metrics.sql_time * 1000))
+
+    first, repeats = runs[0], runs[1:] or runs[:1]
+    return {'name': case.name,
+            'key': case.key,
+            'status': response.status_code,
+            'bytes': size,
+            'first_queries': first[1],
+            'first_ms': round(first[0], 2),
+            'queries': max(run[1] for run in repeats),
+            'median_ms': round(statistics.median(run[0] for run in repeats), 2),
+            'min_ms': round(min(run[0] for run in repeats), 2),
+            'max_ms': round(max(run[0] for run in repeats), 2),
+            'sql_ms': round(statistics.median(run[2] for run in repeats), 2),
+            }
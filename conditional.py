@@ -0,0 +1,100 @@
+import hashlib
+
+from django.contrib import messages
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+
+from .permissions import user_group_names
+from .versions import PERMISSIONS, get_versions, versions_shared
+
+
+class ConditionalGetMixin:
+    """
+    Answers a GET request with 304 Not Modified, without loading the page's records or
+    rendering its template, when the browser's copy of the page is still current.
+
+    The page's ETag is computed from a cheap validator (see get_validator), the versions
+    of etag_models (every model whose records the page shows; see versions.py) and the
+    user's permission fingerprint, since pages differ by user group.
+    Pages are only validated when the versions are held in a shared cache (see
+    versions_shared): with a cache per process, an edit saved through one process would
+    leave the others answering 304 for the old page.
+    Only an ETag is sent: record_update holds a date, so a Last-Modified header could
+    not tell apart two versions of a record saved on the same day.
+    """
+    etag_models = ()
+
+    def get_validator(self):
+        raise NotImplementedError
+
+    def get_user_fingerprint(self):
+        user = self.request.user
+        # the csrf cookie is set now, rather than while the page is rendered, so that the
+        # first response carries the same ETag as the following ones
+        get_token(self.request)
+        return (user.pk,
+                user.is_staff,
+                user.is_superuser,
+                sorted(user_group_names(user)),
+                # the page's csrf token stays valid for as long as the csrf cookie does
+                self.request.META.get('CSRF_COOKIE'),
+                )
+
+    def get_etag(self):
+        versions = get_versions(PERMISSIONS, *self.etag_models)
+        parts = (type(self).__name__,
+                 self.request.get_full_path(),
+                 self.get_validator(),
+                 sorted(versions.items()),
+                 self.get_user_fingerprint(),
+                 )
+        # weak, as the csrf token in the page changes on each render
+        return 'W/"%s"' % hashlib.sha1(repr(parts).encode()).hexdigest()
+
+    def set_etag_headers(self, response, etag):
+        response['ETag'] = etag
+        # pages are per user, and must be revalidated on every request
+        patch_cache_control(response, private=True, no_cache=True)
+        patch_vary_headers(response, ('Cookie',))
+
+    def get(self, request, *args, **kwargs):
+        # a page showing pending messages must not be reused once they have been shown
+        if not versions_shared() or len(messages.get_messages(request)):
+            return super(ConditionalGetMixin, self).get(request, *args, **kwargs)
+
+        etag = self.get_etag()
+        headers = HttpResponse()
+        self.set_etag_headers(headers, etag)
+        response = get_conditional_response(request, etag=etag, response=headers)
+        if response is not headers:
+            return response
+
+        response = super(ConditionalGetMixin, self).get(request, *args, **kwargs)
+        self.set_etag_headers(response, etag)
+        return response
+
+
+class ConditionalDetailMixin(ConditionalGetMixin):
+    """
+    for DetailViews: validated by the record's primary key and modification date. The
+    record is fetched once, for both the validator and the page.
+    """
+    def get_object(self, queryset=None):
+        if queryset is None and getattr(self, 'object', None) is not None:
+            return self.object
+        return super(ConditionalDetailMixin, self).get_object(queryset)
+
+    def get_validator(self):
+        self.object = self.get_object()
+        return (self.object.pk, self.object.record_update)
+
+
+class ConditionalListMixin(ConditionalGetMixin):
+    """
+    for ListViews: validated by the request parameters (the filters, ordering and page) alone,
+    without a query. A list only changes when a record of one of its etag_models is saved,
+    deleted or linked, which changes that model's version.
+    """
+    def get_validator(self):
+        return sorted(self.request.GET.lists())
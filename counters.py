@@ -0,0 +1,41 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Dataset, DataUseAgreement, DataAccess, RetentionRequest
+
+DASHBOARD_COUNTS_KEY = 'datacatalog:dashboard_counts'
+
+# the counts are invalidated whenever the models change, so the timeout only guards
+# against updates made outside of django (eg. directly in the database)
+DEFAULT_COUNTS_TIMEOUT = 60 * 60
+
+# models whose changes alter the dashboard counts
+COUNTED_MODELS = (Dataset, DataUseAgreement, DataAccess, RetentionRequest)
+
+
+def get_dashboard_counts():
+    """
+    returns the record counts shown on the catalog landing page, from the cache where
+    possible.
+    """
+    counts = cache.get(DASHBOARD_COUNTS_KEY)
+    if counts is None:
+        counts = {'ds_count': Dataset.objects.filter(published=True).count(),
+                  'dua_count': DataUseAgreement.objects.filter(published=True).count(),
+                  'access_count': DataAccess.objects.filter(published=True).count(),
+                  'unlocked_requests': RetentionRequest.objects.exclude(locked=True).count(),
+                  }
+        cache.set(DASHBOARD_COUNTS_KEY,
+                  counts,
+                  getattr(settings, 'DATACATALOG_COUNTS_TIMEOUT', DEFAULT_COUNTS_TIMEOUT),
+                  )
+    return counts
+
+
+def invalidate_dashboard_counts():
+    """
+    clears the cached counts once the current transaction commits, so they cannot be
+    recalculated from data that is about to change.
+    """
+    transaction.on_commit(lambda: cache.delete(DASHBOARD_COUNTS_KEY))
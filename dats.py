@@ -0,0 +1,432 @@
+import json
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Q
+from django.utils.dateparse import parse_date
+
+from .models import Dataset, DataProvider, Keyword, MediaSubType, ConfidentialityImpact
+from .versions import bump_versions
+
+# number of DATS records written to the database in each transaction
+BATCH_SIZE = 1000
+
+# DATS date types, mapped to Dataset fields
+DATE_TYPES = {
+    'publication date': 'publication_date',
+    'date published': 'publication_date',
+    'release date': 'publication_date',
+    'start date': 'period_start',
+    'coverage start date': 'period_start',
+    'end date': 'period_end',
+    'coverage end date': 'period_end',
+}
+
+# Dataset fields set from a DATS record (the remaining fields are references)
+DATASET_FIELDS = ('ds_id', 'title', 'description', 'publication_date', 'period_start', 'period_end',
+                  'landing_url', 'num_records', 'comments')
+
+
+class DATSError(ValueError):
+    """
+    raised when a DATS record cannot be mapped to a Dataset
+    """
+
+
+def normalize(value):
+    return " ".join(str(value).split()).lower()
+
+
+def first_value(items, key='value'):
+    """
+    returns the first non-empty key of a list of DATS objects (or of a single object)
+    """
+    if isinstance(items, dict):
+        items = [items]
+    for item in items or []:
+        if isinstance(item, dict) and item.get(key):
+            return item[key]
+    return None
+
+
+def all_values(items, key='value'):
+    if isinstance(items, dict):
+        items = [items]
+    return [item[key] for item in items or [] if isinstance(item, dict) and item.get(key)]
+
+
+def extra_property(record, category):
+    """
+    returns the first value of the extraProperties entry of a record with the given category
+    """
+    for prop in record.get('extraProperties') or []:
+        if normalize(prop.get('category', '')) == category:
+            return first_value(prop.get('values'))
+    return None
+
+
+def parse_record(record):
+    """
+    maps a DATS 2.2 Dataset object to a dict of Dataset field values, plus the names of
+    the referenced records:
+        identifier.identifier               -> ds_id
+        title, description                  -> title, description
+        dates[type.value]                   -> publication_date, period_start, period_end
+        distributions[].access.landingPage  -> landing_url
+        distributions[].formats             -> media_subtype (matched on template or name)
+        storedIn.publishers[].name          -> publisher
+        creators[].name                     -> data_source (first named creator)
+        keywords[].value                    -> keywords
+        privacy                             -> cil (matched on "standard: level" or level)
+        extraProperties "number of records" -> num_records
+        extraProperties "comments"          -> comments
+    """
+    if not isinstance(record, dict):
+        raise DATSError("record is not a JSON object")
+    title = (record.get('title') or '').strip()
+    if not title:
+        raise DATSError("record has no title")
+
+    fields = {'title': title[:256],
+              'ds_id': first_value(record.get('identifier'), 'identifier'),
+              'description': record.get('description'),
+              'comments': extra_property(record, 'comments'),
+              }
+
+    for date in record.get('dates') or []:
+        field_name = DATE_TYPES.get(normalize(first_value(date.get('type')) or ''))
+        if field_name and date.get('date'):
+            try:
+                fields[field_name] = parse_date(str(date['date'])[:10])
+            except ValueError:
+                raise DATSError(f"invalid {date.get('type')} date: {date['date']}")
+
+    num_records = extra_property(record, 'number of records')
+    if num_records is not None:
+        try:
+            fields['num_records'] = int(num_records)
+        except (TypeError, ValueError):
+            raise DATSError(f"invalid number of records: {num_records}")
+
+    distributions = record.get('distributions') or []
+    media_types = []
+    for distribution in distributions:
+        media_types.extend(distribution.get('formats') or [])
+        if not fields.get('landing_url'):
+            fields['landing_url'] = first_value(distribution.get('access'), 'landingPage')
+
+    stored_in = record.get('storedIn') or {}
+    publisher = first_value(stored_in.get('publishers'), 'name') or first_value(record.get('publisher'), 'name')
+
+    privacy = record.get('privacy')
+    return {'fields': fields,
+            'publisher': publisher,
+            'data_source': first_value(record.get('creators'), 'name'),
+            'keywords': all_values(record.get('keywords')),
+            'media_types': media_types,
+            'cil': [privacy] if privacy else [],
+            }
+
+
+def to_dats(dataset):
+    """
+    maps a Dataset to a DATS 2.2 Dataset object, the reverse of parse_record. The publisher,
+    data_source, keywords, media_subtype and cil of the dataset should be fetched in bulk
+    beforehand (see export.DatasetExport).
+    """
+    record = {'title': dataset.title}
+    if dataset.ds_id:
+        record['identifier'] = {'identifier': dataset.ds_id}
+    if dataset.description:
+        record['description'] = dataset.description
+
+    dates = [{'date': value.isoformat(), 'type': {'value': date_type}}
+             for date_type, value in (('publication date', dataset.publication_date),
+                                      ('start date', dataset.period_start),
+                                      ('end date', dataset.period_end),
+                                      )
+             if value]
+    if dates:
+        record['dates'] = dates
+
+    keywords = [{'value': kw.keyword} for kw in dataset.keywords.all()]
+    if keywords:
+        record['keywords'] = keywords
+    if dataset.data_source_id:
+        record['creators'] = [{'name': dataset.data_source.name}]
+    if dataset.publisher_id:
+        record['storedIn'] = {'publishers': [{'name': dataset.publisher.name}]}
+
+    formats = [str(mst) for mst in dataset.media_subtype.all()]
+    if formats or dataset.landing_url:
+        distribution = {}
+        if formats:
+            distribution['formats'] = formats
+        if dataset.landing_url:
+            distribution['access'] = {'landingPage': dataset.landing_url}
+        record['distributions'] = [distribution]
+
+    cils = [str(cil) for cil in dataset.cil.all()]
+    if cils:
+        record['privacy'] = cils[0]
+
+    extra = [(category, value) for category, value in (('number of records', dataset.num_records),
+                                                        ('comments', dataset.comments),
+                                                        )
+             if value is not None and value != '']
+    if extra:
+        record['extraProperties'] = [{'category': category, 'values': [{'value': str(value)}]}
+                                     for category, value in extra]
+    return record
+
+
+def read_jsonl(fh):
+    """
+    yields (line number, record) for each line of a DATS JSON-lines file
+    """
+    for line_number, line in enumerate(fh, 1):
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        if not line.strip():
+            continue
+        try:
+            yield line_number, json.loads(line)
+        except json.JSONDecodeError as e:
+            yield line_number, DATSError(f"invalid JSON: {e}")
+
+
+def save_new(model, objects, key):
+    """
+    inserts the objects in bulk, ensuring each gets its primary key. key is a field whose
+    values identify the objects inserted: where the database cannot return the new keys,
+    they are fetched back by those values (the newest record of each value winning).
+    """
+    if not objects:
+        return objects
+    model.objects.bulk_create(objects)
+    if not connection.features.can_return_rows_from_bulk_insert:
+        values = {getattr(obj, key) for obj in objects}
+        pks = dict(model.objects.filter(**{f'{key}__in': values}).order_by('pk').values_list(key, 'pk'))
+        for obj in objects:
+            obj.pk = pks[getattr(obj, key)]
+    return objects
+
+
+class LookupCache:
+    """
+    An in-memory map from normalized names to the records of a model, loaded with a single
+    query. Names not found are created in bulk by the factory, if one is given; field is
+    the model field the factory sets the name in.
+    """
+    def __init__(self, queryset, keys, factory=None, field=None):
+        self.model = queryset.model
+        self.keys = keys
+        self.factory = factory
+        self.field = field
+        self.objects = {}
+        for obj in queryset:
+            self.add(obj)
+
+    def add(self, obj):
+        for key in self.keys(obj):
+            if key:
+                self.objects.setdefault(normalize(key), obj)
+
+    def resolve(self, names):
+        """
+        returns {normalized name: record} for the names, creating any that are missing
+        """
+        missing = {normalize(n): n for n in names if n and normalize(n) not in self.objects}
+        if missing and self.factory:
+            for obj in save_new(self.model, [self.factory(n) for n in missing.values()], self.field):
+                self.add(obj)
+        return {normalize(n): self.objects[normalize(n)] for n in names if n and normalize(n) in self.objects}
+
+
+class DATSImporter:
+    """
+    Creates (or, with update=True, updates) Datasets from DATS records, BATCH_SIZE records per
+    transaction. Providers, keywords and media types are resolved through LookupCaches and
+    created when missing; confidentiality impact levels must already exist.
+
+    Records are matched to existing datasets on ds_id, then on title, ignoring case and
+    whitespace. Counts of the records created, updated, skipped and rejected are kept in
+    self.stats, and the reasons for rejection in self.errors as (line number, message).
+    """
+    def __init__(self, user, update=False, publish=False, batch_size=BATCH_SIZE):
+        self.user = user
+        self.update = update
+        self.publish = publish
+        self.batch_size = batch_size
+        self.stats = {'created': 0, 'updated': 0, 'skipped': 0, 'rejected': 0}
+        self.errors = []
+
+        # primary keys of the existing datasets by ds_id and by normalized title, since
+        # titles cannot be normalized in the database
+        self.dataset_ids = {}
+        self.dataset_titles = {}
+        for pk, ds_id, title in Dataset.objects.values_list('pk', 'ds_id', 'title').iterator():
+            self.add_dataset(pk, ds_id, title)
+
+        self.providers = LookupCache(DataProvider.objects.only('pk', 'name'),
+                                     keys=lambda p: [p.name],
+                                     factory=self.provider_factory,
+                                     field='name',
+                                     )
+        self.keywords = LookupCache(Keyword.objects.only('pk', 'keyword'),
+                                    keys=lambda k: [k.keyword],
+                                    factory=self.keyword_factory,
+                                    field='keyword',
+                                    )
+        self.media_types = LookupCache(MediaSubType.objects.only('pk', 'name', 'template'),
+                                       keys=lambda m: [m.template, m.name],
+                                       factory=self.media_type_factory,
+                                       field='name',
+                                       )
+        self.cils = LookupCache(ConfidentialityImpact.objects.all(),
+                                keys=lambda c: [str(c), c.impact_level],
+                                )
+
+    def add_dataset(self, pk, ds_id, title):
+        if ds_id:
+            self.dataset_ids[ds_id] = pk
+        self.dataset_titles.setdefault(normalize(title), pk)
+
+    def find_dataset(self, fields):
+        """
+        returns the primary key of the existing dataset matching the fields of a record, or None
+        """
+        pk = self.dataset_ids.get(fields['ds_id']) if fields['ds_id'] else None
+        return pk or self.dataset_titles.get(normalize(fields['title']))
+
+    def reject(self, line_number, message):
+        self.stats['rejected'] += 1
+        self.errors.append((line_number, message))
+
+    def provider_factory(self, name):
+        return DataProvider(name=name[:256], record_author=self.user, published=True)
+
+    def keyword_factory(self, name):
+        return Keyword(keyword=name[:64], definition="", record_author=self.user, published=True)
+
+    def media_type_factory(self, name):
+        return MediaSubType(name=name[:256], template=name[:256] if '/' in name else None)
+
+    def run(self, records):
+        """
+        imports an iterable of (line number, record) pairs, yielding the stats after each batch
+        """
+        batch = []
+        for line_number, record in records:
+            try:
+                if isinstance(record, Exception):
+                    raise record
+                batch.append((line_number, parse_record(record)))
+            except DATSError as e:
+                self.reject(line_number, str(e))
+
+            if len(batch) >= self.batch_size:
+                self.save_batch(batch)
+                batch = []
+                yield self.stats
+        if batch:
+            self.save_batch(batch)
+            yield self.stats
+
+    @transaction.atomic
+    def save_batch(self, batch):
+        # the last record wins if a dataset appears more than once in the batch
+        parsed = {}
+        titles = {}
+        for line_number, item in batch:
+            fields = item['fields']
+            key = fields['ds_id'] or normalize(fields['title'])
+            if titles.setdefault(normalize(fields['title']), key) != key:
+                self.reject(line_number, f"title is used by another record: {fields['title']}")
+                continue
+            parsed[key] = (line_number, item)
+
+        matched = {key: self.find_dataset(item['fields']) for key, (line_number, item) in parsed.items()}
+        if self.update:
+            existing = Dataset.objects.in_bulk([pk for pk in matched.values() if pk])
+        else:
+            self.stats['skipped'] += sum(1 for pk in matched.values() if pk)
+            parsed = {key: value for key, value in parsed.items() if not matched[key]}
+
+        # references for the whole batch, creating those that are missing
+        items = [item for line_number, item in parsed.values()]
+        providers = self.providers.resolve({i[k] for i in items for k in ('publisher', 'data_source')})
+        keywords = self.keywords.resolve({k for i in items for k in i['keywords']})
+        media_types = self.media_types.resolve({m for i in items for m in i['media_types']})
+        cils = self.cils.resolve({c for i in items for c in i['cil']})
+
+        new, changed, links = [], [], []
+        for key, (line_number, item) in parsed.items():
+            fields = item['fields']
+            if matched[key]:
+                dataset = existing[matched[key]]
+                changed.append((line_number, dataset))
+            else:
+                dataset = Dataset(record_author=self.user, published=self.publish)
+                new.append(dataset)
+
+            for name in DATASET_FIELDS:
+                if fields.get(name) is not None:
+                    setattr(dataset, name, fields[name])
+            # references the record leaves out are kept when updating
+            for name in ('publisher', 'data_source'):
+                if item[name] or dataset.pk is None:
+                    setattr(dataset, name, providers.get(normalize(item[name] or '')))
+            links.append((dataset, item))
+
+        save_new(Dataset, new, 'title')
+        for dataset in new:
+            self.add_dataset(dataset.pk, dataset.ds_id, dataset.title)
+        rejected = self.save_changed(changed)
+        for line_number, dataset in changed:
+            if dataset.pk not in rejected:
+                self.add_dataset(dataset.pk, dataset.ds_id, dataset.title)
+        links = [(dataset, item) for dataset, item in links if dataset.pk not in rejected]
+        self.stats['created'] += len(new)
+        self.stats['updated'] += len(changed) - len(rejected)
+
+        # many-to-many links, one insert per through table
+        for field_name, key, resolved in (('keywords', 'keywords', keywords),
+                                          ('media_subtype', 'media_types', media_types),
+                                          ('cil', 'cil', cils),
+                                          ):
+            field = Dataset._meta.get_field(field_name)
+            Through = field.remote_field.through
+            target = field.m2m_reverse_field_name() + '_id'
+            Through.objects.bulk_create([Through(**{'dataset_id': dataset.pk, target: resolved[normalize(name)].pk})
+                                         for dataset, item in links
+                                         for name in set(item[key])
+                                         if normalize(name) in resolved
+                                         ],
+                                        ignore_conflicts=True,
+                                        )
+        # bulk writes do not send the signals that update the page versions
+        bump_versions(Dataset, DataProvider, Keyword, MediaSubType)
+
+    def save_changed(self, changed):
+        """
+        writes the updated datasets, given as (line number, dataset), in bulk. If that fails
+        (eg. a record gives a dataset the title of another), each dataset is written on its own
+        and those that fail are rejected. Returns the primary keys of the rejected datasets.
+        """
+        update_fields = list(DATASET_FIELDS) + ['publisher', 'data_source']
+        try:
+            with transaction.atomic():
+                Dataset.objects.bulk_update([dataset for line_number, dataset in changed], update_fields)
+            return set()
+        except IntegrityError:
+            pass
+
+        rejected = set()
+        for line_number, dataset in changed:
+            try:
+                with transaction.atomic():
+                    Dataset.objects.filter(pk=dataset.pk).update(**{f: getattr(dataset, f) for f in update_fields})
+            except IntegrityError as e:
+                self.reject(line_number, f"dataset {dataset.pk} could not be updated: {e}")
+                rejected.add(dataset.pk)
+        return rejected
@@ -0,0 +1,233 @@
+import csv
+import importlib.util
+import io
+import json
+import os
+
+from django.db import connection, transaction
+
+from .models import DataField, Dataset
+from .search import get_search_backend
+from .versions import bump_versions
+
+# number of dictionary rows written to the database at a time
+BATCH_SIZE = 1000
+
+# accepted column headings (lower case, with underscores as spaces) for each DataField attribute
+NAME_COLUMNS = ('name', 'field', 'field name', 'variable', 'variable name', 'column', 'column name')
+DESCRIPTION_COLUMNS = ('description', 'definition', 'label', 'variable label', 'field description')
+SCOPE_COLUMNS = ('scope', 'values', 'range', 'allowed values', 'value range', 'notes')
+
+# maximum lengths of the DataField text columns
+MAX_LENGTH = 256
+
+# extensions of the uploaded dictionaries parsed by a background job; other dictionaries
+# the parser reads (eg. JSON) are parsed by the parse_dictionaries command
+UPLOAD_EXTENSIONS = ('.csv', '.tsv', '.xlsx')
+
+
+class DictionaryError(ValueError):
+    """
+    raised when a data dictionary cannot be read
+    """
+
+
+def normalize(heading):
+    return str(heading or '').strip().lower().replace('_', ' ')
+
+
+def find_column(headings, candidates):
+    """
+    returns the heading of the first of the candidate columns present in headings
+    """
+    normalized = {normalize(h): h for h in headings if h is not None}
+    for candidate in candidates:
+        if candidate in normalized:
+            return normalized[candidate]
+    return None
+
+
+def map_rows(rows):
+    """
+    yields (name, description, scope) for each of the dict rows of a dictionary,
+    skipping rows without a name
+    """
+    columns = None
+    for row in rows:
+        if columns is None:
+            headings = list(row.keys())
+            columns = (find_column(headings, NAME_COLUMNS),
+                       find_column(headings, DESCRIPTION_COLUMNS),
+                       find_column(headings, SCOPE_COLUMNS),
+                       )
+            if columns[0] is None:
+                raise DictionaryError("The data dictionary has no field name column "
+                                      f"(expected one of: {', '.join(NAME_COLUMNS)})")
+
+        values = [str(row.get(c) or '').strip()[:MAX_LENGTH] if c is not None else '' for c in columns]
+        if values[0]:
+            yield values[0], values[1], values[2] or None
+
+
+def read_delimited(fh, delimiter=None):
+    """
+    yields dict rows of a CSV or TSV file, guessing the delimiter if none is given
+    """
+    text = io.TextIOWrapper(fh, encoding='utf-8-sig', errors='replace', newline='')
+    if delimiter is None:
+        sample = text.read(4096)
+        text.seek(0)
+        try:
+            delimiter = csv.Sniffer().sniff(sample, delimiters=',\t;|').delimiter
+        except csv.Error:
+            delimiter = ','
+    yield from csv.DictReader(text, delimiter=delimiter)
+
+
+def read_xlsx(fh):
+    """
+    yields dict rows of the first worksheet of an Excel workbook
+    """
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise DictionaryError("Reading .xlsx data dictionaries requires the openpyxl package")
+
+    workbook = load_workbook(fh, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        headings = next(rows, None)
+        if headings is None:
+            return
+        for row in rows:
+            yield dict(zip(headings, row))
+    finally:
+        workbook.close()
+
+
+def read_json(fh, lines=False):
+    """
+    yields dict rows of a JSON-lines file (read line by line), or of a JSON document that is
+    either a list of objects or an object with a "fields" list (eg. a Frictionless table schema)
+    """
+    if lines:
+        for line in io.TextIOWrapper(fh, encoding='utf-8-sig'):
+            if line.strip():
+                yield json.loads(line)
+        return
+
+    document = json.load(io.TextIOWrapper(fh, encoding='utf-8-sig'))
+    if isinstance(document, dict):
+        document = document.get('fields', [])
+    if not isinstance(document, list):
+        raise DictionaryError("A JSON data dictionary must be a list of fields")
+    yield from document
+
+
+def read_dictionary(fh, filename):
+    """
+    yields (name, description, scope) for each field of a data dictionary, choosing the
+    reader by file extension. fh must be opened in binary mode.
+    """
+    extension = os.path.splitext(filename)[1].lower()
+    try:
+        if extension in ('.csv', '.txt'):
+            rows = read_delimited(fh)
+        elif extension == '.tsv':
+            rows = read_delimited(fh, delimiter='\t')
+        elif extension in ('.xlsx', '.xlsm'):
+            rows = read_xlsx(fh)
+        elif extension == '.json':
+            rows = read_json(fh)
+        elif extension in ('.jsonl', '.ndjson'):
+            rows = read_json(fh, lines=True)
+        else:
+            raise DictionaryError(f"Data dictionaries of type {extension or 'unknown'} cannot be parsed")
+        yield from map_rows(rows)
+    except (csv.Error, UnicodeError, json.JSONDecodeError) as e:
+        raise DictionaryError(f"The data dictionary could not be read: {e}")
+
+
+def parsed_on_upload(filename):
+    """
+    returns True if an uploaded data dictionary of this name should be parsed by a
+    background job: a CSV, TSV or (with openpyxl installed) Excel file
+    """
+    extension = os.path.splitext(filename)[1].lower()
+    if extension == '.xlsx' and importlib.util.find_spec('openpyxl') is None:
+        return False
+    return extension in UPLOAD_EXTENSIONS
+
+
+def batches(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def save_batch(dataset, fields, author):
+    """
+    updates the fields of the dataset that are already present (matched by name) and
+    creates the rest, then links the new fields to the dataset. Returns the number of
+    fields created.
+    """
+    # the last entry wins if a name is repeated in the dictionary
+    by_name = {name: (description, scope) for name, description, scope in fields}
+
+    existing = list(dataset.data_fields.filter(name__in=by_name.keys()).order_by('pk'))
+    changed = []
+    for field in existing:
+        description, scope = by_name.pop(field.name, (None, None))
+        if description is not None and (field.description, field.scope) != (description, scope):
+            field.description, field.scope = description, scope
+            changed.append(field)
+    DataField.objects.bulk_update(changed, ['description', 'scope'])
+
+    new_fields = [DataField(name=name, description=description, scope=scope, record_author=author)
+                  for name, (description, scope) in by_name.items()]
+    DataField.objects.bulk_create(new_fields)
+    if new_fields and not connection.features.can_return_rows_from_bulk_insert:
+        # the database does not return the new keys, which the links below need: fetch them
+        # back by name from the fields not yet linked to any dataset, the newest of each name
+        # winning. The import's transaction keeps other imports from writing in between.
+        pks = dict(DataField.objects.filter(name__in=by_name.keys(),
+                                            record_author=author,
+                                            dataset__isnull=True,
+                                            ).order_by('pk').values_list('name', 'pk'))
+        for field in new_fields:
+            field.pk = pks[field.name]
+
+    Through = Dataset.data_fields.through
+    Through.objects.bulk_create([Through(dataset_id=dataset.pk, datafield_id=field.pk) for field in new_fields],
+                                ignore_conflicts=True,
+                                )
+    # bulk writes do not send the signals that update the page versions and the search index
+    bump_versions(DataField, Dataset)
+    get_search_backend().update_many(changed + new_fields)
+    return len(new_fields)
+
+
+def import_dictionary(dataset, author=None):
+    """
+    parses the data_dictionary file of a dataset into DataField records linked to it, and
+    returns (fields read, fields created). Rows are read as a stream and written
+    BATCH_SIZE at a time, so large dictionaries are imported in constant memory.
+
+    Fields already linked to the dataset are updated in place when their name appears in
+    the dictionary; fields that are no longer in the dictionary are left linked.
+    """
+    if not dataset.data_dictionary:
+        raise DictionaryError("The dataset has no data dictionary")
+
+    author = author or dataset.record_author
+    read = created = 0
+    with dataset.data_dictionary.open('rb') as fh, transaction.atomic():
+        for batch in batches(read_dictionary(fh, dataset.data_dictionary.name), BATCH_SIZE):
+            read += len(batch)
+            created += save_batch(dataset, batch, author)
+    return read, created
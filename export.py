@@ -0,0 +1,222 @@
+import csv
+import json
+
+from django.core.exceptions import PermissionDenied
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Prefetch
+
+from .dats import to_dats
+from .models import Dataset, DataUseAgreement, DataAccess, Keyword, DataField
+from .permissions import get_permission_resolver
+
+# number of records (and their related records) loaded from the database at a time
+DEFAULT_CHUNK_SIZE = 500
+
+
+def in_chunks(queryset, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    yields the records of a queryset in primary key order, fetching chunk_size records at a
+    time with a keyset query. Unlike QuerySet.iterator(), prefetch_related is applied to
+    each chunk, and memory use does not grow with the size of the table.
+    """
+    queryset = queryset.order_by('pk')
+    last_pk = None
+    while True:
+        chunk = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        chunk = list(chunk[:chunk_size])
+        yield from chunk
+        if len(chunk) < chunk_size:
+            return
+        last_pk = chunk[-1].pk
+
+
+def joined(values):
+    return "; ".join(str(v) for v in values)
+
+
+class Export:
+    """
+    Describes the export of one model: the records a user may export, and the columns of
+    each exported row.
+    """
+    model = None
+    columns = ()
+
+    def get_queryset(self):
+        return self.model.objects.all()
+
+    def viewable(self, request):
+        """
+        returns the records the logged in user may export
+        """
+        return self.get_queryset().filter(published=True)
+
+    def row(self, obj):
+        raise NotImplementedError
+
+    # set on exports that can be written as DATS
+    dats = None
+
+
+class DatasetExport(Export):
+    model = Dataset
+    columns = ('id', 'ds_id', 'title', 'description', 'publisher', 'data_source', 'period_start', 'period_end',
+               'publication_date', 'num_records', 'record_scale', 'landing_url', 'keywords', 'cil',
+               'media_subtype', 'data_fields', 'record_update', 'url')
+
+    def get_queryset(self):
+        return Dataset.objects.select_related('publisher', 'data_source'
+                                              ).prefetch_related(Prefetch('keywords',
+                                                                          queryset=Keyword.objects.only('pk', 'keyword')),
+                                                                 'cil',
+                                                                 'media_subtype',
+                                                                 Prefetch('data_fields',
+                                                                          queryset=DataField.objects.only('pk', 'name')),
+                                                                 )
+
+    def row(self, ds):
+        return {'id': ds.pk,
+                'ds_id': ds.ds_id,
+                'title': ds.title,
+                'description': ds.description,
+                'publisher': ds.publisher.name if ds.publisher_id else None,
+                'data_source': ds.data_source.name if ds.data_source_id else None,
+                'period_start': ds.period_start,
+                'period_end': ds.period_end,
+                'publication_date': ds.publication_date,
+                'num_records': ds.num_records,
+                'record_scale': ds.get_record_scale_display() if ds.record_scale else None,
+                'landing_url': ds.landing_url,
+                'keywords': joined(kw.keyword for kw in ds.keywords.all()),
+                'cil': joined(ds.cil.all()),
+                'media_subtype': joined(ds.media_subtype.all()),
+                'data_fields': joined(df.name for df in ds.data_fields.all()),
+                'record_update': ds.record_update,
+                'url': ds.get_absolute_url(),
+                }
+
+    def dats(self, ds):
+        return to_dats(ds)
+
+
+class DUAExport(Export):
+    model = DataUseAgreement
+    columns = ('id', 'duaid', 'title', 'description', 'governance_type', 'publisher', 'scope', 'date_signed',
+               'start_date', 'end_date', 'destruction_required', 'mixing_allowed', 'datasets', 'record_update', 'url')
+
+    def get_queryset(self):
+        return DataUseAgreement.objects.select_related('governance_type', 'publisher'
+                                                       ).prefetch_related(Prefetch('datasets',
+                                                                                   queryset=Dataset.objects.only('pk', 'title')))
+
+    def viewable(self, request):
+        # DUAs are only listed to users with permission to view them
+        if not request.user.has_perm('datacatalog.view_datauseagreement'):
+            raise PermissionDenied
+        return super(DUAExport, self).viewable(request)
+
+    def row(self, dua):
+        return {'id': dua.pk,
+                'duaid': dua.duaid,
+                'title': dua.title,
+                'description': dua.description,
+                'governance_type': dua.governance_type.name if dua.governance_type_id else None,
+                'publisher': dua.publisher.name if dua.publisher_id else None,
+                'scope': dua.get_scope_display() if dua.scope else None,
+                'date_signed': dua.date_signed,
+                'start_date': dua.start_date,
+                'end_date': dua.end_date,
+                'destruction_required': dua.destruction_required,
+                'mixing_allowed': dua.mixing_allowed,
+                'datasets': joined(ds.title for ds in dua.datasets.all()),
+                'record_update': dua.record_update,
+                'url': dua.get_absolute_url(),
+                }
+
+
+class DataAccessExport(Export):
+    model = DataAccess
+    columns = ('id', 'name', 'storage_type', 'unique_id', 'shareable_link', 'filepaths', 'project', 'metadata',
+               'public_data', 'steward_email', 'data_retained', 'record_update', 'url')
+
+    def get_queryset(self):
+        return DataAccess.objects.select_related('storage_type', 'project'
+                                                 ).prefetch_related(Prefetch('metadata',
+                                                                             queryset=Dataset.objects.only('pk', 'title')))
+
+    def viewable(self, request):
+        # only the data access records the user may view, as on the detail pages
+        queryset = super(DataAccessExport, self).viewable(request)
+        return get_permission_resolver(request).viewable(queryset)
+
+    def row(self, da):
+        return {'id': da.pk,
+                'name': da.name,
+                'storage_type': da.storage_type.name if da.storage_type_id else None,
+                'unique_id': da.unique_id,
+                'shareable_link': da.shareable_link,
+                'filepaths': da.filepaths,
+                'project': da.project.name if da.project_id else None,
+                'metadata': joined(ds.title for ds in da.metadata.all()),
+                'public_data': da.public_data,
+                'steward_email': da.steward_email,
+                'data_retained': da.data_retained,
+                'record_update': da.record_update,
+                'url': da.get_absolute_url(),
+                }
+
+
+EXPORTS = {
+    'datasets': DatasetExport(),
+    'duas': DUAExport(),
+    'access': DataAccessExport(),
+}
+
+
+class Echo:
+    """
+    a file-like object for csv.writer that returns each line instead of storing it
+    """
+    def write(self, value):
+        return value
+
+
+def csv_lines(export, objects):
+    writer = csv.DictWriter(Echo(), fieldnames=export.columns)
+    yield writer.writeheader()
+    for obj in objects:
+        yield writer.writerow(export.row(obj))
+
+
+def jsonl_lines(export, objects):
+    for obj in objects:
+        yield json.dumps(export.row(obj), cls=DjangoJSONEncoder) + "\n"
+
+
+def dats_lines(export, objects):
+    for obj in objects:
+        yield json.dumps(export.dats(obj), cls=DjangoJSONEncoder) + "\n"
+
+
+# export formats: (line generator, content type, file extension)
+FORMATS = {
+    'csv': (csv_lines, 'text/csv', 'csv'),
+    'jsonl': (jsonl_lines, 'application/x-ndjson', 'jsonl'),
+    'dats': (dats_lines, 'application/x-ndjson', 'dats.jsonl'),
+}
+
+
+def supports(kind, fmt):
+    """
+    returns True if records of the kind can be exported in the format
+    """
+    return kind in EXPORTS and fmt in FORMATS and (fmt != 'dats' or EXPORTS[kind].dats is not None)
+
+
+def export_lines(kind, fmt, queryset, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    yields the lines of an export of the queryset (as returned by EXPORTS[kind].viewable or
+    get_queryset) in the format
+    """
+    lines, content_type, extension = FORMATS[fmt]
+    return lines(EXPORTS[kind], in_chunks(queryset, chunk_size))
@@ -0,0 +1,158 @@
+import os
+import re
+import zlib
+
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.http import http_date, parse_etags, quote_etag
+
+# size of the blocks read from storage while streaming a byte range
+CHUNK_SIZE = 64 * 1024
+
+RANGE_RE = re.compile(r'^\s*bytes=(\d*)-(\d*)\s*$')
+
+
+def file_etag(name, size, modified):
+    """
+    returns a strong ETag for a stored file, built from its name, size and modification time
+    """
+    stamp = int(modified.timestamp() * 1000000) if modified else 0
+    return quote_etag('{:x}-{:x}-{:x}'.format(zlib.crc32(name.encode()), size, stamp))
+
+
+def parse_range(header, size):
+    """
+    returns the (start, end) byte positions (inclusive) requested by a single-range
+    Range header, None if the header should be ignored, or False if the range cannot
+    be satisfied.
+    """
+    match = RANGE_RE.match(header)
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+
+    if not first:
+        # suffix range: the final n bytes
+        length = int(last)
+        if length == 0:
+            return False
+        return max(size - length, 0), size - 1
+
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def iter_range(fh, start, length):
+    """
+    yields length bytes of the file from start, in blocks of CHUNK_SIZE, closing the
+    file once done.
+    """
+    try:
+        fh.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = fh.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        fh.close()
+
+
+def offload_response(field_file, content_type):
+    """
+    returns an empty response instructing the web server to send the file itself, as set
+    by DATACATALOG_SENDFILE in settings.py:
+        'x-sendfile'       - Apache mod_xsendfile / lighttpd, sent the file's path
+        'x-accel-redirect' - nginx, sent DATACATALOG_SENDFILE_URL + the file's name, which
+                             should map to an internal location aliasing MEDIA_ROOT
+    """
+    mode = getattr(settings, 'DATACATALOG_SENDFILE', None)
+    if not mode:
+        return None
+
+    response = HttpResponse(content_type=content_type)
+    if mode == 'x-sendfile':
+        response['X-Sendfile'] = field_file.storage.path(field_file.name)
+    elif mode == 'x-accel-redirect':
+        prefix = getattr(settings, 'DATACATALOG_SENDFILE_URL', '/protected/')
+        response['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + field_file.name.lstrip('/')
+    else:
+        raise ValueError(f"Unknown DATACATALOG_SENDFILE mode: {mode}")
+    return response
+
+
+def serve_file(request, field_file, content_type, as_attachment=False):
+    """
+    returns a response that streams a model's FileField contents from storage, without
+    reading the whole file into memory. Supports conditional requests (If-None-Match),
+    single byte ranges (Range / If-Range) and, optionally, web server offloading.
+    """
+    if not field_file:
+        raise Http404()
+
+    storage = field_file.storage
+    name = field_file.name
+    try:
+        size = storage.size(name)
+    except (FileNotFoundError, OSError):
+        raise Http404()
+    try:
+        modified = storage.get_modified_time(name)
+    except (NotImplementedError, OSError):
+        modified = None
+
+    etag = file_etag(name, size, modified)
+    filename = os.path.basename(name)
+    disposition = '{}; filename="{}"'.format('attachment' if as_attachment else 'inline', filename)
+
+    # the client's copy is current
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match and (if_none_match.strip() == '*' or etag in parse_etags(if_none_match)):
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        return response
+
+    response = offload_response(field_file, content_type)
+    if response is None:
+        byte_range = None
+        range_header = request.META.get('HTTP_RANGE')
+        if_range = request.META.get('HTTP_IF_RANGE')
+        if range_header and (not if_range or if_range.strip() == etag):
+            byte_range = parse_range(range_header, size)
+
+        if byte_range is False:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+
+        try:
+            fh = storage.open(name, 'rb')
+        except (FileNotFoundError, OSError):
+            raise Http404()
+
+        if byte_range:
+            start, end = byte_range
+            response = StreamingHttpResponse(iter_range(fh, start, end - start + 1),
+                                             status=206,
+                                             content_type=content_type,
+                                             )
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+            response['Content-Length'] = str(end - start + 1)
+        else:
+            response = FileResponse(fh, content_type=content_type)
+            response['Content-Length'] = str(size)
+
+        response['Accept-Ranges'] = 'bytes'
+
+    response['Content-Disposition'] = disposition
+    response['ETag'] = etag
+    if modified:
+        response['Last-Modified'] = http_date(modified.timestamp())
+    return response
@@ -546,6 +546,7 @@ class RetentionInventoryForm(forms.ModelForm):
         self.helper.form_id = 'retentionInventoryForm'
         self.helper.form_method = 'post'
         self.helper.add_input(Submit('submitinventory', 'Upload inventory'))
+        self.fields['inventory'].error_messages['required'] = "No inventory file was uploaded."
         self.helper.layout = Layout(
             Fieldset("",
                      'inventory',
@@ -559,6 +560,13 @@ class RetentionInventoryForm(forms.ModelForm):
                   'inventory',
                   ]
 
+    def clean_inventory(self):
+        # the field is satisfied by a previously attached inventory, but this form is only
+        # submitted to upload a new one
+        if 'inventory' not in self.files:
+            raise forms.ValidationError(self.fields['inventory'].error_messages['required'], code='required')
+        return self.cleaned_data['inventory']
+
 class RetentionWorkflowDataForm(forms.ModelForm):
     def __init__(self, *args, **kwargs):
         super(RetentionWorkflowDataForm, self).__init__(*args, **kwargs)
@@ -0,0 +1,271 @@
+import random
+import secrets
+from datetime import date, timedelta
+
+from django.db import connection
+from django.db.models import Max
+
+from persons.models import Person
+
+from .counters import invalidate_dashboard_counts
+from .models import Keyword, MediaSubType, DataField, ConfidentialityImpact, DataProvider, StorageType
+from .models import Dataset, Project, DataAccess, DataUseAgreement, RetentionRequest
+from .versions import bump_versions
+
+# records generated per dataset, when the sizes of a catalog are derived from its number
+# of datasets (see catalog_sizes)
+DEFAULT_RATIOS = {'keyword': 0.5,
+                  'datafield': 20,
+                  'dataprovider': 0.1,
+                  'person': 0.2,
+                  'project': 0.2,
+                  'dataaccess': 0.5,
+                  'datauseagreement': 0.1,
+                  'retentionrequest': 0.1,
+                  }
+
+# (fewest, most) records linked to each generated record, by many-to-many field
+DEFAULT_FAN_OUT = {'dataset.keywords': (1, 6),
+                   'dataset.data_fields': (5, 40),
+                   'dataset.cil': (1, 2),
+                   'dataset.media_subtype': (1, 3),
+                   'project.other_pis': (0, 2),
+                   'project.other_editors': (0, 4),
+                   'dataaccess.metadata': (1, 3),
+                   'datauseagreement.datasets': (1, 5),
+                   'datauseagreement.users': (2, 10),
+                   'retentionrequest.to_archive': (1, 4),
+                   }
+
+# reference records created only when the database has none
+REFERENCE_SIZES = {'storagetype': 3, 'confidentialityimpact': 4, 'mediasubtype': 20}
+
+PUBLISHED_RATIO = 0.9
+
+# number of distinct modification dates given to the generated records
+DATE_SPREAD = 365
+
+BATCH_SIZE = 2000
+
+WORDS = ('patient', 'cohort', 'clinical', 'genomic', 'imaging', 'survey', 'registry', 'trial', 'outcome',
+         'admission', 'laboratory', 'medication', 'diagnosis', 'procedure', 'billing', 'vital', 'sign',
+         'cardiac', 'oncology', 'pediatric', 'population', 'health', 'claims', 'encounter', 'sequencing',
+         'biomarker', 'longitudinal', 'sample', 'study', 'record', 'visit', 'discharge', 'emergency',
+         'inpatient', 'outpatient', 'pharmacy', 'radiology', 'pathology', 'mortality', 'readmission')
+
+FIRST_NAMES = ('Ana', 'Ben', 'Chen', 'Dara', 'Eli', 'Fatima', 'Gus', 'Hana', 'Ivan', 'Jo', 'Kemal', 'Lia')
+LAST_NAMES = ('Adams', 'Baker', 'Cruz', 'Diaz', 'Evans', 'Fox', 'Gupta', 'Ho', 'Ito', 'Jones', 'Kim', 'Lopez')
+
+
+def catalog_sizes(datasets, ratios=None):
+    """
+    returns the number of records of each generated model (by model name) for a catalog
+    of the given number of datasets
+    """
+    sizes = {'dataset': datasets}
+    for name, ratio in (ratios or DEFAULT_RATIOS).items():
+        sizes[name] = max(1, round(datasets * ratio)) if datasets else 0
+    return sizes
+
+
+class CatalogGenerator:
+    """
+    Generates a synthetic catalog with bulk_create: keywords, data fields, providers,
+    persons, datasets, projects, data accesses, DUAs and retention requests, in the
+    numbers given by sizes (see catalog_sizes), linked according to fan_out, with about
+    PUBLISHED_RATIO of the records published and modification dates spread over
+    DATE_SPREAD days.
+
+    The seed fixes the shape of the catalog (links and flags). Names are prefixed with a
+    random token, so that they do not clash with existing records. If member is given (a
+    Person), they are given a role in every third project, as PI, other PI or editor.
+
+    Records created with bulk_create are not indexed for search, and do not send signals:
+    generate() updates the cache versions and dashboard counts itself, but the search
+    index must be rebuilt afterwards.
+    """
+    def __init__(self, author, sizes, seed=0, fan_out=None, member=None):
+        self.author = author
+        self.sizes = sizes
+        self.random = random.Random(seed)
+        self.fan_out = DEFAULT_FAN_OUT if fan_out is None else fan_out
+        self.member = member
+        self.token = secrets.token_hex(3)
+        self.counts = {}
+
+    def size(self, model):
+        return self.sizes.get(model._meta.model_name, 0)
+
+    def words(self, count):
+        return " ".join(self.random.choice(WORDS) for i in range(count))
+
+    def published(self):
+        return self.random.random() < PUBLISHED_RATIO
+
+    def create(self, model, make, count=None):
+        """
+        creates count records (by default, the size of the model) made by make(i), and
+        returns their primary keys
+        """
+        count = self.size(model) if count is None else count
+        if count <= 0:
+            return []
+        last = model.objects.aggregate(last=Max('pk'))['last'] or 0
+        objects = model.objects.bulk_create((make(i) for i in range(count)), batch_size=BATCH_SIZE)
+        if connection.features.can_return_rows_from_bulk_insert:
+            pks = [obj.pk for obj in objects]
+        else:
+            # the database does not return the new keys: fetch them back
+            pks = list(model.objects.filter(pk__gt=last).order_by('pk').values_list('pk', flat=True))
+        self.counts[model._meta.model_name] = len(pks)
+        return pks
+
+    def reference(self, model, make):
+        """
+        returns the primary keys of the existing records of a reference model, creating
+        them if there are none
+        """
+        pks = list(model.objects.values_list('pk', flat=True))
+        if not pks:
+            pks = self.create(model, make, REFERENCE_SIZES[model._meta.model_name])
+        return pks
+
+    def link(self, model, field_name, sources, targets):
+        """
+        links each of the sources to a random sample of the targets through a many-to-many
+        field, with as many links as the field's fan-out allows
+        """
+        key = f'{model._meta.model_name}.{field_name}'
+        if key not in self.fan_out or not sources or not targets:
+            return
+        fewest, most = self.fan_out[key]
+        field = model._meta.get_field(field_name)
+        through = field.remote_field.through
+        source = through._meta.get_field(field.m2m_field_name()).attname
+        target = through._meta.get_field(field.m2m_reverse_field_name()).attname
+
+        def links():
+            for pk in sources:
+                count = self.random.randint(fewest, min(most, len(targets)))
+                for target_pk in self.random.sample(targets, count):
+                    yield through(**{source: pk, target: target_pk})
+
+        created = through.objects.bulk_create(links(), batch_size=BATCH_SIZE)
+        self.counts[key] = len(created)
+
+    def spread_dates(self, model, pks):
+        """
+        spreads the modification dates of the generated records over DATE_SPREAD days, as
+        in a catalog built up over time (record_update is set to today on creation)
+        """
+        if not pks:
+            return
+        today = date.today()
+        step = max(1, len(pks) // DATE_SPREAD + (len(pks) % DATE_SPREAD > 0))
+        for n, start in enumerate(range(0, len(pks), step)):
+            chunk = pks[start:start + step]
+            model.objects.filter(pk__gte=chunk[0], pk__lte=chunk[-1]
+                                 ).update(record_update=today - timedelta(days=n))
+
+    def generate(self):
+        """
+        generates the catalog, and returns the number of records and links created, by
+        model name and by many-to-many field
+        """
+        author, token, rnd = self.author, self.token, self.random
+
+        storage_types = self.reference(StorageType, lambda i: StorageType(name=f'Storage {token}-{i}',
+                                                                          record_author=author))
+        cils = self.reference(ConfidentialityImpact,
+                              lambda i: ConfidentialityImpact(impact_level=('Low', 'Moderate', 'High', 'Very High')[i],
+                                                              # 1 is the highest risk
+                                                              impact_rank=4 - i,
+                                                              standard='FIPS 199',
+                                                              definition=self.words(12),
+                                                              record_author=author))
+        media_types = self.reference(MediaSubType, lambda i: MediaSubType(name=f'application/x-{token}-{i}'))
+
+        keywords = self.create(Keyword, lambda i: Keyword(keyword=f'{rnd.choice(WORDS)}-{token}-{i}',
+                                                          definition=self.words(10),
+                                                          record_author=author,
+                                                          published=self.published()))
+        fields = self.create(DataField, lambda i: DataField(name=f'{rnd.choice(WORDS)}_{token}_{i}',
+                                                            description=self.words(6),
+                                                            record_author=author))
+        providers = self.create(DataProvider, lambda i: DataProvider(name=f'{self.words(2).title()} {token}-{i}',
+                                                                     record_author=author,
+                                                                     published=self.published()))
+        # DUAs need a contact and a PI
+        person_count = self.size(Person) or (1 if self.size(DataUseAgreement) else 0)
+        persons = self.create(Person, lambda i: Person(first_name=rnd.choice(FIRST_NAMES),
+                                                       last_name=rnd.choice(LAST_NAMES),
+                                                       cwid=f'{token}{i}'),
+                              person_count)
+
+        datasets = self.create(Dataset, lambda i: Dataset(title=f'{self.words(4).capitalize()} {token}-{i}',
+                                                          description=self.words(30),
+                                                          publisher_id=rnd.choice(providers) if providers else None,
+                                                          data_source_id=rnd.choice(providers) if providers else None,
+                                                          num_records=rnd.randint(10, 10 ** 7),
+                                                          record_author=author,
+                                                          published=self.published()))
+        self.link(Dataset, 'keywords', datasets, keywords)
+        self.link(Dataset, 'data_fields', datasets, fields)
+        self.link(Dataset, 'cil', datasets, cils)
+        self.link(Dataset, 'media_subtype', datasets, media_types)
+
+        member = self.member.pk if self.member is not None else None
+
+        def make_project(i):
+            # every third project has the member as PI, other PI or editor, in turn
+            member_is_pi = member is not None and i % 9 == 0
+            return Project(name=f'{self.words(3).capitalize()} {token}-{i}',
+                           description=self.words(20),
+                           pi_id=member if member_is_pi else rnd.choice(persons),
+                           record_author=author)
+
+        projects = self.create(Project, make_project) if persons else []
+        self.link(Project, 'other_pis', projects, persons)
+        self.link(Project, 'other_editors', projects, persons)
+        if member is not None:
+            Project.other_pis.through.objects.bulk_create(
+                [Project.other_pis.through(project_id=pk, person_id=member) for pk in projects[3::9]])
+            Project.other_editors.through.objects.bulk_create(
+                [Project.other_editors.through(project_id=pk, person_id=member) for pk in projects[6::9]])
+
+        accesses = self.create(DataAccess, lambda i: DataAccess(name=f'{self.words(2)} {token}-{i}',
+                                                                storage_type_id=rnd.choice(storage_types),
+                                                                project_id=rnd.choice(projects) if projects else None,
+                                                                record_author=author,
+                                                                published=self.published()))
+        self.link(DataAccess, 'metadata', accesses, datasets)
+
+        duas = self.create(DataUseAgreement, lambda i: DataUseAgreement(duaid=f'DUA-{token}-{i}',
+                                                                        title=f'{self.words(3).capitalize()} {token}-{i}',
+                                                                        publisher_id=rnd.choice(providers),
+                                                                        contact_id=rnd.choice(persons),
+                                                                        pi_id=rnd.choice(persons),
+                                                                        record_author=author,
+                                                                        published=self.published())
+                           ) if providers and persons else []
+        self.link(DataUseAgreement, 'datasets', duas, datasets)
+        self.link(DataUseAgreement, 'users', duas, persons)
+
+        requests = self.create(RetentionRequest, lambda i: RetentionRequest(name=f'{self.words(3)} {token}-{i}',
+                                                                            project_id=(rnd.choice(projects)
+                                                                                        if projects else None),
+                                                                            milestone_pointer=self.words(2),
+                                                                            record_author=author,
+                                                                            verified=rnd.random() < 0.2,
+                                                                            locked=rnd.random() < 0.5))
+        self.link(RetentionRequest, 'to_archive', requests, accesses)
+
+        for model, pks in ((Keyword, keywords), (DataField, fields), (DataProvider, providers), (Dataset, datasets),
+                           (Project, projects), (DataAccess, accesses), (DataUseAgreement, duas),
+                           (RetentionRequest, requests)):
+            self.spread_dates(model, pks)
+
+        bump_versions(Keyword, MediaSubType, DataField, ConfidentialityImpact, DataProvider, StorageType, Dataset,
+                      Project, DataAccess, DataUseAgreement, RetentionRequest, Person)
+        invalidate_dashboard_counts()
+        return self.counts
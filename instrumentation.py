@@ -0,0 +1,182 @@
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+
+logger = logging.getLogger('datacatalog.instrumentation')
+
+STATS_KEY = 'datacatalog:instrumentation:stats'
+
+# the aggregates are kept until they are reset from the stats page
+DEFAULT_STATS_TIMEOUT = None
+
+# number of times the same SQL shape may be run in one request before it is logged as
+# a probable N+1 query
+DEFAULT_REPEAT_THRESHOLD = 10
+
+# number of repeated shapes kept per view for the stats page
+MAX_REPEATED_SHAPES = 5
+
+NUMBER = re.compile(r'\b\d+\b')
+STRING = re.compile(r"'(?:[^']|'')*'")
+PLACEHOLDER_LIST = re.compile(r'\((?:\s*%s\s*,)*\s*%s\s*\)')
+
+
+def repeat_threshold():
+    return getattr(settings, 'DATACATALOG_INSTRUMENTATION_REPEATS', DEFAULT_REPEAT_THRESHOLD)
+
+
+def sql_shape(sql):
+    """
+    returns the SQL with its literals and parameter lists collapsed, so that queries
+    differing only in their values have the same shape
+    """
+    shape = STRING.sub('?', sql)
+    shape = NUMBER.sub('?', shape)
+    return PLACEHOLDER_LIST.sub('(...)', shape)
+
+
+class RequestMetrics:
+    """
+    The queries, SQL time and template render time of one request, recorded by wrapping
+    the execution of queries on every database connection (see InstrumentationMiddleware).
+    """
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.sql_time = 0.0
+        self.shapes = Counter()
+        self.render_started = None
+        self.render_time = None
+
+    @property
+    def query_count(self):
+        return sum(self.shapes.values())
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_time += time.perf_counter() - start
+            self.shapes[sql_shape(sql)] += 1
+
+    def wrap_connections(self):
+        """
+        returns a context manager recording the queries run on every database connection
+        """
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(self))
+        return stack
+
+    def start_render(self, response):
+        self.render_started = time.perf_counter()
+        response.add_post_render_callback(self.end_render)
+
+    def end_render(self, response):
+        self.render_time = time.perf_counter() - self.render_started
+
+    def repeated_shapes(self):
+        """
+        returns the (shape, count) pairs of the queries run more often than the repeat threshold
+        """
+        threshold = repeat_threshold()
+        return [(shape, count) for shape, count in self.shapes.most_common() if count > threshold]
+
+
+def response_size(response):
+    # streamed responses (eg. file downloads) are not read to be measured
+    if response.streaming:
+        return None
+    return len(response.content)
+
+
+def record_request(view_name, request, response, metrics):
+    """
+    logs the metrics of a request, warns of its repeated queries, and adds them to the
+    aggregates of its view
+    """
+    total_time = time.perf_counter() - metrics.started
+    size = response_size(response)
+    repeated = metrics.repeated_shapes()
+
+    logger.info("%s %s (%s): %d %s, %d queries in %.1f ms, render %s, %s bytes, %.1f ms",
+                request.method,
+                request.path,
+                view_name,
+                response.status_code,
+                response.reason_phrase,
+                metrics.query_count,
+                metrics.sql_time * 1000,
+                "-" if metrics.render_time is None else "%.1f ms" % (metrics.render_time * 1000),
+                "-" if size is None else size,
+                total_time * 1000,
+                )
+    for shape, count in repeated:
+        logger.warning("%s %s (%s): query repeated %d times: %s",
+                       request.method, request.path, view_name, count, shape)
+
+    add_to_stats(view_name, metrics, total_time, size, repeated)
+
+
+def add_to_stats(view_name, metrics, total_time, size, repeated):
+    # the aggregates are read and written back without a lock: with several server
+    # processes, a few concurrent requests may go uncounted
+    stats = cache.get(STATS_KEY) or {}
+    view = stats.setdefault(view_name, {'requests': 0,
+                                        'queries': 0,
+                                        'max_queries': 0,
+                                        'sql_time': 0.0,
+                                        'render_time': 0.0,
+                                        'rendered': 0,
+                                        'total_time': 0.0,
+                                        'max_time': 0.0,
+                                        'bytes': 0,
+                                        'sized': 0,
+                                        'repeated': {},
+                                        })
+    view['requests'] += 1
+    view['queries'] += metrics.query_count
+    view['max_queries'] = max(view['max_queries'], metrics.query_count)
+    view['sql_time'] += metrics.sql_time
+    if metrics.render_time is not None:
+        view['render_time'] += metrics.render_time
+        view['rendered'] += 1
+    view['total_time'] += total_time
+    view['max_time'] = max(view['max_time'], total_time)
+    if size is not None:
+        view['bytes'] += size
+        view['sized'] += 1
+    for shape, count in repeated:
+        view['repeated'][shape] = max(view['repeated'].get(shape, 0), count)
+    view['repeated'] = dict(sorted(view['repeated'].items(), key=lambda item: -item[1])[:MAX_REPEATED_SHAPES])
+
+    cache.set(STATS_KEY, stats, getattr(settings, 'DATACATALOG_INSTRUMENTATION_TIMEOUT', DEFAULT_STATS_TIMEOUT))
+
+
+def get_stats():
+    """
+    returns the aggregates of each instrumented view, with their averages, slowest first
+    """
+    rows = []
+    for view_name, view in (cache.get(STATS_KEY) or {}).items():
+        requests = view['requests']
+        rows.append(dict(view,
+                         view_name=view_name,
+                         avg_queries=view['queries'] / requests,
+                         avg_sql_ms=view['sql_time'] * 1000 / requests,
+                         avg_render_ms=view['render_time'] * 1000 / view['rendered'] if view['rendered'] else None,
+                         avg_ms=view['total_time'] * 1000 / requests,
+                         max_ms=view['max_time'] * 1000,
+                         avg_bytes=view['bytes'] / view['sized'] if view['sized'] else None,
+                         ))
+    return sorted(rows, key=lambda row: -row['avg_ms'])
+
+
+def reset_stats():
+    cache.delete(STATS_KEY)
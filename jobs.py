@@ -0,0 +1,161 @@
+import logging
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Job
+from .versions import bump_versions
+
+logger = logging.getLogger('datacatalog.jobs')
+
+# seconds after which a running job is taken to have been abandoned by its worker (eg.
+# after a crash), unless overridden by DATACATALOG_JOB_TIMEOUT in settings.py. It should
+# be longer than the slowest job.
+DEFAULT_JOB_TIMEOUT = 60 * 60
+
+# number of times an abandoned job is started before it is failed, unless overridden by
+# DATACATALOG_JOB_MAX_ATTEMPTS in settings.py
+DEFAULT_MAX_ATTEMPTS = 3
+
+# registered task functions, and the functions cleaning up after their failed jobs, by name
+TASKS = {}
+FAILURE_HANDLERS = {}
+
+
+def task(name, on_failure=None):
+    """
+    decorator registering a function as the task run for jobs with the given name. The
+    function is called with the Job instance and may return a short summary string.
+    on_failure, if given, is called with the Job instance once the job has failed, eg. to
+    remove the files it was given.
+    """
+    def register(func):
+        TASKS[name] = func
+        if on_failure is not None:
+            FAILURE_HANDLERS[name] = on_failure
+        return func
+    return register
+
+
+def enqueue(task_name, description="", payload=None, user=None, data_access=None, retention_request=None,
+            dataset=None):
+    """
+    queues a job for the run_jobs worker and returns it. With DATACATALOG_JOBS_EAGER set
+    in settings.py the job is instead run as soon as the current transaction commits,
+    which is useful in development and tests.
+    """
+    if task_name not in TASKS:
+        raise KeyError(f"No task registered as {task_name}")
+
+    job = Job.objects.create(task=task_name,
+                             description=description,
+                             payload=payload or {},
+                             record_author=user if user is not None and user.is_authenticated else None,
+                             data_access=data_access,
+                             retention_request=retention_request,
+                             dataset=dataset,
+                             )
+    if getattr(settings, 'DATACATALOG_JOBS_EAGER', False):
+        transaction.on_commit(lambda: start_job(job) and run_job(job))
+    return job
+
+
+def start_job(job):
+    """
+    marks a queued job as running, returning False if another worker got to it first
+    """
+    started = timezone.now()
+    claimed = Job.objects.filter(pk=job.pk, status=Job.QUEUED).update(status=Job.RUNNING,
+                                                                      started=started,
+                                                                      attempts=F('attempts') + 1,
+                                                                      )
+    if claimed:
+        bump_versions(Job)
+        job.status = Job.RUNNING
+        job.started = started
+    return bool(claimed)
+
+
+def handle_failure(job):
+    """
+    runs the failure handler registered for the job's task, if any
+    """
+    handler = FAILURE_HANDLERS.get(job.task)
+    if handler is None:
+        return
+    try:
+        handler(job)
+    except Exception:
+        logger.exception("Cleaning up after job %s (%s) failed", job.pk, job.task)
+
+
+def reclaim_stale_jobs():
+    """
+    queues again the jobs left running for longer than DATACATALOG_JOB_TIMEOUT seconds, as
+    after a worker crash, or fails those already started DATACATALOG_JOB_MAX_ATTEMPTS
+    times. Returns the number of jobs queued again and failed.
+    """
+    timeout = getattr(settings, 'DATACATALOG_JOB_TIMEOUT', DEFAULT_JOB_TIMEOUT)
+    max_attempts = getattr(settings, 'DATACATALOG_JOB_MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS)
+    now = timezone.now()
+    stale = Job.objects.filter(status=Job.RUNNING, started__lt=now - timedelta(seconds=timeout))
+
+    requeued = stale.filter(attempts__lt=max_attempts).update(status=Job.QUEUED)
+    failed = 0
+    for job in stale.filter(attempts__gte=max_attempts):
+        error = f"Abandoned by its worker {job.attempts} times"
+        # conditional, so that a job is failed by one worker only
+        if Job.objects.filter(pk=job.pk, status=Job.RUNNING).update(status=Job.FAILED, error=error, finished=now):
+            job.status, job.error, job.finished = Job.FAILED, error, now
+            logger.error("Job %s (%s) failed: %s", job.pk, job.task, error)
+            handle_failure(job)
+            failed += 1
+
+    if requeued:
+        logger.warning("%s abandoned jobs queued again", requeued)
+    if requeued or failed:
+        bump_versions(Job)
+    return requeued, failed
+
+
+def claim_jobs(limit):
+    """
+    claims up to limit queued jobs, oldest first, for the calling worker, after queueing
+    again any abandoned jobs (see reclaim_stale_jobs). Rows locked by other workers are
+    skipped where the database supports it, and each job is claimed with a conditional
+    update so that no job is run twice.
+    """
+    reclaim_stale_jobs()
+    with transaction.atomic():
+        candidates = list(Job.objects.select_for_update(skip_locked=True
+                                                        ).filter(status=Job.QUEUED
+                                                                 ).order_by('pk')[:limit])
+        return [job for job in candidates if start_job(job)]
+
+
+def run_job(job):
+    """
+    runs the task of a claimed job and records its outcome
+    """
+    func = TASKS.get(job.task)
+    try:
+        if func is None:
+            raise KeyError(f"No task registered as {job.task}")
+        result = func(job)
+    except Exception:
+        logger.exception("Job %s (%s) failed", job.pk, job.task)
+        job.status = Job.FAILED
+        job.error = traceback.format_exc()
+    else:
+        job.status = Job.DONE
+        job.result = result or ""
+
+    job.finished = timezone.now()
+    job.save(update_fields=['status', 'result', 'error', 'finished'])
+    if job.status == Job.FAILED:
+        handle_failure(job)
+    return job
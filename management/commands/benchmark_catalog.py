@@ -0,0 +1,111 @@
+import json
+import platform
+
+import django
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.utils import timezone
+
+from datacatalog.benchmark import benchmark_cases, run_case
+from datacatalog.generator import CatalogGenerator, catalog_sizes
+from datacatalog.search import get_search_backend
+from persons.models import Person
+
+# relative slowdown of the median time, compared to a previous report, that is flagged
+SLOWER_RATIO = 1.5
+
+
+class Command(BaseCommand):
+    help = """Time and count the queries of every catalog view (including the search and the autocompletes) as a
+              superuser, and write a JSON report that can be compared with the report of another release.
+              Nothing is kept: the requests are made within a transaction that is rolled back."""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--datasets', type=int, default=0,
+                            help="generate a catalog of this many datasets to benchmark (see generate_catalog), "
+                                 "rather than using the records in the database. Clears the default cache.")
+        parser.add_argument('--seed', type=int, default=0,
+                            help="seed of the generated catalog")
+        parser.add_argument('--repeat', type=int, default=5,
+                            help="number of times each request is repeated after the first")
+        parser.add_argument('--output', help="file the JSON report is written to (by default, standard output)")
+        parser.add_argument('--compare', help="a previous JSON report to compare the results with")
+
+    def handle(self, *args, **options):
+        previous = None
+        if options['compare']:
+            try:
+                with open(options['compare'], encoding='utf-8') as fh:
+                    previous = {result['key']: result for result in json.load(fh)['results']}
+            except (OSError, ValueError, KeyError) as e:
+                raise CommandError(f"Cannot read {options['compare']}: {e}")
+
+        # the test client's requests are made to the 'testserver' host
+        setup_test_environment()
+        try:
+            with transaction.atomic():
+                report = self.benchmark(options)
+                transaction.set_rollback(True)
+        finally:
+            teardown_test_environment()
+            if options['datasets']:
+                # the cached pages and counts of the generated catalog
+                cache.clear()
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as fh:
+                fh.write(output)
+        else:
+            self.stdout.write(output)
+
+        if previous is not None:
+            self.compare(previous, report['results'])
+
+    def benchmark(self, options):
+        user = User.objects.create_superuser(username='catalog-benchmark-user')
+
+        if options['datasets']:
+            cache.clear()
+            member = Person.objects.create(first_name='Catalog', last_name='Benchmark', cwid=user.username)
+            CatalogGenerator(user, catalog_sizes(options['datasets']), seed=options['seed'], member=member).generate()
+            get_search_backend().rebuild()
+
+        # a view that fails is reported with its 500 status
+        client = Client(raise_request_exception=False)
+        client.force_login(user)
+
+        results = []
+        for case in benchmark_cases():
+            result = run_case(client, case, max(0, options['repeat']))
+            results.append(result)
+            self.stderr.write(f"{result['key'][:80]:80} {result['status']} {result['queries']:5} queries "
+                              f"{result['median_ms']:9.2f} ms", style_func=str)
+
+        return {'created': timezone.now().isoformat(),
+                'django': django.get_version(),
+                'python': platform.python_version(),
+                'database': connection.vendor,
+                'repeat': options['repeat'],
+                'catalog': {model._meta.model_name: model.objects.count()
+                            for model in apps.get_app_config('datacatalog').get_models()},
+                'results': results,
+                }
+
+    def compare(self, previous, results):
+        # written with the progress lines, apart from the report
+        self.stderr.write("Changes from the previous report:", style_func=self.style.MIGRATE_HEADING)
+        for result in results:
+            before = previous.get(result['key'])
+            if before is None:
+                self.stderr.write(f"  {result['key'][:80]:80} new", style_func=str)
+                continue
+            line = (f"  {result['key'][:80]:80} {before['queries']:5} -> {result['queries']:5} queries "
+                    f"{before['median_ms']:9.2f} -> {result['median_ms']:9.2f} ms")
+            slower = result['queries'] > before['queries'] or result['median_ms'] > before['median_ms'] * SLOWER_RATIO
+            self.stderr.write(line, style_func=self.style.WARNING if slower else str)
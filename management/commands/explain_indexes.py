@@ -0,0 +1,123 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from datacatalog.generator import CatalogGenerator
+from datacatalog.models import Dataset, DataUseAgreement, DataAccess, Keyword, DataProvider, RetentionRequest
+from datacatalog.pagination import keyset_page
+
+# models whose Meta.indexes are compared
+INDEXED_MODELS = (Keyword, DataProvider, Dataset, DataAccess, DataUseAgreement, RetentionRequest)
+
+
+def published_shapes(model):
+    """
+    the queries run by the catalog lists on a published model: the first and a following
+    keyset page, and the dashboard count
+    """
+    queryset = model.objects.filter(published=True)
+
+    def next_page():
+        first = keyset_page(queryset, 50)
+        return keyset_page(queryset, 50, cursor=first.next_cursor)
+
+    name = model._meta.model_name
+    return [(f"{name}: first page", lambda: keyset_page(queryset, 50)),
+            (f"{name}: next page", next_page),
+            (f"{name}: published count", queryset.count),
+            ]
+
+
+def retention_shapes():
+    ordering = ('record_update', 'pk')
+    return [("retentionrequest: first page",
+             lambda: keyset_page(RetentionRequest.objects.all(), 50, ordering=ordering)),
+            ("retentionrequest: active first page",
+             lambda: keyset_page(RetentionRequest.objects.filter(verified="False"), 50, ordering=ordering)),
+            ("retentionrequest: unlocked count",
+             RetentionRequest.objects.exclude(locked=True).count),
+            ]
+
+
+class Command(BaseCommand):
+    help = """Compare the query plans and timings of the catalog's list queries with and without the
+              published/record_update indexes, on generated records. Nothing is kept: the records are
+              created and the indexes dropped within a transaction that is rolled back."""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100000,
+                            help="number of records generated for each model")
+        parser.add_argument('--repeat', type=int, default=20,
+                            help="number of times each query is timed")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.seed(max(1, options['rows']))
+            self.analyze()
+
+            shapes = [s for model in INDEXED_MODELS[:-1] for s in published_shapes(model)] + retention_shapes()
+
+            self.set_indexes(drop=True)
+            before = self.report("Without indexes", shapes, options['repeat'])
+            self.set_indexes(drop=False)
+            after = self.report("With indexes", shapes, options['repeat'])
+
+            self.stdout.write(self.style.MIGRATE_HEADING("Summary (ms per query)"))
+            for label, _ in shapes:
+                self.stdout.write(f"  {label:45} {before[label]:9.2f} -> {after[label]:9.2f}")
+
+            transaction.set_rollback(True)
+
+    def seed(self, rows):
+        """
+        generates rows records of each indexed model (see generator.py), without the
+        links between them, which the compared queries do not use
+        """
+        user = User.objects.create(username='explain-indexes-user')
+        self.stdout.write(f"Generating {rows} records per model...")
+        sizes = {model._meta.model_name: rows for model in INDEXED_MODELS}
+        # DUAs need a contact and a PI
+        sizes['person'] = max(1, rows // 100)
+        CatalogGenerator(user, sizes, fan_out={}).generate()
+
+    def analyze(self):
+        # refresh the planner statistics for the generated rows
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def set_indexes(self, drop):
+        editor = connection.schema_editor()
+        for model in INDEXED_MODELS:
+            for index in model._meta.indexes:
+                sql = index.remove_sql(model, editor) if drop else index.create_sql(model, editor)
+                if sql is not None:
+                    editor.execute(sql)
+        self.analyze()
+
+    def report(self, heading, shapes, repeat):
+        self.stdout.write(self.style.MIGRATE_HEADING(heading))
+        timings = {}
+        for label, run in shapes:
+            queries = []
+
+            def record(execute, sql, params, many, context):
+                queries.append((sql, params))
+                return execute(sql, params, many, context)
+
+            with connection.execute_wrapper(record):
+                run()
+            start = time.perf_counter()
+            for i in range(repeat):
+                run()
+            timings[label] = (time.perf_counter() - start) * 1000 / repeat
+
+            self.stdout.write(self.style.SUCCESS(f"{label} ({timings[label]:.2f} ms)"))
+            # the plan of the query that returned the rows (the last one run)
+            sql, params = queries[-1]
+            with connection.cursor() as cursor:
+                cursor.execute(f"{connection.ops.explain_query_prefix()} {sql}", params)
+                for row in cursor.fetchall():
+                    self.stdout.write("    " + " ".join(str(col) for col in row))
+        return timings
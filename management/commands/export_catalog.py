@@ -0,0 +1,34 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from datacatalog.export import DEFAULT_CHUNK_SIZE, EXPORTS, FORMATS, export_lines, supports
+
+
+class Command(BaseCommand):
+    help = "Export datasets, DUAs or data access records as CSV, JSON-lines or DATS JSON-lines"
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(EXPORTS))
+        parser.add_argument('--format', default='jsonl', choices=sorted(FORMATS))
+        parser.add_argument('--output', '-o', help="file to write to (default: standard output)")
+        parser.add_argument('--all', action='store_true', help="include unpublished records")
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                            help="number of records loaded from the database at a time")
+
+    def handle(self, *args, **options):
+        kind, fmt = options['kind'], options['format']
+        if not supports(kind, fmt):
+            raise CommandError(f"{kind} cannot be exported as {fmt}")
+
+        queryset = EXPORTS[kind].get_queryset()
+        if not options['all']:
+            queryset = queryset.filter(published=True)
+
+        out = open(options['output'], 'w', encoding='utf-8', newline='') if options['output'] else sys.stdout
+        try:
+            for line in export_lines(kind, fmt, queryset, chunk_size=max(1, options['chunk_size'])):
+                out.write(line)
+        finally:
+            if out is not sys.stdout:
+                out.close()
@@ -0,0 +1,44 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from datacatalog.generator import CatalogGenerator, catalog_sizes
+from datacatalog.permissions import person_id_for
+from datacatalog.search import get_search_backend
+from persons.models import Person
+
+
+class Command(BaseCommand):
+    help = """Generate a synthetic catalog for load testing: datasets, with keywords, data fields, providers, persons,
+              projects, data accesses, DUAs and retention requests in proportion to them"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--datasets', type=int, default=1000,
+                            help="number of datasets generated; the other records are generated in proportion")
+        parser.add_argument('--user', required=True,
+                            help="username recorded as the author of the generated records, and given a role in "
+                                 "some of the generated projects if they have a person record")
+        parser.add_argument('--seed', type=int, default=0,
+                            help="seed fixing the links and flags of the generated records")
+        parser.add_argument('--no-index', action='store_true',
+                            help="do not rebuild the search index after generating")
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f"No user {options['user']}")
+
+        member = Person.objects.filter(pk=person_id_for(user.username)).first()
+        generator = CatalogGenerator(user, catalog_sizes(max(0, options['datasets'])),
+                                     seed=options['seed'], member=member)
+        with transaction.atomic():
+            counts = generator.generate()
+
+        # bulk inserts bypass the signals that maintain the search index
+        if not options['no_index']:
+            get_search_backend().rebuild()
+
+        for name, count in counts.items():
+            self.stdout.write(f"  {name:30} {count:9}")
+        self.stdout.write(self.style.SUCCESS(f"Catalog generated with prefix {generator.token}"))
@@ -0,0 +1,49 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from datacatalog.counters import invalidate_dashboard_counts
+from datacatalog.dats import BATCH_SIZE, DATSImporter, read_jsonl
+from datacatalog.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = "Import datasets from a DATS 2.2 JSON-lines file (one Dataset object per line)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="the JSON-lines file to import")
+        parser.add_argument('--user', required=True,
+                            help="username recorded as the author of the imported records")
+        parser.add_argument('--update', action='store_true',
+                            help="update datasets that already exist (matched on ID, then title) instead of skipping them")
+        parser.add_argument('--publish', action='store_true',
+                            help="publish the imported datasets immediately")
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                            help="number of records written in each transaction")
+        parser.add_argument('--no-index', action='store_true',
+                            help="do not rebuild the search index after importing")
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f"No user {options['user']}")
+
+        importer = DATSImporter(user,
+                                update=options['update'],
+                                publish=options['publish'],
+                                batch_size=max(1, options['batch_size']),
+                                )
+        try:
+            with open(options['path'], encoding='utf-8') as fh:
+                for stats in importer.run(read_jsonl(fh)):
+                    self.stdout.write("{created} created, {updated} updated, "
+                                      "{skipped} skipped, {rejected} rejected".format(**stats))
+        finally:
+            # bulk inserts bypass the signals that maintain these
+            invalidate_dashboard_counts()
+            if not options['no_index'] and (importer.stats['created'] or importer.stats['updated']):
+                get_search_backend().rebuild()
+
+        for line_number, message in importer.errors:
+            self.stdout.write(self.style.WARNING(f"line {line_number}: {message}"))
+        self.stdout.write(self.style.SUCCESS("{created} datasets created, {updated} updated".format(**importer.stats)))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from datacatalog.dictionary import DictionaryError, import_dictionary
+from datacatalog.models import Dataset
+
+
+class Command(BaseCommand):
+    help = "Parse uploaded data dictionaries into the data fields of their datasets"
+
+    def add_arguments(self, parser):
+        parser.add_argument('pks', nargs='*', type=int,
+                            help="primary keys of the datasets to parse (default: all with a data dictionary)")
+
+    def handle(self, *args, **options):
+        datasets = Dataset.objects.exclude(data_dictionary='').exclude(data_dictionary__isnull=True)
+        if options['pks']:
+            datasets = datasets.filter(pk__in=options['pks'])
+
+        for dataset in datasets.select_related('record_author').order_by('pk'):
+            try:
+                read, created = import_dictionary(dataset)
+            except DictionaryError as e:
+                self.stdout.write(self.style.WARNING(f"{dataset.pk}: {e}"))
+            else:
+                self.stdout.write(self.style.SUCCESS(f"{dataset.pk}: {read} fields read, {created} new"))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from datacatalog.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text search index used by the catalog search page"
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        backend.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Search index rebuilt using {backend.__class__.__name__}"))
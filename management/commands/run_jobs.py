@@ -0,0 +1,56 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from datacatalog import tasks  # noqa: F401 registers the task functions
+from datacatalog.jobs import claim_jobs, run_job
+
+
+def run_in_thread(job):
+    try:
+        return run_job(job)
+    finally:
+        # each pool thread holds its own database connection
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = "Run queued background jobs (file uploads, inventories, archiving)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4,
+                            help="number of jobs run concurrently by this process")
+        parser.add_argument('--interval', type=float, default=2.0,
+                            help="seconds to wait before polling again when the queue is empty")
+        parser.add_argument('--once', action='store_true',
+                            help="exit once the queue is empty instead of polling")
+
+    def handle(self, *args, **options):
+        workers = max(1, options['workers'])
+        running = set()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            while True:
+                # a job is claimed for each free worker, so that a slow job does not hold
+                # back the ones queued after it
+                idle = workers - len(running)
+                if idle:
+                    jobs = claim_jobs(idle)
+                    running.update(executor.submit(run_in_thread, job) for job in jobs)
+                    idle -= len(jobs)
+
+                if not running:
+                    if options['once']:
+                        break
+                    time.sleep(options['interval'])
+                    continue
+
+                # with workers left idle the queue is polled again after the interval,
+                # otherwise as soon as a job finishes
+                done, running = wait(running, timeout=options['interval'] if idle else None,
+                                     return_when=FIRST_COMPLETED)
+                for future in done:
+                    job = future.result()
+                    style = self.style.SUCCESS if job.status == job.DONE else self.style.ERROR
+                    self.stdout.write(style(f"{job}"))
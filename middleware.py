@@ -0,0 +1,46 @@
+from django.utils.functional import SimpleLazyObject
+
+from .instrumentation import RequestMetrics, record_request
+from .permissions import get_person
+
+
+class PersonMiddleware:
+    """
+    Sets request.person to the logged in user's Person record, or None, looked up on
+    first use (see permissions.get_person). Add it after AuthenticationMiddleware.
+    As with request.user, test the record with `if request.person`, not `is None`.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.person = SimpleLazyObject(lambda: get_person(request))
+        return self.get_response(request)
+
+
+class InstrumentationMiddleware:
+    """
+    Records the number of queries, SQL time, template render time and response size of
+    every request to a datacatalog view, logs them to the 'datacatalog.instrumentation'
+    logger (with a warning for each query repeated more than DATACATALOG_INSTRUMENTATION_REPEATS
+    times), and adds them to the aggregates shown on the stats page (see instrumentation.py).
+    Place it first in MIDDLEWARE to include the time spent in the other middleware.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics = RequestMetrics()
+        request._datacatalog_metrics = metrics
+        with metrics.wrap_connections():
+            response = self.get_response(request)
+
+        match = getattr(request, 'resolver_match', None)
+        if match is not None and 'datacatalog' in match.app_names:
+            record_request(match.view_name, request, response, metrics)
+        return response
+
+    def process_template_response(self, request, response):
+        # called just before a TemplateResponse is rendered
+        request._datacatalog_metrics.start_render(response)
+        return response
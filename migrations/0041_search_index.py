@@ -0,0 +1,64 @@
+from django.db import migrations
+
+# searchable fields of each model, as used by datacatalog.search
+SEARCH_FIELDS = (
+    ('Dataset', 'datacatalog_dataset_search', ('ds_id', 'title', 'description', 'comments')),
+    ('DataUseAgreement', 'datacatalog_dua_search', ('duaid', 'title', 'description')),
+    ('Keyword', 'datacatalog_keyword_search', ('keyword', 'definition')),
+    ('DataField', 'datacatalog_datafield_search', ('name', 'description')),
+)
+
+FTS_TABLE = 'datacatalog_search_fts'
+
+
+def postgres_indexes(apps):
+    from django.contrib.postgres.indexes import GinIndex
+    from django.contrib.postgres.search import SearchVector
+
+    for model_name, index_name, fields in SEARCH_FIELDS:
+        model = apps.get_model('datacatalog', model_name)
+        yield model, GinIndex(SearchVector(*fields, config='english'), name=index_name)
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        for model, index in postgres_indexes(apps):
+            schema_editor.add_index(model, index)
+
+    elif vendor == 'sqlite':
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+            if not cursor.fetchone()[0]:
+                return
+
+        schema_editor.execute(f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(body)")
+
+        # populate the index; rowids encode the model position and the primary key
+        for position, (model_name, index_name, fields) in enumerate(SEARCH_FIELDS):
+            model = apps.get_model('datacatalog', model_name)
+            body = " || ' ' || ".join(f"COALESCE({f}, '')" for f in fields)
+            schema_editor.execute(f"INSERT INTO {FTS_TABLE} (rowid, body) "
+                                  f"SELECT id * {len(SEARCH_FIELDS)} + {position}, {body} "
+                                  f"FROM {model._meta.db_table}")
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        for model, index in postgres_indexes(apps):
+            schema_editor.remove_index(model, index)
+
+    elif vendor == 'sqlite':
+        schema_editor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datacatalog', '0040_auto_20220614_1748'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,25 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datacatalog', '0041_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchiveFile',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('record_creation', models.DateField(auto_now_add=True)),
+                ('name', models.CharField(max_length=255)),
+                ('path', models.CharField(max_length=512)),
+                ('size', models.BigIntegerField()),
+                ('sha256', models.CharField(db_index=True, max_length=64)),
+                ('data_access', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archive_files', to='datacatalog.dataaccess')),
+                ('duplicate_of', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='duplicates', to='datacatalog.archivefile')),
+            ],
+        ),
+    ]
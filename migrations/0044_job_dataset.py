@@ -0,0 +1,17 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datacatalog', '0043_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='dataset',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='jobs', to='datacatalog.dataset'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datacatalog', '0044_job_dataset'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='keyword',
+            index=models.Index(condition=models.Q(('published', True)), fields=['-record_update', '-id'], name='datacatalog_keyword_pub_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='dataprovider',
+            index=models.Index(condition=models.Q(('published', True)), fields=['-record_update', '-id'], name='datacatalog_provider_pub_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='dataset',
+            index=models.Index(condition=models.Q(('published', True)), fields=['-record_update', '-id'], name='datacatalog_dataset_pub_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='dataaccess',
+            index=models.Index(condition=models.Q(('published', True)), fields=['-record_update', '-id'], name='datacatalog_access_pub_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='datauseagreement',
+            index=models.Index(condition=models.Q(('published', True)), fields=['-record_update', '-id'], name='datacatalog_dua_pub_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='retentionrequest',
+            index=models.Index(fields=['record_update', 'id'], name='datacatalog_retention_upd_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='retentionrequest',
+            index=models.Index(condition=models.Q(('verified', False)), fields=['record_update', 'id'], name='datacatalog_retention_ver_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='retentionrequest',
+            index=models.Index(fields=['locked', 'record_update'], name='datacatalog_retention_lck_idx'),
+        ),
+    ]
@@ -0,0 +1,65 @@
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations, models
+
+# columns searched by the autocomplete views on the larger tables, as used by
+# datacatalog.typeahead. On PostgreSQL each has a pg_trgm index, which serves both
+# substring and prefix matches; elsewhere a case-insensitive index for prefix matches.
+AUTOCOMPLETE_FIELDS = (
+    ('Dataset', 'title', 'datacatalog_dataset_title_ac'),
+    ('Dataset', 'ds_id', 'datacatalog_dataset_dsid_ac'),
+    ('DataProvider', 'name', 'datacatalog_provider_name_ac'),
+    ('DataAccess', 'name', 'datacatalog_access_name_ac'),
+    ('DataUseAgreement', 'duaid', 'datacatalog_dua_duaid_ac'),
+    ('DataUseAgreement', 'title', 'datacatalog_dua_title_ac'),
+    ('Keyword', 'keyword', 'datacatalog_keyword_ac'),
+    ('DataField', 'name', 'datacatalog_datafield_name_ac'),
+    ('DataField', 'description', 'datacatalog_datafield_desc_ac'),
+)
+
+
+def autocomplete_indexes(apps):
+    for model_name, field, index_name in AUTOCOMPLETE_FIELDS:
+        model = apps.get_model('datacatalog', model_name)
+        yield model, field, index_name, model._meta.db_table, model._meta.get_field(field).column
+
+
+def create_autocomplete_indexes(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        # matches the UPPER(column::text) LIKE UPPER(...) of icontains and istartswith
+        for model, field, name, table, column in autocomplete_indexes(apps):
+            schema_editor.execute(f'CREATE INDEX "{name}" ON "{table}" '
+                                  f'USING gin ((UPPER("{column}"::text)) gin_trgm_ops)')
+
+    elif vendor == 'sqlite':
+        # LIKE is case-insensitive in SQLite, and can only use an index with the NOCASE collation
+        for model, field, name, table, column in autocomplete_indexes(apps):
+            schema_editor.execute(f'CREATE INDEX "{name}" ON "{table}" '
+                                  f'("{column}" COLLATE NOCASE)')
+
+    else:
+        # eg. MySQL, where the default collations are case-insensitive
+        for model, field, name, table, column in autocomplete_indexes(apps):
+            schema_editor.add_index(model, models.Index(fields=[field], name=name))
+
+
+def drop_autocomplete_indexes(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    for model, field, name, table, column in autocomplete_indexes(apps):
+        if vendor in ('postgresql', 'sqlite'):
+            schema_editor.execute(f'DROP INDEX IF EXISTS "{name}"')
+        else:
+            schema_editor.remove_index(model, models.Index(fields=[field], name=name))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datacatalog', '0045_published_indexes'),
+    ]
+
+    operations = [
+        # only runs on PostgreSQL, and only creates the extension if it is not installed yet
+        TrigramExtension(),
+        migrations.RunPython(create_autocomplete_indexes, drop_autocomplete_indexes),
+    ]
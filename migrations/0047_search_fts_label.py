@@ -0,0 +1,59 @@
+from django.db import migrations
+
+# searchable fields of each model, as used by datacatalog.search, with the label of
+# each model in the search results
+SEARCH_FIELDS = (
+    ('Dataset', 'dataset', ('ds_id', 'title', 'description', 'comments')),
+    ('DataUseAgreement', 'dua', ('duaid', 'title', 'description')),
+    ('Keyword', 'keyword', ('keyword', 'definition')),
+    ('DataField', 'datafield', ('name', 'description')),
+)
+
+FTS_TABLE = 'datacatalog_search_fts'
+
+
+def rebuild_fts_table(apps, schema_editor, with_label):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    if FTS_TABLE not in schema_editor.connection.introspection.table_names():
+        # SQLite was compiled without FTS5, see migration 0041
+        return
+
+    schema_editor.execute(f"DROP TABLE {FTS_TABLE}")
+    if with_label:
+        schema_editor.execute(f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(body, label UNINDEXED)")
+    else:
+        schema_editor.execute(f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(body)")
+
+    # populate the index; rowids encode the model position and the primary key
+    for position, (model_name, label, fields) in enumerate(SEARCH_FIELDS):
+        model = apps.get_model('datacatalog', model_name)
+        body = " || ' ' || ".join(f"COALESCE({f}, '')" for f in fields)
+        if with_label:
+            schema_editor.execute(f"INSERT INTO {FTS_TABLE} (rowid, body, label) "
+                                  f"SELECT id * {len(SEARCH_FIELDS)} + {position}, {body}, '{label}' "
+                                  f"FROM {model._meta.db_table}")
+        else:
+            schema_editor.execute(f"INSERT INTO {FTS_TABLE} (rowid, body) "
+                                  f"SELECT id * {len(SEARCH_FIELDS)} + {position}, {body} "
+                                  f"FROM {model._meta.db_table}")
+
+
+def add_label_column(apps, schema_editor):
+    # the label lets each model be ranked by a query of its own
+    rebuild_fts_table(apps, schema_editor, True)
+
+
+def remove_label_column(apps, schema_editor):
+    rebuild_fts_table(apps, schema_editor, False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datacatalog', '0046_autocomplete_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_label_column, remove_label_column),
+    ]
@@ -1,7 +1,8 @@
 import datetime
 from datetime import date
 
-from django.db import models
+from django.db import models, transaction
+from django.db.models.functions import Coalesce
 
 from django.urls import reverse
 
@@ -9,6 +10,8 @@ from django.contrib.auth.models import User
 
 from persons.models import Person, Department, Organization, Role 
 
+from .versions import bump_versions
+
 
 def dictionary_directory_path(instance, filename):
     """
@@ -69,6 +72,13 @@ class Keyword(models.Model):
     # field to designate whether data should be published
     published = models.BooleanField(null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            # published records, newest first: the catalog lists and their keyset pages
+            models.Index(fields=['-record_update', '-id'], condition=models.Q(published=True),
+                         name='datacatalog_keyword_pub_idx'),
+        ]
+
     def __str__(self):
         return "{}".format(self.keyword,)
 
@@ -208,6 +218,41 @@ class ConfidentialityImpact(models.Model):
         return reverse('datacatalog:cil-view', kwargs={'pk': self.pk})
     
 
+class DataProviderQuerySet(models.QuerySet):
+    """
+    Queryset methods shared by the views that list data providers.
+    """
+    @staticmethod
+    def published_datasets(field_name):
+        """
+        the published datasets whose field_name (data_source or publisher) is the provider
+        of the outer query
+        """
+        return Dataset.objects.filter(published=True, **{field_name: models.OuterRef('pk')}).order_by()
+
+    def with_published_counts(self):
+        """
+        annotates each provider with the number of published datasets it is the source
+        (published_source_count) and the publisher (published_publisher_count) of,
+        computed in the same query as the providers themselves. Each count is a subquery
+        of its own, rather than a Count() over the joins of both relations.
+        """
+        counts = {}
+        for name, field_name in (('published_source_count', 'data_source'),
+                                 ('published_publisher_count', 'publisher')):
+            count = self.published_datasets(field_name).values(field_name
+                                                               ).annotate(count=models.Count('pk')).values('count')
+            counts[name] = Coalesce(models.Subquery(count, output_field=models.IntegerField()), 0)
+        return self.annotate(**counts)
+
+    def with_published_datasets(self):
+        """
+        filters the providers that are the source or the publisher of a published dataset
+        """
+        return self.filter(models.Exists(self.published_datasets('data_source')) |
+                           models.Exists(self.published_datasets('publisher')))
+
+
 class DataProvider(models.Model):
     """
     This class defines data providers.
@@ -259,6 +304,15 @@ class DataProvider(models.Model):
     # field to designate whether data should be published
     published = models.BooleanField(null=True, blank=True)
 
+    objects = DataProviderQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # published records, newest first: the catalog lists and their keyset pages
+            models.Index(fields=['-record_update', '-id'], condition=models.Q(published=True),
+                         name='datacatalog_provider_pub_idx'),
+        ]
+
     def __str__(self):
         return "{}".format(self.name,)
 
@@ -293,6 +347,46 @@ class StorageType(models.Model):
         return "{}".format(self.name)
 
 
+class DatasetQuerySet(models.QuerySet):
+    """
+    Queryset methods shared by the views that list datasets.
+    """
+    def for_listing(self):
+        """
+        restricts the query to the columns shown in dataset listings (table_datasets.html
+        and index.html), and fetches publishers and keywords in bulk, so that a listing
+        costs the same number of queries however many datasets it shows.
+        """
+        keywords = models.Prefetch('keywords', queryset=Keyword.objects.only('pk', 'keyword'))
+        return self.select_related('publisher'
+                                   ).prefetch_related(keywords
+                                                      ).only('title',
+                                                             'description',
+                                                             'period_start',
+                                                             'period_end',
+                                                             'published',
+                                                             'record_update',
+                                                             'publisher',
+                                                             'publisher__name',
+                                                             )
+
+    def for_metadata(self):
+        """
+        fetches the related records shown in table_metadata.html in bulk, so that a page
+        showing the metadata of several datasets (eg. detail_access.html) costs the same
+        number of queries however many datasets it shows.
+        """
+        return self.select_related('expert',
+                                   'data_source',
+                                   ).prefetch_related('cil',
+                                                      'media_subtype',
+                                                      models.Prefetch('keywords',
+                                                                      queryset=Keyword.objects.only('pk',
+                                                                                                    'keyword',
+                                                                                                    'definition')),
+                                                      )
+
+
 class Dataset(models.Model):
     """
     Each instance of Dataset defines a single collection of data. The minimum unit of a
@@ -493,6 +587,8 @@ class Dataset(models.Model):
     # provide a direct link between related datasets, allowing for smart subsetting of projects or data models
     linked_data = models.ManyToManyField("self")
 
+    objects = DatasetQuerySet.as_manager()
+
     def viewing_is_permitted(self, request):
         """
         checks viewing permission of instance against restricted field, and the logged in user via requests
@@ -509,6 +605,13 @@ class Dataset(models.Model):
         else:
             return False
 
+    class Meta:
+        indexes = [
+            # published records, newest first: the catalog lists and their keyset pages
+            models.Index(fields=['-record_update', '-id'], condition=models.Q(published=True),
+                         name='datacatalog_dataset_pub_idx'),
+        ]
+
     def __str__(self):
         return "{}".format(self.title)
 
@@ -516,6 +619,36 @@ class Dataset(models.Model):
         return reverse('datacatalog:dataset-view', kwargs={'pk': self.pk})
 
 
+class ProjectQuerySet(models.QuerySet):
+    """
+    Queryset methods shared by the views that list a user's projects.
+    """
+    def for_member(self, person):
+        """
+        restricts the query to the projects of a person (a Person or its primary key), and
+        annotates each with the person's roles in it (is_pi, is_other_pi, is_other_editor),
+        all in a single query.
+        """
+        other_pis = Project.other_pis.through.objects.filter(project=models.OuterRef('pk'), person=person)
+        other_editors = Project.other_editors.through.objects.filter(project=models.OuterRef('pk'), person=person)
+        return self.annotate(is_pi=models.ExpressionWrapper(models.Q(pi=person), output_field=models.BooleanField()),
+                             is_other_pi=models.Exists(other_pis),
+                             is_other_editor=models.Exists(other_editors),
+                             ).filter(models.Q(is_pi=True) | models.Q(is_other_pi=True) | models.Q(is_other_editor=True))
+
+    def for_cards(self):
+        """
+        fetches the data locations (with their storage types) and the retention requests
+        (see RetentionRequestQuerySet.for_listing) of the projects in bulk, for
+        carddeck_projects.html and table_retention_requests.html.
+        """
+        data_accesses = models.Prefetch('dataaccess_set',
+                                        queryset=DataAccess.objects.select_related('storage_type').order_by('pk'))
+        retention_requests = models.Prefetch('retentionrequest_set',
+                                             queryset=RetentionRequest.objects.for_listing().order_by('pk'))
+        return self.prefetch_related(data_accesses, retention_requests)
+
+
 class Project(models.Model):
     """
     The Project model allows aggregation of multiple datasets together under a common
@@ -571,22 +704,16 @@ class Project(models.Model):
     # expected date of project completion
     completion = models.DateField(null=True, blank=True, help_text="expected completion date of project",)
 
+    objects = ProjectQuerySet.as_manager()
+
     def viewing_is_permitted(self, request):
         """
         checks viewing permission of instance against restricted field, and the logged in user via requests
         and returns True if the model instance is viewable by the user.
         """
-        user = getattr(request, 'user', None)
-        if user.has_perm('datacatalog.view_project'):
-            return True
-        elif user.username == self.pi.cwid:
-            return True
-        elif self.other_pis.filter(cwid=user.username).exists():
-            return True
-        elif self.other_editors.filter(cwid=user.username).exists():
-            return True
-        else:
-            return False
+        # permissions are resolved once per request, see permissions.PermissionResolver
+        from .permissions import get_permission_resolver
+        return get_permission_resolver(request).can_view(self)
 
     def __str__(self):
         return "{}".format(self.name)
@@ -595,6 +722,32 @@ class Project(models.Model):
         return reverse('datacatalog:project-view', kwargs={'pk': self.pk})
 
 
+def link_count(field, outer='pk'):
+    """
+    a subquery counting the links of each record through a many-to-many field, for
+    annotating lists of records. Unlike Count(), it counts every link whatever the
+    filters and joins of the annotated query.
+    """
+    through = field.remote_field.through
+    source = field.m2m_field_name()
+    counts = through.objects.filter(**{source: models.OuterRef(outer)}
+                                    ).order_by().values(source).annotate(count=models.Count('pk')).values('count')
+    return Coalesce(models.Subquery(counts, output_field=models.IntegerField()), 0)
+
+
+class DataAccessQuerySet(models.QuerySet):
+    """
+    Queryset methods shared by the lists of data locations.
+    """
+    def with_request_flags(self):
+        """
+        annotates each data location with whether it is part of any retention request
+        (has_retention_requests), used by is_requested()
+        """
+        requests = RetentionRequest.to_archive.through.objects.filter(dataaccess=models.OuterRef('pk'))
+        return self.annotate(has_retention_requests=models.Exists(requests))
+
+
 class DataAccess(models.Model):
     """
     This class defines the processes and information required in order to gain access
@@ -721,6 +874,15 @@ class DataAccess(models.Model):
     # access to view
     restricted = models.ManyToManyField(Person, related_name='restricted_access', )
 
+    objects = DataAccessQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # published records, newest first: the catalog lists and their keyset pages
+            models.Index(fields=['-record_update', '-id'], condition=models.Q(published=True),
+                         name='datacatalog_access_pub_idx'),
+        ]
+
     def __str__(self):
         return "{}".format(self.name)
 
@@ -732,27 +894,52 @@ class DataAccess(models.Model):
         checks viewing permission of instance against restricted field, and the logged in user via requests
         and returns True if the model instance is viewable by the user.
         """
-        user = getattr(request, 'user', None)
-        if user.has_perm('datacatalog.view_dataaccess'):
-            return True
-        elif user.username == self.project.pi.cwid:
-            return True
-        elif self.project.other_pis.filter(cwid=user.username).exists():
-            return True
-        elif self.project.other_editors.filter(cwid=user.username).exists():
-            return True
-        elif self.public:
-            return True
-        elif self.restricted.filter(cwid=user.username).exists():
-            return True
-        else:
-            return False
+        # permissions are resolved once per request, see permissions.PermissionResolver
+        from .permissions import get_permission_resolver
+        return get_permission_resolver(request).can_view(self)
 
     def is_requested(self):
-        if self.retention_requests.count() > 0:
-            return True
-        else:
-            return False
+        # annotated on the records of lists, see DataAccessQuerySet.with_request_flags
+        if hasattr(self, 'has_retention_requests'):
+            return self.has_retention_requests
+        return self.retention_requests.exists()
+
+
+class ArchiveFile(models.Model):
+    """
+    A file uploaded for archiving through the multifiles field of a DataAccess record.
+    Together these records form the manifest of uploaded files, with the size and SHA-256
+    checksum of each. Where identical content was already stored, the upload is not kept
+    and the record points to the stored copy instead (see uploads.store_uploads).
+    """
+    # date the record was created
+    record_creation = models.DateField(auto_now_add=True)
+
+    # the data location the file was uploaded to
+    data_access = models.ForeignKey(DataAccess, on_delete=models.CASCADE, related_name='archive_files')
+
+    # name of the file as uploaded
+    name = models.CharField(max_length=255)
+
+    # name of the stored file within the default storage
+    path = models.CharField(max_length=512)
+
+    # size of the file in bytes
+    size = models.BigIntegerField()
+
+    # hex digest of the SHA-256 checksum of the file contents
+    sha256 = models.CharField(max_length=64, db_index=True)
+
+    # the previously uploaded file holding identical content, if any
+    duplicate_of = models.ForeignKey('self',
+                                     null=True,
+                                     blank=True,
+                                     on_delete=models.SET_NULL,
+                                     related_name='duplicates',
+                                     )
+
+    def __str__(self):
+        return "{}".format(self.path)
 
 
 class GovernanceType(models.Model):
@@ -782,6 +969,18 @@ class GovernanceType(models.Model):
         return "{}".format(self.name)
        
 
+class DataUseAgreementQuerySet(models.QuerySet):
+    """
+    Queryset methods shared by the views that list DUAs.
+    """
+    def for_listing(self):
+        """
+        fetches the publisher and the number of datasets (dataset_count) of each DUA with
+        the DUAs themselves, for table_duas.html.
+        """
+        return self.select_related('publisher').annotate(dataset_count=link_count(DataUseAgreement.datasets.field))
+
+
 class DataUseAgreement(models.Model):
     """
     The Datauseagreement model defines all the governance attributes of a single DUA 
@@ -914,7 +1113,16 @@ class DataUseAgreement(models.Model):
     # specify the users who have access. If none specified, then all users have
     # access to view
     restricted = models.ManyToManyField(Person, related_name='restricted_dua')
+
+    objects = DataUseAgreementQuerySet.as_manager()
     
+    class Meta:
+        indexes = [
+            # published records, newest first: the catalog lists and their keyset pages
+            models.Index(fields=['-record_update', '-id'], condition=models.Q(published=True),
+                         name='datacatalog_dua_pub_idx'),
+        ]
+
     def __str__(self):
         return "{}: {}".format(self.duaid, self.title)
 
@@ -968,6 +1176,20 @@ class DataUseAgreement(models.Model):
             return False
 
 
+class RetentionRequestQuerySet(models.QuerySet):
+    """
+    Queryset methods shared by the views that list retention requests.
+    """
+    def for_listing(self):
+        """
+        fetches the project, the author and the number of data locations to archive
+        (to_archive_count) of each request with the requests themselves, for
+        table_retention_requests.html.
+        """
+        return self.select_related('project', 'record_author'
+                                   ).annotate(to_archive_count=link_count(RetentionRequest.to_archive.field))
+
+
 class RetentionRequest(models.Model):
     """
     The Datauseagreement model defines all the governance attributes of a single DUA
@@ -1064,6 +1286,18 @@ class RetentionRequest(models.Model):
                         help_text="""Document list of all files archived""",
                         )
 
+    objects = RetentionRequestQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # all requests and the active (unverified) requests, oldest first
+            models.Index(fields=['record_update', 'id'], name='datacatalog_retention_upd_idx'),
+            models.Index(fields=['record_update', 'id'], condition=models.Q(verified=False),
+                         name='datacatalog_retention_ver_idx'),
+            # the unlocked requests counted on the catalog landing page
+            models.Index(fields=['locked', 'record_update'], name='datacatalog_retention_lck_idx'),
+        ]
+
     def __str__(self):
         return "{}: {}".format(self.record_creation, self.name)
 
@@ -1075,15 +1309,97 @@ class RetentionRequest(models.Model):
         checks viewing permission of instance against restricted fields, and the logged in user via requests
         and returns True if the model instance is viewable by the user.
         """
-        user = getattr(request, 'user', None)
+        # permissions are resolved once per request, see permissions.PermissionResolver
+        from .permissions import get_permission_resolver
+        return get_permission_resolver(request).can_view(self)
 
-        if user.has_perm('datacatalog.view_retentionrequest'):
-            return True
-        elif user.username == self.project.pi.cwid:
-            return True
-        elif self.project.other_pis.filter(cwid=user.username).exists():
-            return True
-        elif self.project.other_editors.filter(cwid=user.username).exists():
-            return True
-        else:
-            return False
\ No newline at end of file
+    def mark_archived(self):
+        """
+        marks all data locations of the request as retained and the request as archived and
+        locked, in a single transaction. The locations are updated with one UPDATE statement
+        (bypassing DataAccess.save()), and the number of locations updated is returned.
+        """
+        with transaction.atomic():
+            # update() skips auto_now, so the modification date is set explicitly
+            count = self.to_archive.update(data_retained=True, record_update=date.today())
+            bump_versions(DataAccess)
+            self.archived = True
+            self.locked = True
+            self.save(update_fields=['archived', 'locked', 'record_update'])
+        return count
+
+
+class Job(models.Model):
+    """
+    A unit of work run outside the web request by the run_jobs worker (see jobs.py),
+    eg. storing uploaded files or marking a retention request as archived. Jobs are
+    linked to the record they act on so that their progress can be shown there.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    # time the job was queued
+    created = models.DateTimeField(auto_now_add=True)
+
+    # time a worker started the job
+    started = models.DateTimeField(null=True, blank=True)
+
+    # time the job completed or failed
+    finished = models.DateTimeField(null=True, blank=True)
+
+    # the user who was signed in when the job was queued
+    record_author = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL)
+
+    # name of the registered task to run
+    task = models.CharField(max_length=64)
+
+    # short description of the work, for display
+    description = models.CharField(max_length=255, blank=True, default="")
+
+    # arguments for the task
+    payload = models.JSONField(default=dict, blank=True)
+
+    status = models.CharField(max_length=8, choices=STATUS_CHOICES, default=QUEUED)
+
+    # number of times a worker has started the job
+    attempts = models.PositiveSmallIntegerField(default=0)
+
+    # summary returned by the task, or the traceback if it failed
+    result = models.TextField(blank=True, default="")
+    error = models.TextField(blank=True, default="")
+
+    # the records the job acts on
+    data_access = models.ForeignKey(DataAccess,
+                                    null=True,
+                                    blank=True,
+                                    on_delete=models.CASCADE,
+                                    related_name='jobs',
+                                    )
+    retention_request = models.ForeignKey(RetentionRequest,
+                                          null=True,
+                                          blank=True,
+                                          on_delete=models.CASCADE,
+                                          related_name='jobs',
+                                          )
+    dataset = models.ForeignKey(Dataset,
+                                null=True,
+                                blank=True,
+                                on_delete=models.CASCADE,
+                                related_name='jobs',
+                                )
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'id'], name='datacatalog_job_queue_idx'),
+        ]
+
+    def __str__(self):
+        return "{}: {} ({})".format(self.pk, self.description or self.task, self.status)
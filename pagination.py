@@ -0,0 +1,121 @@
+import base64
+import json
+
+from django.db.models import Q
+from django.http import Http404
+
+
+def encode_cursor(values):
+    """
+    encodes the ordering values of the last row of a page as an opaque url-safe cursor
+    """
+    data = json.dumps([v.isoformat() if hasattr(v, 'isoformat') else v for v in values])
+    return base64.urlsafe_b64encode(data.encode()).decode()
+
+
+def decode_cursor(cursor, model, ordering):
+    """
+    decodes a cursor into python values for each of the ordering fields
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except (ValueError, UnicodeError):
+        raise Http404("Invalid page cursor")
+    if not isinstance(values, list) or len(values) != len(ordering):
+        raise Http404("Invalid page cursor")
+
+    decoded = []
+    for field_name, value in zip(ordering, values):
+        name = field_name.lstrip('-')
+        field = model._meta.pk if name == 'pk' else model._meta.get_field(name)
+        try:
+            decoded.append(field.to_python(value))
+        except Exception:
+            raise Http404("Invalid page cursor")
+    return decoded
+
+
+def keyset_filter(ordering, values):
+    """
+    builds the filter that selects all rows after the cursor values, eg. for an ordering
+    of ('-record_update', '-pk'):
+        record_update < v1 OR (record_update = v1 AND pk < v2)
+    """
+    condition = Q()
+    for i, field_name in enumerate(ordering):
+        name = field_name.lstrip('-')
+        lookup = 'lt' if field_name.startswith('-') else 'gt'
+        equal = {f.lstrip('-'): v for f, v in zip(ordering[:i], values[:i])}
+        condition |= Q(**equal, **{f'{name}__{lookup}': values[i]})
+    return condition
+
+
+class KeysetPage:
+    """
+    A single page of keyset-paginated results. Unlike django's Page, it holds no
+    total count, only the cursor needed to fetch the following page.
+    """
+    def __init__(self, object_list, page_size, cursor=None, next_cursor=None):
+        self.object_list = object_list
+        self.page_size = page_size
+        self.cursor = cursor
+        self.next_cursor = next_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+def keyset_page(queryset, page_size, cursor=None, ordering=('-record_update', '-pk')):
+    """
+    returns the KeysetPage of the queryset that follows the cursor (or the first page, if
+    no cursor is given). Only page_size + 1 rows are fetched, whatever the table size.
+    """
+    queryset = queryset.order_by(*ordering)
+    if cursor:
+        values = decode_cursor(cursor, queryset.model, ordering)
+        queryset = queryset.filter(keyset_filter(ordering, values))
+
+    object_list = list(queryset[:page_size + 1])
+    next_cursor = None
+    if len(object_list) > page_size:
+        object_list = object_list[:page_size]
+        last = object_list[-1]
+        next_cursor = encode_cursor([getattr(last, f.lstrip('-')) for f in ordering])
+
+    return KeysetPage(object_list, page_size, cursor=cursor, next_cursor=next_cursor)
+
+
+class KeysetPaginationMixin:
+    """
+    Replaces the offset pagination of a ListView with keyset pagination on
+    keyset_ordering. The page size is taken from the page_size query parameter,
+    limited to max_paginate_by, and the next page from the cursor query parameter.
+    """
+    keyset_ordering = ('-record_update', '-pk')
+    paginate_by = 50
+    max_paginate_by = 500
+    cursor_kwarg = 'cursor'
+    page_size_kwarg = 'page_size'
+
+    def get_paginate_by(self, queryset):
+        try:
+            page_size = int(self.request.GET.get(self.page_size_kwarg, self.paginate_by))
+        except ValueError:
+            page_size = self.paginate_by
+        return max(1, min(page_size, self.max_paginate_by))
+
+    def paginate_queryset(self, queryset, page_size):
+        cursor = self.request.GET.get(self.cursor_kwarg) or None
+        page = keyset_page(queryset, page_size, cursor=cursor, ordering=self.keyset_ordering)
+        return None, page, page.object_list, page.has_next or page.has_previous
@@ -0,0 +1,238 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+
+from persons.models import Person
+
+from .models import Project, DataAccess, RetentionRequest
+
+
+GROUP_NAMES_ATTR = '_datacatalog_group_names'
+PERSON_ATTR = '_datacatalog_person'
+
+PERSON_ID_KEY = 'datacatalog:person_id:{}'
+
+# the cached ids are cleared whenever a Person is saved or deleted, so the timeout only
+# guards against changes made outside of django
+DEFAULT_PERSON_TIMEOUT = 24 * 60 * 60
+
+
+def user_group_names(user):
+    """
+    returns the set of names of the groups the user belongs to. The names are loaded
+    with a single query and kept on the user object, which lives for one request.
+    """
+    names = getattr(user, GROUP_NAMES_ATTR, None)
+    if names is None:
+        names = frozenset(user.groups.values_list('name', flat=True))
+        setattr(user, GROUP_NAMES_ATTR, names)
+    return names
+
+
+def clear_user_group_names(user):
+    """
+    discards the group names held on the user object, eg. after its groups change
+    """
+    if hasattr(user, GROUP_NAMES_ATTR):
+        delattr(user, GROUP_NAMES_ATTR)
+
+
+def person_id_for(username):
+    """
+    returns the primary key of the Person record whose cwid is the username, or None if
+    there is none. Found ids are cached across requests.
+    """
+    if not username:
+        return None
+    key = PERSON_ID_KEY.format(username)
+    person_id = cache.get(key)
+    if person_id is None:
+        person_id = Person.objects.filter(cwid=username).values_list('pk', flat=True).first()
+        # users without a Person record are not cached, so that a record created for them
+        # is found at once
+        if person_id is not None:
+            cache.set(key, person_id, getattr(settings, 'DATACATALOG_PERSON_TIMEOUT', DEFAULT_PERSON_TIMEOUT))
+    return person_id
+
+
+def forget_person_id(username):
+    """
+    clears the cached Person id of a username once the current transaction commits
+    """
+    if username:
+        transaction.on_commit(lambda: cache.delete(PERSON_ID_KEY.format(username)))
+
+
+class RequestPerson:
+    """
+    The Person record of the logged in user, resolved at most once per request: the id
+    from the cache (see person_id_for), and the record itself only if it is used.
+    """
+    def __init__(self, user):
+        self.user = user
+        self._id = None
+        self._id_loaded = False
+        self._person = None
+        self._person_loaded = False
+
+    @property
+    def id(self):
+        if not self._id_loaded:
+            self._id = person_id_for(self.user.get_username()) if self.user.is_authenticated else None
+            self._id_loaded = True
+        return self._id
+
+    @property
+    def person(self):
+        if not self._person_loaded:
+            self._person = Person.objects.filter(pk=self.id).first() if self.id is not None else None
+            self._person_loaded = True
+        return self._person
+
+    def set(self, person):
+        self._id, self._id_loaded = person.pk, True
+        self._person, self._person_loaded = person, True
+
+
+def get_request_person(request):
+    """
+    returns the RequestPerson of the logged in user, creating it on the first call within
+    a request
+    """
+    user = getattr(request, 'user', None)
+    request_person = getattr(request, PERSON_ATTR, None)
+    if request_person is None or request_person.user is not user:
+        request_person = RequestPerson(user)
+        setattr(request, PERSON_ATTR, request_person)
+    return request_person
+
+
+def get_person_id(request):
+    """
+    returns the primary key of the logged in user's Person record (matched on cwid), or
+    None. Use this rather than the record where an id will do, eg. in query filters.
+    """
+    return get_request_person(request).id
+
+
+def get_person(request):
+    """
+    returns the logged in user's Person record (matched on cwid), or None
+    """
+    return get_request_person(request).person
+
+
+class PermissionResolver:
+    """
+    Answers viewing permission checks for a single user. The user's Person record,
+    project memberships and restricted data access records are each loaded with one
+    query on first use and then reused, so that checking any number of objects costs
+    no further queries.
+
+    Use get_permission_resolver(request) to share one resolver over a whole request.
+    """
+    def __init__(self, user, request_person=None):
+        self.user = user
+        self.request_person = request_person or RequestPerson(user)
+        self._project_ids = None
+        self._restricted_access_ids = None
+
+    @property
+    def person_id(self):
+        """
+        the primary key of the user's Person record (matched on cwid), or None if there is none
+        """
+        return self.request_person.id
+
+    @property
+    def project_ids(self):
+        """
+        the set of primary keys of projects where the user is the PI, another PI, or
+        another editor
+        """
+        if self._project_ids is None:
+            person = self.person_id
+            if person is None:
+                self._project_ids = set()
+            else:
+                as_pi = Project.objects.filter(pi=person).values_list('pk')
+                as_other_pi = Project.other_pis.through.objects.filter(person=person).values_list('project_id')
+                as_other_editor = Project.other_editors.through.objects.filter(person=person).values_list('project_id')
+                self._project_ids = {pk for (pk,) in as_pi.union(as_other_pi, as_other_editor)}
+        return self._project_ids
+
+    @property
+    def restricted_access_ids(self):
+        """
+        the set of primary keys of data access records that list the user as restricted
+        """
+        if self._restricted_access_ids is None:
+            person = self.person_id
+            if person is None:
+                self._restricted_access_ids = set()
+            else:
+                self._restricted_access_ids = set(DataAccess.restricted.through.objects.filter(person=person
+                                                                                               ).values_list('dataaccess_id',
+                                                                                                             flat=True,
+                                                                                                             ))
+        return self._restricted_access_ids
+
+    def can_view(self, obj):
+        """
+        returns True if the user may view the Project, DataAccess or RetentionRequest instance
+        """
+        if isinstance(obj, Project):
+            return (self.user.has_perm('datacatalog.view_project') or
+                    obj.pk in self.project_ids)
+
+        elif isinstance(obj, DataAccess):
+            return (self.user.has_perm('datacatalog.view_dataaccess') or
+                    obj.project_id in self.project_ids or
+                    bool(obj.public) or
+                    obj.pk in self.restricted_access_ids)
+
+        elif isinstance(obj, RetentionRequest):
+            return (self.user.has_perm('datacatalog.view_retentionrequest') or
+                    obj.project_id in self.project_ids)
+
+        raise TypeError(f"No viewing permissions defined for {obj.__class__.__name__}")
+
+    def viewable(self, queryset):
+        """
+        restricts a Project, DataAccess or RetentionRequest queryset to the records the
+        user may view, for use where filtering must happen in the database (eg. paging).
+        """
+        model = queryset.model
+        if model is Project:
+            if self.user.has_perm('datacatalog.view_project'):
+                return queryset
+            return queryset.filter(pk__in=self.project_ids)
+
+        elif model is DataAccess:
+            if self.user.has_perm('datacatalog.view_dataaccess'):
+                return queryset
+            return queryset.filter(Q(project__in=self.project_ids) |
+                                   Q(public=True) |
+                                   Q(pk__in=self.restricted_access_ids)
+                                   )
+
+        elif model is RetentionRequest:
+            if self.user.has_perm('datacatalog.view_retentionrequest'):
+                return queryset
+            return queryset.filter(project__in=self.project_ids)
+
+        raise TypeError(f"No viewing permissions defined for {model.__name__}")
+
+
+def get_permission_resolver(request):
+    """
+    returns the PermissionResolver for the logged in user, creating it on the first call
+    within a request.
+    """
+    user = getattr(request, 'user', None)
+    resolver = getattr(request, '_datacatalog_permissions', None)
+    if resolver is None or resolver.user is not user:
+        resolver = PermissionResolver(user, get_request_person(request))
+        request._datacatalog_permissions = resolver
+    return resolver
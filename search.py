@@ -0,0 +1,393 @@
+import bisect
+import math
+import re
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import CharField, Value
+from django.utils.module_loading import import_string
+
+from .models import Dataset, DataUseAgreement, Keyword, DataField
+
+# the models covered by the catalog search, keyed by the label used in search results,
+# together with the text fields that make up each searchable document.
+SEARCH_MODELS = {
+    'dataset': (Dataset, ('ds_id', 'title', 'description', 'comments')),
+    'dua': (DataUseAgreement, ('duaid', 'title', 'description')),
+    'keyword': (Keyword, ('keyword', 'definition')),
+    'datafield': (DataField, ('name', 'description')),
+}
+
+# maximum number of results returned per model, unless overridden in settings.py
+DEFAULT_SEARCH_LIMIT = 200
+
+# number of ranked hits checked against the restricting queryset at a time, by the
+# backends that cannot restrict their hits in the database (see InvertedIndexBackend)
+RESTRICT_BATCH = 500
+
+TOKEN_RE = re.compile(r'\w+')
+
+
+def tokenize(text):
+    """
+    split text into lowercase word tokens
+    """
+    if not text:
+        return []
+    return TOKEN_RE.findall(str(text).lower())
+
+
+def get_search_label(instance):
+    """
+    returns the search label of a model instance, or None if the model is not searchable
+    """
+    for label, (model, fields) in SEARCH_MODELS.items():
+        if isinstance(instance, model):
+            return label
+    return None
+
+
+def document_text(instance, fields):
+    """
+    concatenates the searchable fields of an instance into a single document
+    """
+    return " ".join(str(getattr(instance, f)) for f in fields if getattr(instance, f, None))
+
+
+class BaseSearchBackend:
+    """
+    A search backend returns ranked primary keys for each of the SEARCH_MODELS in a
+    single call. Every token of the term must match a word of the document, or the start
+    of one. Backends that maintain their own index are kept up to date by the post_save
+    and post_delete signals registered in signals.py.
+    """
+    def search(self, term, limit=None, querysets=None):
+        """
+        returns a dictionary of search label to a list of primary keys, most relevant first,
+        with at most limit keys for each label.
+
+        querysets: optional dictionary of search label to the queryset the hits of that
+                   label are restricted to, before the limit is applied.
+        """
+        raise NotImplementedError
+
+    def update(self, instance):
+        pass
+
+    def update_many(self, instances):
+        """
+        updates the index for records written in bulk, which send no post_save signals
+        """
+        for instance in instances:
+            self.update(instance)
+
+    def remove(self, instance):
+        pass
+
+    def rebuild(self):
+        pass
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    """
+    Full-text search using postgres tsvectors. The vectors are not stored, but are
+    matched against the GIN expression indexes created in migration 0041, so the
+    search vector used here must stay identical to the indexed expression.
+    """
+    config = 'english'
+
+    def search_vector(self, fields):
+        from django.contrib.postgres.search import SearchVector
+        return SearchVector(*fields, config=self.config)
+
+    def search_query(self, term):
+        from django.contrib.postgres.search import SearchQuery
+
+        # every token as a prefix, like the other backends: 'clin' finds 'clinical'
+        tokens = tokenize(term)
+        if not tokens:
+            return None
+        return SearchQuery(" & ".join(f"{t}:*" for t in tokens), config=self.config, search_type='raw')
+
+    def search(self, term, limit=None, querysets=None):
+        from django.contrib.postgres.search import SearchRank
+
+        results = defaultdict(list)
+        query = self.search_query(term)
+        if query is None:
+            return results
+
+        limit = limit or DEFAULT_SEARCH_LIMIT
+        querysets = querysets or {}
+
+        # one ranked sub-select per model, combined into a single round trip
+        selects = []
+        for label, (model, fields) in SEARCH_MODELS.items():
+            vector = self.search_vector(fields)
+            qs = model.objects.all()
+            if label in querysets:
+                qs = qs.filter(pk__in=querysets[label].order_by().values('pk'))
+            qs = qs.annotate(search_document=vector
+                             ).filter(search_document=query
+                                      ).annotate(search_label=Value(label, output_field=CharField()),
+                                                 search_rank=SearchRank(vector, query),
+                                                 ).order_by('-search_rank'
+                                                            ).values_list('search_label',
+                                                                          'pk',
+                                                                          'search_rank',
+                                                                          )[:limit]
+            selects.append(qs)
+
+        rows = selects[0].union(*selects[1:], all=True)
+
+        for label, pk, rank in sorted(rows, key=lambda r: r[2], reverse=True):
+            results[label].append(pk)
+        return results
+
+
+class SQLiteFTSBackend(BaseSearchBackend):
+    """
+    Full-text search using an SQLite FTS5 virtual table, created in migration 0041 and
+    given an unindexed label column in migration 0047. Each row's rowid encodes both the
+    model and the primary key of the indexed object, so that updates and deletes are
+    single rowid lookups.
+
+    Each model is ranked by a query of its own, filtered on the label: ranked together,
+    the short data field documents would crowd the datasets out of the results.
+    """
+    table = 'datacatalog_search_fts'
+    labels = list(SEARCH_MODELS)
+
+    @classmethod
+    def is_available(cls):
+        return cls.table in connection.introspection.table_names()
+
+    def rowid(self, label, pk):
+        return pk * len(self.labels) + self.labels.index(label)
+
+    def match_expression(self, term):
+        # quote every token to escape FTS5 syntax, and allow prefix matches
+        return " ".join('"{}"*'.format(t) for t in tokenize(term))
+
+    def search(self, term, limit=None, querysets=None):
+        results = defaultdict(list)
+        match = self.match_expression(term)
+        if not match:
+            return results
+
+        limit = limit or DEFAULT_SEARCH_LIMIT
+        querysets = querysets or {}
+        with connection.cursor() as cursor:
+            for label in self.labels:
+                sql = f"SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s AND label = %s"
+                params = [match, label]
+                if label in querysets:
+                    # the primary key of the indexed object is rowid / len(labels), rounded down
+                    pk_sql, pk_params = querysets[label].order_by().values('pk').query.sql_with_params()
+                    sql += f" AND rowid / {len(self.labels)} IN ({pk_sql})"
+                    params += list(pk_params)
+                cursor.execute(sql + " ORDER BY rank LIMIT %s", params + [limit])
+                results[label] = [rowid // len(self.labels) for (rowid,) in cursor.fetchall()]
+        return results
+
+    def update(self, instance):
+        label = get_search_label(instance)
+        model, fields = SEARCH_MODELS[label]
+        rowid = self.rowid(label, instance.pk)
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table} WHERE rowid = %s", [rowid])
+            cursor.execute(f"INSERT INTO {self.table} (rowid, body, label) VALUES (%s, %s, %s)",
+                           [rowid, document_text(instance, fields), label],
+                           )
+
+    def update_many(self, instances):
+        if not instances:
+            return
+        rows = []
+        for instance in instances:
+            label = get_search_label(instance)
+            model, fields = SEARCH_MODELS[label]
+            rows.append((self.rowid(label, instance.pk), document_text(instance, fields), label))
+        with connection.cursor() as cursor:
+            cursor.executemany(f"DELETE FROM {self.table} WHERE rowid = %s", [row[:1] for row in rows])
+            cursor.executemany(f"INSERT INTO {self.table} (rowid, body, label) VALUES (%s, %s, %s)", rows)
+
+    def remove(self, instance):
+        label = get_search_label(instance)
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table} WHERE rowid = %s", [self.rowid(label, instance.pk)])
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table}")
+            for label, (model, fields) in SEARCH_MODELS.items():
+                rows = [(self.rowid(label, obj.pk), document_text(obj, fields), label)
+                        for obj in model.objects.only(*fields).iterator()]
+                cursor.executemany(f"INSERT INTO {self.table} (rowid, body, label) VALUES (%s, %s, %s)", rows)
+
+
+class InvertedIndexBackend(BaseSearchBackend):
+    """
+    A pure-python inverted index, used when the database offers no full-text search.
+    The index is built on first use and held in memory by each process, so it is best
+    suited to development and single-process deployments.
+    """
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._postings = None
+        self._documents = None
+        self._vocabulary = None
+
+    def _index(self, key, text):
+        counts = defaultdict(int)
+        for token in tokenize(text):
+            counts[token] += 1
+        for token, tf in counts.items():
+            if token not in self._postings:
+                self._vocabulary = None
+            self._postings[token][key] = tf
+        self._documents[key] = list(counts)
+
+    def _unindex(self, key):
+        for token in self._documents.pop(key, []):
+            postings = self._postings[token]
+            postings.pop(key, None)
+            if not postings:
+                del self._postings[token]
+                self._vocabulary = None
+
+    def _ensure_built(self):
+        if self._postings is None:
+            self.rebuild()
+
+    def _expand(self, token):
+        # all indexed terms that start with the token, found by bisecting the vocabulary
+        if self._vocabulary is None:
+            self._vocabulary = sorted(self._postings)
+        start = bisect.bisect_left(self._vocabulary, token)
+        terms = []
+        for term in self._vocabulary[start:]:
+            if not term.startswith(token):
+                break
+            terms.append(term)
+        return terms
+
+    def search(self, term, limit=None, querysets=None):
+        results = defaultdict(list)
+        tokens = tokenize(term)
+        if not tokens:
+            return results
+
+        limit = limit or DEFAULT_SEARCH_LIMIT
+        with self._lock:
+            self._ensure_built()
+            total = len(self._documents) or 1
+            scores = None
+            for token in tokens:
+                # tf-idf score of the best matching expansion of each token
+                token_scores = {}
+                for expansion in self._expand(token):
+                    postings = self._postings[expansion]
+                    idf = math.log(1 + total / len(postings))
+                    for key, tf in postings.items():
+                        token_scores[key] = max(token_scores.get(key, 0), tf * idf)
+
+                # every token must match, as in the database backends
+                if scores is None:
+                    scores = token_scores
+                else:
+                    scores = {key: scores[key] + s for key, s in token_scores.items() if key in scores}
+                if not scores:
+                    break
+
+        ranked = defaultdict(list)
+        for (label, pk), score in sorted(scores.items(), key=lambda i: i[1], reverse=True):
+            ranked[label].append(pk)
+
+        querysets = querysets or {}
+        for label, pks in ranked.items():
+            if label not in querysets:
+                results[label] = pks[:limit]
+                continue
+            # the index knows nothing of the restrictions: check the hits a batch at a time,
+            # in rank order, until the limit is reached
+            for start in range(0, len(pks), RESTRICT_BATCH):
+                batch = pks[start:start + RESTRICT_BATCH]
+                allowed = set(querysets[label].filter(pk__in=batch).values_list('pk', flat=True))
+                results[label] += [pk for pk in batch if pk in allowed][:limit - len(results[label])]
+                if len(results[label]) >= limit:
+                    break
+        return results
+
+    def update(self, instance):
+        label = get_search_label(instance)
+        model, fields = SEARCH_MODELS[label]
+        with self._lock:
+            if self._postings is None:
+                return
+            key = (label, instance.pk)
+            self._unindex(key)
+            self._index(key, document_text(instance, fields))
+
+    def remove(self, instance):
+        with self._lock:
+            if self._postings is None:
+                return
+            self._unindex((get_search_label(instance), instance.pk))
+
+    def rebuild(self):
+        with self._lock:
+            self._postings = defaultdict(dict)
+            self._documents = {}
+            self._vocabulary = None
+            for label, (model, fields) in SEARCH_MODELS.items():
+                for obj in model.objects.only(*fields).iterator():
+                    self._index((label, obj.pk), document_text(obj, fields))
+
+
+_backend = None
+
+
+def get_search_backend():
+    """
+    returns the search backend specified by DATACATALOG_SEARCH_BACKEND in settings.py,
+    or else the best backend available for the database in use.
+    """
+    global _backend
+    if _backend is None:
+        backend_path = getattr(settings, 'DATACATALOG_SEARCH_BACKEND', None)
+        if backend_path:
+            _backend = import_string(backend_path)()
+        elif connection.vendor == 'postgresql':
+            _backend = PostgresSearchBackend()
+        elif connection.vendor == 'sqlite' and SQLiteFTSBackend.is_available():
+            _backend = SQLiteFTSBackend()
+        else:
+            _backend = InvertedIndexBackend()
+    return _backend
+
+
+def search_catalog(term, querysets=None, limit=None):
+    """
+    runs a ranked search across all SEARCH_MODELS, and returns a dictionary of search
+    label to a list of model instances, most relevant first.
+
+    querysets: optional dictionary of search label to the queryset that results are
+               drawn from, e.g. to restrict results to published records. The
+               restriction is applied before the limit.
+    """
+    querysets = querysets or {}
+    limit = limit or getattr(settings, 'DATACATALOG_SEARCH_LIMIT', DEFAULT_SEARCH_LIMIT)
+    ranked = get_search_backend().search(term, limit=limit, querysets=querysets)
+
+    results = {}
+    for label, (model, fields) in SEARCH_MODELS.items():
+        pks = ranked.get(label, [])
+        if pks:
+            found = querysets.get(label, model.objects.all()).in_bulk(pks)
+            results[label] = [found[pk] for pk in pks if pk in found]
+        else:
+            results[label] = []
+    return results
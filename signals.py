@@ -0,0 +1,144 @@
+from django.apps import apps
+from django.contrib.auth.models import User, Group
+from django.db.models.signals import pre_save, post_save, post_delete, m2m_changed
+
+from persons.models import Person
+
+from .counters import COUNTED_MODELS, invalidate_dashboard_counts
+from .permissions import clear_user_group_names, forget_person_id
+from .search import SEARCH_MODELS, get_search_backend
+from .versions import PERMISSIONS, bump_versions
+
+
+# ################################## #
+# #####    SEARCH  INDEXING    ##### #
+# ################################## #
+
+def update_search_index(sender, instance, **kwargs):
+    get_search_backend().update(instance)
+
+
+def remove_from_search_index(sender, instance, **kwargs):
+    get_search_backend().remove(instance)
+
+
+for model, fields in SEARCH_MODELS.values():
+    post_save.connect(update_search_index,
+                      sender=model,
+                      dispatch_uid=f'datacatalog_search_update_{model.__name__}',
+                      )
+    post_delete.connect(remove_from_search_index,
+                        sender=model,
+                        dispatch_uid=f'datacatalog_search_remove_{model.__name__}',
+                        )
+
+
+# ################################## #
+# #####   DASHBOARD  COUNTERS  ##### #
+# ################################## #
+
+def update_dashboard_counts(sender, instance, **kwargs):
+    invalidate_dashboard_counts()
+
+
+for model in COUNTED_MODELS:
+    post_save.connect(update_dashboard_counts,
+                      sender=model,
+                      dispatch_uid=f'datacatalog_counts_save_{model.__name__}',
+                      )
+    post_delete.connect(update_dashboard_counts,
+                        sender=model,
+                        dispatch_uid=f'datacatalog_counts_delete_{model.__name__}',
+                        )
+
+
+# ################################## #
+# #####   GROUP  MEMBERSHIPS   ##### #
+# ################################## #
+
+def update_group_names(sender, instance, action, **kwargs):
+    # only the user instance whose groups were changed holds stale group names;
+    # changes made from the group side are picked up by the next request.
+    if action in ('post_add', 'post_remove', 'post_clear') and isinstance(instance, User):
+        clear_user_group_names(instance)
+
+
+m2m_changed.connect(update_group_names,
+                    sender=User.groups.through,
+                    dispatch_uid='datacatalog_group_names',
+                    )
+
+
+# ################################## #
+# #####      PERSON  IDS       ##### #
+# ################################## #
+
+def forget_previous_cwid(sender, instance, raw=False, **kwargs):
+    # a changed cwid no longer identifies the person
+    if instance.pk is not None and not raw:
+        previous = sender.objects.filter(pk=instance.pk).values_list('cwid', flat=True).first()
+        if previous != instance.cwid:
+            forget_person_id(previous)
+
+
+def forget_cwid(sender, instance, **kwargs):
+    forget_person_id(instance.cwid)
+
+
+pre_save.connect(forget_previous_cwid,
+                 sender=Person,
+                 dispatch_uid='datacatalog_person_ids_pre_save',
+                 )
+post_save.connect(forget_cwid,
+                  sender=Person,
+                  dispatch_uid='datacatalog_person_ids_save',
+                  )
+post_delete.connect(forget_cwid,
+                    sender=Person,
+                    dispatch_uid='datacatalog_person_ids_delete',
+                    )
+
+
+# ################################## #
+# #####    CACHE  VERSIONS     ##### #
+# ################################## #
+
+# models whose changes alter the catalog pages (see versions.py)
+VERSIONED_MODELS = tuple(apps.get_app_config('datacatalog').get_models()) + (Person,)
+
+
+def update_versions(sender, instance, **kwargs):
+    bump_versions(sender)
+
+
+def update_m2m_versions(sender, instance, action, model, **kwargs):
+    # a link changes the records on both of its sides
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        bump_versions(*{type(instance), model} & set(VERSIONED_MODELS))
+
+
+def update_permission_versions(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        bump_versions(PERMISSIONS)
+
+
+for model in VERSIONED_MODELS:
+    post_save.connect(update_versions,
+                      sender=model,
+                      dispatch_uid=f'datacatalog_versions_save_{model.__name__}',
+                      )
+    post_delete.connect(update_versions,
+                        sender=model,
+                        dispatch_uid=f'datacatalog_versions_delete_{model.__name__}',
+                        )
+    for field in model._meta.local_many_to_many:
+        m2m_changed.connect(update_m2m_versions,
+                            sender=field.remote_field.through,
+                            dispatch_uid=f'datacatalog_versions_m2m_{model.__name__}_{field.name}',
+                            )
+
+for through in (User.groups.through, User.user_permissions.through, Group.permissions.through):
+    m2m_changed.connect(update_permission_versions,
+                        sender=through,
+                        dispatch_uid=f'datacatalog_versions_{through.__name__}',
+                        )
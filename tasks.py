@@ -0,0 +1,107 @@
+from django.core.files import File
+from django.core.files.storage import default_storage
+
+from .dictionary import import_dictionary
+from .jobs import enqueue, task
+from .uploads import discard_staged, stage_upload, store_staged_uploads, upload_log
+
+
+# ############################ #
+# #####  UPLOADED FILES  ##### #
+# ############################ #
+
+def discard_staged_uploads(job):
+    for path, name in job.payload['staged']:
+        discard_staged(path)
+
+
+@task('store_uploads', on_failure=discard_staged_uploads)
+def store_uploads_task(job):
+    data_access = job.data_access
+    archive_files = store_staged_uploads(data_access, job.payload['staged'])
+    data_access.fileupload_log = upload_log(archive_files)
+    # other jobs may be updating the same record concurrently
+    data_access.save(update_fields=['fileupload_log', 'record_update'])
+    return f"{len(archive_files)} files stored"
+
+
+def queue_uploads(data_access, filelist, user=None):
+    """
+    stages the files uploaded to a DataAccess record and queues a job to store them
+    """
+    staged = [(stage_upload(f), f.name) for f in filelist]
+    return enqueue('store_uploads',
+                   description=f"Store {len(staged)} uploaded files",
+                   payload={'staged': staged},
+                   user=user,
+                   data_access=data_access,
+                   )
+
+
+# ############################ #
+# #####    RETENTION     ##### #
+# ############################ #
+
+def discard_staged_inventory(job):
+    discard_staged(job.payload['staged'])
+
+
+@task('attach_inventory', on_failure=discard_staged_inventory)
+def attach_inventory_task(job):
+    retention_request = job.retention_request
+    staged = job.payload['staged']
+    with default_storage.open(staged, 'rb') as fh:
+        retention_request.inventory.save(job.payload['name'], File(fh), save=False)
+    retention_request.save(update_fields=['inventory', 'record_update'])
+    discard_staged(staged)
+    return f"Inventory {job.payload['name']} attached"
+
+
+def queue_inventory(retention_request, uploaded_file, user=None):
+    """
+    stages an uploaded inventory and queues a job to attach it to the RetentionRequest
+    """
+    return enqueue('attach_inventory',
+                   description=f"Attach inventory {uploaded_file.name}",
+                   payload={'staged': stage_upload(uploaded_file), 'name': uploaded_file.name},
+                   user=user,
+                   retention_request=retention_request,
+                   )
+
+
+@task('mark_archived')
+def mark_archived_task(job):
+    count = job.retention_request.mark_archived()
+    return f"{count} data locations marked as archived, request locked"
+
+
+def queue_archiving(retention_request, user=None):
+    """
+    queues a job to mark the data locations of a RetentionRequest as archived
+    """
+    return enqueue('mark_archived',
+                   description="Mark data locations as archived",
+                   user=user,
+                   retention_request=retention_request,
+                   )
+
+
+# ############################ #
+# #####  DATA DICTIONARY ##### #
+# ############################ #
+
+@task('parse_dictionary')
+def parse_dictionary_task(job):
+    read, created = import_dictionary(job.dataset, author=job.record_author)
+    return f"{read} fields read from the data dictionary, {created} new"
+
+
+def queue_dictionary(dataset, user=None):
+    """
+    queues a job to parse the data dictionary of a Dataset into its data fields
+    """
+    return enqueue('parse_dictionary',
+                   description=f"Parse data dictionary {dataset.data_dictionary.name}",
+                   user=user,
+                   dataset=dataset,
+                   )
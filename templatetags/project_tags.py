@@ -1,9 +1,37 @@
-
-
 from django import template
+from django.apps import apps
+from django.conf import settings
+
+from ..permissions import user_group_names
+from ..versions import get_versions
 
 register = template.Library()
+
+# fragments are keyed on the versions of the models they show, so they are replaced as
+# soon as those change; the timeout only frees the space held by outdated fragments
+DEFAULT_FRAGMENT_TIMEOUT = 24 * 60 * 60
         
 @register.filter(name='has_group') 
 def has_group(user, group_name):
-    return user.groups.filter(name=group_name).exists() 
+    # group names are loaded once per request, however many times the filter is used
+    return group_name in user_group_names(user)
+
+
+@register.simple_tag
+def fragment_version(*model_names):
+    """
+    returns the combined version of the named catalog models, for use in {% cache %} keys:
+        {% fragment_version "confidentialityimpact" as cil_version %}
+        {% cache timeout dataset_cil dataset.pk dataset.record_update cil_version %}
+    Name only the related models a fragment shows, and key it on its own record: the
+    version of the record's model changes whenever any of its records is saved. Links
+    change the versions of the models on both sides.
+    """
+    models = [apps.get_model('datacatalog', name) for name in model_names]
+    versions = get_versions(*models)
+    return '-'.join(str(versions[label]) for label in sorted(versions))
+
+
+@register.simple_tag
+def fragment_timeout():
+    return getattr(settings, 'DATACATALOG_FRAGMENT_TIMEOUT', DEFAULT_FRAGMENT_TIMEOUT)
@@ -1,3 +1,1357 @@
-from django.test import TestCase
+import hashlib
+import io
+import shutil
+import tempfile
+import threading
+from datetime import date, timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.contrib.auth.models import Permission, User
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, models
+from django.utils import timezone
+from django.db.models.fields.files import FieldFile
+from django.http import Http404
+from django.test import RequestFactory, TestCase, modify_settings, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from persons.models import Person
+
+from .admin import make_published
+from .benchmark import benchmark_cases, run_case
+from .counters import get_dashboard_counts
+from .dats import DATSError, DATSImporter, read_jsonl, save_new
+from .dictionary import DictionaryError, import_dictionary, parsed_on_upload, read_dictionary
+from .export import export_lines
+from .fileserving import serve_file
+from .generator import CatalogGenerator, catalog_sizes
+from .instrumentation import get_stats
+from .jobs import claim_jobs, reclaim_stale_jobs, run_job
+from .models import Dataset, DataUseAgreement, Keyword, DataField, DataProvider, Project, DataAccess
+from .models import ConfidentialityImpact, MediaSubType
+from .models import RetentionRequest, ArchiveFile, Job
+from .pagination import encode_cursor, keyset_page, KeysetPaginationMixin
+from .middleware import PersonMiddleware
+from .permissions import PermissionResolver, get_person, get_person_id, person_id_for
+from .search import InvertedIndexBackend, PostgresSearchBackend, SQLiteFTSBackend, search_catalog
+from .tasks import queue_inventory, queue_uploads
+from .uploads import archive_directory, store_uploads
+from .views import check_or_create_user
+
+# datasets in the catalogs each view is measured on: the larger catalog is generated
+# on top of the smaller one, and has several times as many records of each model
+SMALL_CATALOG = 10
+LARGE_CATALOG = 60
+
+# admin changelists whose rows show counts or flags of related records
+ADMIN_CHANGELISTS = ('dataaccess',)
+
+INDEX_VIEWS = ('index', 'projects-byuser', 'datasets', 'duas', 'access', 'keywords', 'providers', 'retention',
+               'retention-active')
+
+# most queries each view may run on an uncached request of the larger catalog, by url
+# name. The counts include the session and user lookups made on every request.
+MAX_QUERIES = {
+    # index views
+    'index': 10,
+    'projects-byuser': 7,
+    'datasets': 6,
+    'duas': 5,
+    'access': 4,
+    'keywords': 5,
+    'providers': 5,
+    'retention': 4,
+    'retention-active': 4,
+    # detail views
+    'project-view': 12,
+    'dataset-view': 14,
+    'access-view': 9,
+    'provider-view': 6,
+    'dua-view': 9,
+    'keyword-view': 6,
+    'datafield-view': 6,
+    'retention-view': 15,
+    # search
+    'full-search': 7,
+    # autocompletes
+    'autocomplete-dataset': 4,
+    'autocomplete-publisher': 3,
+    'autocomplete-project-byuser': 5,
+    'autocomplete-access': 3,
+    'autocomplete-access-byproject': 6,
+    'autocomplete-dua': 4,
+    'autocomplete-keyword': 3,
+    'autocomplete-datafield': 4,
+    'autocomplete-mediatype': 4,
+    'autocomplete-cil': 5,
+    # retention workflow
+    'wizard-milestone': 3,
+    'wizard-project': 5,
+    'wizard-data': 7,
+    'wizard-summary': 8,
+}
+
+
+class QueryCountTests(TestCase):
+    """
+    Runs each view on a small and on a larger generated catalog (see generator.py), and
+    checks that it runs no more than MAX_QUERIES queries, and no more on the larger
+    catalog than on the small one: a view whose queries grow with the number of records
+    has a query per row, typically from a template (eg. a count or a related record
+    read for each row of a table).
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser(username='query-count-user')
+        # given a role in some of the generated projects
+        cls.member = Person.objects.create(first_name='Query', last_name='Count', cwid=cls.user.username)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def generate(self, datasets, seed):
+        CatalogGenerator(self.user, catalog_sizes(datasets), seed=seed, member=self.member).generate()
+
+    def count_queries(self, names):
+        """
+        returns the queries run by the benchmark requests of the views (see benchmark.py),
+        by view and search term
+        """
+        # the counts are of uncached pages
+        cache.clear()
+        counts = {}
+        for case in benchmark_cases():
+            if case.name in names:
+                result = run_case(self.client, case, 0)
+                self.assertLess(result['status'], 500, case.key)
+                counts[(case.name, case.data.get('q'))] = result['first_queries']
+        return counts
+
+    def assertQueriesBounded(self, names):
+        self.generate(SMALL_CATALOG, seed=1)
+        small = self.count_queries(names)
+        self.generate(LARGE_CATALOG - SMALL_CATALOG, seed=2)
+        large = self.count_queries(names)
+
+        self.assertEqual(set(large), set(small))
+        for (name, term), count in large.items():
+            with self.subTest(view=name, q=term):
+                self.assertLessEqual(count, MAX_QUERIES[name])
+                self.assertLessEqual(count, small[(name, term)],
+                                     f"{name} runs {small[(name, term)]} queries on the small catalog "
+                                     f"and {count} on the larger one")
+
+    def test_index_views(self):
+        self.assertQueriesBounded(INDEX_VIEWS)
+
+    def test_detail_views(self):
+        self.assertQueriesBounded([name for name in MAX_QUERIES if name.endswith('-view')])
+
+    def test_search_view(self):
+        self.assertQueriesBounded(['full-search'])
+
+    def test_autocomplete_views(self):
+        self.assertQueriesBounded([name for name in MAX_QUERIES if name.startswith('autocomplete-')])
+
+    def test_workflow_views(self):
+        self.assertQueriesBounded([name for name in MAX_QUERIES if name.startswith('wizard-')])
+
+    def test_admin_changelists(self):
+        def count_queries():
+            counts = {}
+            for model_name in ADMIN_CHANGELISTS:
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.get(reverse(f'admin:datacatalog_{model_name}_changelist'))
+                self.assertEqual(response.status_code, 200, model_name)
+                counts[model_name] = len(queries)
+            return counts
+
+        self.generate(SMALL_CATALOG, seed=1)
+        small = count_queries()
+        self.generate(LARGE_CATALOG - SMALL_CATALOG, seed=2)
+        for model_name, count in count_queries().items():
+            with self.subTest(changelist=model_name):
+                self.assertLessEqual(count, small[model_name])
+
+
+class SearchBackendTestMixin:
+    """
+    Runs the same searches on each backend, over a fixed set of records: the data fields
+    are short documents that outrank everything else, and the unpublished datasets
+    outrank the published ones.
+    """
+    backend_class = None
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(username='search-user')
+        provider = DataProvider.objects.create(name='Search provider', record_author=author)
+        person = Person.objects.create(first_name='Search', last_name='Person', cwid='search-person')
+
+        for i in range(12):
+            Dataset.objects.create(title=f'Patient cohort study {i}', record_author=author, published=True,
+                                   description="a longitudinal study of admissions, outcomes and readmissions "
+                                               "across the hospitals of the network")
+        for i in range(3):
+            Dataset.objects.create(title=f'Patient cohort {i}', record_author=author, published=False)
+        Dataset.objects.create(title='Imaging registry', record_author=author, published=True)
+        for i in range(30):
+            DataField.objects.create(name=f'cohort{i}', description='patient cohort', record_author=author)
+        for i in range(2):
+            DataUseAgreement.objects.create(duaid=f'DUA-{i}', title=f'Patient cohort agreement {i}', publisher=provider,
+                                            contact=person, pi=person, record_author=author)
+        Keyword.objects.create(keyword='cohort', definition='a group of patients followed over time',
+                               record_author=author)
+
+    def setUp(self):
+        self.backend = self.backend_class()
+        self.backend.rebuild()
+
+    def counts(self, ranked):
+        return {label: len(pks) for label, pks in ranked.items() if pks}
+
+    def test_each_model_has_its_own_limit(self):
+        ranked = self.backend.search('patient cohort', limit=5)
+        self.assertEqual(self.counts(ranked), {'dataset': 5, 'datafield': 5, 'dua': 2, 'keyword': 1})
+
+    def test_tokens_match_word_prefixes(self):
+        ranked = self.backend.search('pati COH', limit=50)
+        self.assertEqual(self.counts(ranked), {'dataset': 15, 'datafield': 30, 'dua': 2, 'keyword': 1})
+
+    def test_every_token_must_match(self):
+        self.assertEqual(self.counts(self.backend.search('patient registry')), {})
+        self.assertEqual(self.counts(self.backend.search('imaging registry')), {'dataset': 1})
+        self.assertEqual(self.counts(self.backend.search('  ')), {})
+
+    def test_restriction_is_applied_before_the_limit(self):
+        published = Dataset.objects.filter(published=True)
+        ranked = self.backend.search('patient cohort', limit=12, querysets={'dataset': published})
+        self.assertEqual(len(ranked['dataset']), 12)
+        self.assertEqual(set(ranked['dataset']), set(published.filter(title__startswith='Patient'
+                                                                      ).values_list('pk', flat=True)))
+        # the other models are not restricted
+        self.assertEqual(len(ranked['datafield']), 12)
+
+
+class InvertedIndexBackendTests(SearchBackendTestMixin, TestCase):
+    backend_class = InvertedIndexBackend
+
+
+@skipUnless(connection.vendor == 'sqlite' and SQLiteFTSBackend.is_available(), "requires SQLite with FTS5")
+class SQLiteFTSBackendTests(SearchBackendTestMixin, TestCase):
+    backend_class = SQLiteFTSBackend
+
+
+@skipUnless(connection.vendor == 'postgresql', "requires PostgreSQL")
+class PostgresSearchBackendTests(SearchBackendTestMixin, TestCase):
+    backend_class = PostgresSearchBackend
+
+
+class PersonResolutionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='resolved-user', first_name='Resolved', last_name='User')
+        cls.person = Person.objects.create(first_name='Resolved', last_name='User', cwid='resolved-user')
+
+    def setUp(self):
+        cache.clear()
+
+    def request(self, user=None):
+        request = RequestFactory().get('/')
+        request.user = user or self.user
+        return request
+
+    def test_person_ids_are_cached(self):
+        self.assertEqual(person_id_for('resolved-user'), self.person.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(person_id_for('resolved-user'), self.person.pk)
+
+    def test_missing_people_are_not_cached(self):
+        self.assertIsNone(person_id_for('new-user'))
+        person = Person.objects.create(first_name='New', last_name='User', cwid='new-user')
+        self.assertEqual(person_id_for('new-user'), person.pk)
+
+    def test_changed_and_deleted_cwids_are_forgotten(self):
+        person_id_for('resolved-user')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.person.cwid = 'renamed-user'
+            self.person.save()
+        self.assertIsNone(person_id_for('resolved-user'))
+        self.assertEqual(person_id_for('renamed-user'), self.person.pk)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.person.delete()
+        self.assertIsNone(person_id_for('renamed-user'))
+
+    def test_resolved_once_per_request(self):
+        request = self.request()
+        with self.assertNumQueries(1):
+            self.assertEqual(get_person_id(request), self.person.pk)
+            self.assertEqual(get_person_id(request), self.person.pk)
+        with self.assertNumQueries(1):
+            self.assertEqual(get_person(request), self.person)
+            self.assertEqual(get_person(request), self.person)
+        # the id is cached for the following requests
+        with self.assertNumQueries(0):
+            self.assertEqual(get_person_id(self.request()), self.person.pk)
+
+    def test_check_or_create_user(self):
+        user = User.objects.create_user(username='unknown-user', first_name='Unknown', last_name='User')
+        request = self.request(user)
+        person = check_or_create_user(request)
+        self.assertEqual((person.cwid, person.first_name), ('unknown-user', 'Unknown'))
+        with self.assertNumQueries(0):
+            self.assertEqual(get_person(request), person)
+        self.assertEqual(check_or_create_user(self.request()), self.person)
+
+    def test_person_middleware(self):
+        request = self.request()
+        # the person is only looked up when a view uses it
+        with self.assertNumQueries(0):
+            PersonMiddleware(lambda request: None)(request)
+        self.assertEqual(request.person.cwid, 'resolved-user')
+        self.assertEqual(request.person, get_person(request))
+
+
+class DashboardCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='dashboard-user')
+        for i in range(3):
+            Dataset.objects.create(title=f'Dashboard dataset {i}', record_author=cls.user, published=i < 2)
+        DataAccess.objects.create(name='Dashboard location', record_author=cls.user, published=True)
+        cls.retention_request = RetentionRequest.objects.create(name='Dashboard request', milestone_pointer='end',
+                                                                record_author=cls.user)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_counts(self):
+        self.assertEqual(get_dashboard_counts(),
+                         {'ds_count': 2, 'dua_count': 0, 'access_count': 1, 'unlocked_requests': 1})
+
+    def test_counts_are_cached(self):
+        get_dashboard_counts()
+        with self.assertNumQueries(0):
+            self.assertEqual(get_dashboard_counts()['ds_count'], 2)
+
+    def test_counts_are_cleared_when_counted_records_change(self):
+        get_dashboard_counts()
+        with self.captureOnCommitCallbacks(execute=True):
+            Dataset.objects.create(title='Dashboard dataset 3', record_author=self.user, published=True)
+        self.assertEqual(get_dashboard_counts()['ds_count'], 3)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.retention_request.locked = True
+            self.retention_request.save()
+        self.assertEqual(get_dashboard_counts()['unlocked_requests'], 0)
+
+    def test_counts_are_cleared_by_the_admin_actions(self):
+        get_dashboard_counts()
+        with self.captureOnCommitCallbacks(execute=True):
+            make_published(None, None, Dataset.objects.filter(published=False))
+        self.assertEqual(get_dashboard_counts()['ds_count'], 3)
+
+    def test_counts_are_kept_until_the_transaction_commits(self):
+        get_dashboard_counts()
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            Dataset.objects.create(title='Dashboard dataset 3', record_author=self.user, published=True)
+            self.assertEqual(get_dashboard_counts()['ds_count'], 2)
+        self.assertTrue(callbacks)
+
+    def test_landing_page(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('datacatalog:index'))
+        self.assertEqual((response.context['ds_count'], response.context['access_count']), (2, 1))
+
+
+@modify_settings(MIDDLEWARE={'prepend': 'datacatalog.middleware.InstrumentationMiddleware'})
+class InstrumentationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='instrumented-user')
+        cls.staff = User.objects.create_user(username='instrumented-staff', is_staff=True)
+        for i in range(3):
+            Dataset.objects.create(title=f'Instrumented dataset {i}', record_author=cls.user, published=True)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_requests_are_logged_and_aggregated(self):
+        self.client.force_login(self.user)
+        with self.assertLogs('datacatalog.instrumentation', 'INFO') as logs:
+            self.client.get(reverse('datacatalog:datasets'))
+        self.assertEqual(len(logs.records), 1)
+        self.assertIn('GET /datasets (datacatalog:datasets): 200 OK', logs.output[0])
+        self.assertRegex(logs.output[0], r'\d+ queries in [\d.]+ ms, render [\d.]+ ms')
+
+        self.client.get(reverse('datacatalog:datasets'))
+        stats = {row['view_name']: row for row in get_stats()}
+        self.assertEqual(stats['datacatalog:datasets']['requests'], 2)
+        self.assertEqual(stats['datacatalog:datasets']['rendered'], 2)
+        self.assertGreater(stats['datacatalog:datasets']['max_queries'], 0)
+
+    @override_settings(DATACATALOG_INSTRUMENTATION_REPEATS=0)
+    def test_repeated_queries_are_warned_of(self):
+        self.client.force_login(self.user)
+        with self.assertLogs('datacatalog.instrumentation', 'WARNING') as logs:
+            self.client.get(reverse('datacatalog:datasets'))
+        self.assertTrue(all('query repeated' in line for line in logs.output))
+        self.assertTrue(get_stats()[0]['repeated'])
+
+    def test_other_apps_are_not_recorded(self):
+        self.client.force_login(self.user)
+        self.client.get('/no-such-page')
+        self.assertEqual(get_stats(), [])
+
+    def test_stats_page_is_staff_only(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(reverse('datacatalog:instrumentation-stats')).status_code, 403)
+        self.assertEqual(self.client.post(reverse('datacatalog:instrumentation-stats')).status_code, 403)
+
+    def test_stats_page(self):
+        self.client.force_login(self.staff)
+        self.client.get(reverse('datacatalog:datasets'))
+        response = self.client.get(reverse('datacatalog:instrumentation-stats'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['view_name'] for row in response.context['stats']],
+                         ['datacatalog:datasets'])
+        self.assertContains(response, 'datacatalog:datasets')
+
+        response = self.client.post(reverse('datacatalog:instrumentation-stats'))
+        self.assertRedirects(response, reverse('datacatalog:instrumentation-stats'))
+        # the stats page itself is recorded again after the reset
+        self.assertEqual({row['view_name'] for row in get_stats()}, {'datacatalog:instrumentation-stats'})
+
+
+class KeysetPaginationTests(TestCase):
+    """
+    Pages through datasets that share their record_update dates, so that the order
+    within each date is decided by the pk tiebreaker.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='pagination-user')
+        for i in range(25):
+            Dataset.objects.create(title=f'Paged dataset {i}', record_author=cls.user, published=True)
+        # three dates for 25 datasets
+        for n, pk in enumerate(Dataset.objects.order_by('pk').values_list('pk', flat=True)):
+            Dataset.objects.filter(pk=pk).update(record_update=date(2020, 1, 1) + timedelta(days=n % 3))
+
+    def walk(self, page_size, ordering):
+        pages, cursor = [], None
+        while True:
+            page = keyset_page(Dataset.objects.all(), page_size, cursor=cursor, ordering=ordering)
+            pages.append([ds.pk for ds in page])
+            if not page.has_next:
+                return pages
+            cursor = page.next_cursor
+
+    def test_pages_follow_the_ordering_across_ties(self):
+        for ordering in (('-record_update', '-pk'), ('record_update', 'pk')):
+            with self.subTest(ordering=ordering):
+                pages = self.walk(7, ordering)
+                self.assertEqual([len(page) for page in pages], [7, 7, 7, 4])
+                expected = list(Dataset.objects.order_by(*ordering).values_list('pk', flat=True))
+                self.assertEqual([pk for page in pages for pk in page], expected)
+
+    def test_last_full_page_has_no_next_cursor(self):
+        self.assertEqual([len(page) for page in self.walk(5, ('-record_update', '-pk'))], [5] * 5)
+
+    def test_invalid_cursors_raise_404(self):
+        ordering = ('-record_update', '-pk')
+        for cursor in ('not a cursor', encode_cursor(['2020-01-01']), encode_cursor(['yesterday', 1]),
+                       encode_cursor({'pk': 1})):
+            with self.subTest(cursor=cursor), self.assertRaises(Http404):
+                keyset_page(Dataset.objects.all(), 10, cursor=cursor, ordering=ordering)
+
+    def test_view_pages(self):
+        self.client.force_login(self.user)
+        url = reverse('datacatalog:datasets')
+
+        response = self.client.get(url, {'page_size': 10})
+        page = response.context['page_obj']
+        self.assertEqual(len(page), 10)
+        self.assertContains(response, f'?cursor={page.next_cursor}&page_size=10')
+
+        response = self.client.get(url, {'page_size': 10, 'cursor': page.next_cursor})
+        self.assertEqual(len(response.context['page_obj']), 10)
+        self.assertTrue(response.context['page_obj'].has_previous)
+
+        self.assertEqual(self.client.get(url, {'cursor': 'not a cursor'}).status_code, 404)
+
+    def test_view_page_size(self):
+        self.client.force_login(self.user)
+        url = reverse('datacatalog:datasets')
+        for page_size, expected in (('abc', KeysetPaginationMixin.paginate_by), ('0', 1), ('-3', 1),
+                                    ('100000', KeysetPaginationMixin.max_paginate_by)):
+            with self.subTest(page_size=page_size):
+                response = self.client.get(url, {'page_size': page_size})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.context['page_obj'].page_size, expected)
+
+
+class DataProviderCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='provider-user')
+        cls.both = DataProvider.objects.create(name='Source and publisher', record_author=cls.user, published=True)
+        cls.source = DataProvider.objects.create(name='Source only', record_author=cls.user, published=True)
+        cls.unpublished = DataProvider.objects.create(name='Unpublished datasets', record_author=cls.user,
+                                                      published=True)
+        for i in range(4):
+            Dataset.objects.create(title=f'Both {i}', publisher=cls.both, data_source=cls.both,
+                                   record_author=cls.user, published=i != 0)
+        Dataset.objects.create(title='Source', publisher=cls.unpublished, data_source=cls.source,
+                               record_author=cls.user, published=True)
+        Dataset.objects.create(title='Unpublished', publisher=cls.unpublished, data_source=cls.unpublished,
+                               record_author=cls.user, published=False)
+
+    def test_published_counts(self):
+        counts = {pv.pk: (pv.published_source_count, pv.published_publisher_count)
+                  for pv in DataProvider.objects.with_published_counts()}
+        self.assertEqual(counts, {self.both.pk: (3, 3), self.source.pk: (1, 0), self.unpublished.pk: (0, 1)})
+
+    def test_providers_with_published_datasets(self):
+        self.assertEqual(set(DataProvider.objects.with_published_datasets()),
+                         {self.both, self.source, self.unpublished})
+        Dataset.objects.filter(title='Source').update(published=False)
+        self.assertEqual(set(DataProvider.objects.with_published_datasets()), {self.both})
+
+
+class FileServingTests(TestCase):
+    content = b'0123456789abcdef'
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        field = models.FileField(storage=FileSystemStorage(location=self.directory))
+        self.file = FieldFile(None, field, 'files/document.txt')
+        self.file.storage.save(self.file.name, ContentFile(self.content))
+        self.factory = RequestFactory()
+
+    def serve(self, **headers):
+        response = serve_file(self.factory.get('/', **headers), self.file, 'text/plain')
+        body = b''.join(response.streaming_content) if response.streaming else response.content
+        return response, body
+
+    def test_whole_file(self):
+        response, body = self.serve()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body, self.content)
+        self.assertEqual(response['Content-Length'], str(len(self.content)))
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['Content-Disposition'], 'inline; filename="document.txt"')
+
+    def test_byte_ranges(self):
+        for header, status, body, content_range in (('bytes=0-3', 206, b'0123', 'bytes 0-3/16'),
+                                                    ('bytes=-5', 206, b'bcdef', 'bytes 11-15/16'),
+                                                    ('bytes=12-', 206, b'cdef', 'bytes 12-15/16'),
+                                                    ('bytes=10-99', 206, b'abcdef', 'bytes 10-15/16'),
+                                                    ('bytes=16-20', 416, b'', 'bytes */16'),
+                                                    ('bytes=-0', 416, b'', 'bytes */16'),
+                                                    ('bytes=0-1,4-5', 200, self.content, None)):
+            with self.subTest(range=header):
+                response, content = self.serve(HTTP_RANGE=header)
+                self.assertEqual(response.status_code, status)
+                self.assertEqual(content, body)
+                self.assertEqual(response.get('Content-Range'), content_range)
+
+    def test_if_range(self):
+        etag = self.serve()[0]['ETag']
+        self.assertEqual(self.serve(HTTP_RANGE='bytes=0-3', HTTP_IF_RANGE=etag)[0].status_code, 206)
+        response, body = self.serve(HTTP_RANGE='bytes=0-3', HTTP_IF_RANGE='"stale"')
+        self.assertEqual((response.status_code, body), (200, self.content))
+
+    def test_if_none_match(self):
+        etag = self.serve()[0]['ETag']
+        for header in (etag, f'"other", {etag}', '*'):
+            with self.subTest(if_none_match=header):
+                response, body = self.serve(HTTP_IF_NONE_MATCH=header)
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response['ETag'], etag)
+        self.assertEqual(self.serve(HTTP_IF_NONE_MATCH='"other"')[0].status_code, 200)
+
+        # a changed file has another ETag
+        self.file.storage.delete(self.file.name)
+        self.file.storage.save(self.file.name, ContentFile(self.content + b'!'))
+        self.assertEqual(self.serve(HTTP_IF_NONE_MATCH=etag)[0].status_code, 200)
+
+    def test_missing_file(self):
+        self.file.storage.delete(self.file.name)
+        with self.assertRaises(Http404):
+            self.serve()
+
+    @override_settings(DATACATALOG_SENDFILE='x-accel-redirect', DATACATALOG_SENDFILE_URL='/protected/')
+    def test_offloaded_to_the_web_server(self):
+        response, body = self.serve()
+        self.assertEqual(response['X-Accel-Redirect'], '/protected/files/document.txt')
+        self.assertEqual(body, b'')
+
+
+class PermissionResolverTests(TestCase):
+    """
+    A project with a PI, another PI and an editor, and a project none of them belong
+    to, with data locations that are private, public or restricted to a non-member.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(username='permission-author')
+        cls.users = {}
+        persons = {}
+        for role in ('pi', 'other-pi', 'editor', 'non-member', 'outsider-pi'):
+            cls.users[role] = User.objects.create_user(username=f'perm-{role}')
+            persons[role] = Person.objects.create(first_name=role, last_name='Tester', cwid=f'perm-{role}')
+        cls.users['no-person'] = User.objects.create_user(username='perm-no-person')
+        cls.users['staff'] = User.objects.create_user(username='perm-staff', is_staff=True)
+        cls.users['staff'].user_permissions.set(Permission.objects.filter(
+            codename__in=['view_project', 'view_dataaccess', 'view_retentionrequest']))
+
+        cls.project = Project.objects.create(name='Member project', pi=persons['pi'], record_author=author)
+        cls.project.other_pis.add(persons['other-pi'])
+        cls.project.other_editors.add(persons['editor'])
+        cls.other_project = Project.objects.create(name='Other project', pi=persons['outsider-pi'],
+                                                   record_author=author)
+
+        def access(name, project, **kwargs):
+            return DataAccess.objects.create(name=name, project=project, record_author=author, published=True,
+                                             **kwargs)
+
+        cls.accesses = {'member': access('Member location', cls.project),
+                        'private': access('Private location', cls.other_project),
+                        'public': access('Public location', cls.other_project, public=True),
+                        'restricted': access('Restricted location', cls.other_project),
+                        'no project': access('Location without project', None),
+                        }
+        cls.accesses['restricted'].restricted.add(persons['non-member'])
+        cls.requests = {'member': RetentionRequest.objects.create(name='Member request', project=cls.project,
+                                                                  milestone_pointer='end', record_author=author),
+                        'other': RetentionRequest.objects.create(name='Other request', project=cls.other_project,
+                                                                 milestone_pointer='end', record_author=author),
+                        }
+
+    def expected(self, role):
+        if role == 'staff':
+            return ({self.project, self.other_project}, set(self.accesses.values()), set(self.requests.values()))
+        if role in ('pi', 'other-pi', 'editor'):
+            return ({self.project}, {self.accesses['member'], self.accesses['public']}, {self.requests['member']})
+        if role == 'non-member':
+            return (set(), {self.accesses['public'], self.accesses['restricted']}, set())
+        return (set(), {self.accesses['public']}, set())
+
+    def test_can_view_and_viewable_agree(self):
+        for role in ('staff', 'pi', 'other-pi', 'editor', 'non-member', 'no-person'):
+            with self.subTest(role=role):
+                resolver = PermissionResolver(self.users[role])
+                for model, expected in zip((Project, DataAccess, RetentionRequest), self.expected(role)):
+                    objects = model.objects.all()
+                    self.assertEqual({obj for obj in objects if resolver.can_view(obj)}, expected)
+                    self.assertEqual(set(resolver.viewable(objects)), expected)
+
+    def test_memberships_are_loaded_once(self):
+        resolver = PermissionResolver(self.users['editor'])
+        objects = [*Project.objects.all(), *DataAccess.objects.all(), *RetentionRequest.objects.all()]
+        with CaptureQueriesContext(connection) as first:
+            [resolver.can_view(obj) for obj in objects]
+        self.assertLessEqual(len(first), 5)
+        with self.assertNumQueries(0):
+            [resolver.can_view(obj) for obj in objects * 3]
+
+    def test_unsupported_models(self):
+        with self.assertRaises(TypeError):
+            PermissionResolver(self.users['pi']).can_view(self.users['pi'])
+
+    def test_list_views_show_the_viewable_records(self):
+        for role in ('staff', 'editor', 'non-member'):
+            with self.subTest(role=role):
+                self.client.force_login(self.users[role])
+                projects, accesses, requests = self.expected(role)
+                response = self.client.get(reverse('datacatalog:access'))
+                self.assertEqual(set(response.context['access_list']), accesses)
+                response = self.client.get(reverse('datacatalog:retention'))
+                self.assertEqual(set(response.context['retention_requests']), requests)
+
+
+class RetentionArchiveTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser(username='archive-user')
+        cls.retention_request = RetentionRequest.objects.create(name='Archive request', milestone_pointer='end',
+                                                                record_author=cls.user)
+        for i in range(3):
+            data_access = DataAccess.objects.create(name=f'Archived location {i}', record_author=cls.user)
+            cls.retention_request.to_archive.add(data_access)
+        cls.other = DataAccess.objects.create(name='Other location', record_author=cls.user)
+
+    def test_mark_archived(self):
+        DataAccess.objects.update(record_update=date(2020, 1, 1))
+        self.assertEqual(self.retention_request.mark_archived(), 3)
+
+        self.assertEqual(sorted(DataAccess.objects.filter(data_retained=True).values_list('name', flat=True)),
+                         ['Archived location 0', 'Archived location 1', 'Archived location 2'])
+        self.assertEqual(DataAccess.objects.filter(record_update=date.today()).count(), 3)
+        self.assertFalse(DataAccess.objects.get(pk=self.other.pk).data_retained)
+        self.retention_request.refresh_from_db()
+        self.assertTrue(self.retention_request.archived and self.retention_request.locked)
+
+    def test_one_update_however_many_locations(self):
+        counts = []
+        for extra in (0, 20):
+            for i in range(extra):
+                self.retention_request.to_archive.add(
+                    DataAccess.objects.create(name=f'Extra location {i}', record_author=self.user))
+            with CaptureQueriesContext(connection) as queries:
+                self.retention_request.mark_archived()
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_archiving_from_the_retention_page(self):
+        self.client.force_login(self.user)
+        url = reverse('datacatalog:retention-view', kwargs={'pk': self.retention_request.pk})
+        self.client.post(url, {'markarchived': ''})
+        job, = claim_jobs(10)
+        self.assertEqual(run_job(job).result, "3 data locations marked as archived, request locked")
+        self.assertEqual(DataAccess.objects.filter(data_retained=True).count(), 3)
+
+
+class TemporaryMediaMixin:
+    """
+    stores the files written by a test in a temporary MEDIA_ROOT
+    """
+    def setUp(self):
+        super(TemporaryMediaMixin, self).setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+
+class UploadTests(TemporaryMediaMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='upload-user')
+        cls.first = DataAccess.objects.create(name='First location', record_author=cls.user)
+        cls.second = DataAccess.objects.create(name='Second location', record_author=cls.user)
+
+    def stored(self, data_access):
+        return sorted(default_storage.listdir(archive_directory(data_access))[1])
+
+    def test_checksums_and_sizes(self):
+        archive_files = store_uploads(self.first, [SimpleUploadedFile('a.txt', b'first file'),
+                                                   SimpleUploadedFile('b.txt', b'second file!')])
+        self.assertEqual([(af.name, af.size, af.sha256) for af in archive_files],
+                         [('a.txt', 10, hashlib.sha256(b'first file').hexdigest()),
+                          ('b.txt', 12, hashlib.sha256(b'second file!').hexdigest())])
+        self.assertEqual(self.stored(self.first), ['a.txt', 'b.txt'])
+        with default_storage.open(archive_files[1].path) as fh:
+            self.assertEqual(fh.read(), b'second file!')
+
+    def test_storage_that_does_not_read_chunks(self):
+        class ReadingStorage(FileSystemStorage):
+            # reads the whole file at once, as some remote storage backends do
+            def _save(self, name, content):
+                return super(ReadingStorage, self)._save(name, ContentFile(content.read()))
+
+        with mock.patch('datacatalog.uploads.default_storage', ReadingStorage()):
+            archive_file, = store_uploads(self.first, [SimpleUploadedFile('a.txt', b'read at once')])
+        self.assertEqual((archive_file.size, archive_file.sha256),
+                         (12, hashlib.sha256(b'read at once').hexdigest()))
+
+    def test_duplicates_within_an_upload(self):
+        a, b, c = store_uploads(self.first, [SimpleUploadedFile('a.txt', b'same'),
+                                             SimpleUploadedFile('b.txt', b'same'),
+                                             SimpleUploadedFile('c.txt', b'other')])
+        self.assertEqual((a.duplicate_of, b.duplicate_of, c.duplicate_of), (None, a, None))
+        self.assertEqual(b.path, a.path)
+        self.assertEqual(self.stored(self.first), ['a.txt', 'c.txt'])
+        self.assertEqual(ArchiveFile.objects.filter(data_access=self.first).count(), 3)
+
+    def test_duplicates_across_data_locations(self):
+        original, = store_uploads(self.first, [SimpleUploadedFile('a.txt', b'same')])
+        copy, new = store_uploads(self.second, [SimpleUploadedFile('copy.txt', b'same'),
+                                                SimpleUploadedFile('new.txt', b'new')])
+        self.assertEqual(ArchiveFile.objects.get(data_access=self.second, name='copy.txt').duplicate_of, original)
+        self.assertEqual(copy.path, original.path)
+        self.assertIsNone(new.duplicate_of)
+        self.assertEqual(self.stored(self.second), ['new.txt'])
+
+    def test_inventory_upload_without_a_file(self):
+        retention_request = RetentionRequest.objects.create(name='Inventory request', milestone_pointer='end',
+                                                            record_author=self.user)
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('datacatalog:retention-view', kwargs={'pk': retention_request.pk}),
+                                    {'submitinventory': 'Upload inventory'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual([str(m) for m in get_messages(response.wsgi_request)], ["No inventory file was uploaded."])
+        self.assertFalse(Job.objects.exists())
+
+        # a request with an inventory attached already needs a new file as well
+        retention_request.inventory = 'inventory/previous.xlsx'
+        retention_request.save()
+        response = self.client.post(reverse('datacatalog:retention-view', kwargs={'pk': retention_request.pk}),
+                                    {'submitinventory': 'Upload inventory'})
+        self.assertEqual([str(m) for m in get_messages(response.wsgi_request)][-1], "No inventory file was uploaded.")
+
+
+class JobTests(TemporaryMediaMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='job-user')
+        cls.data_access = DataAccess.objects.create(name='Job location', record_author=cls.user)
+        cls.retention_request = RetentionRequest.objects.create(name='Job request', milestone_pointer='end',
+                                                                record_author=cls.user)
+
+    def staging_contents(self):
+        if not default_storage.exists('staging'):
+            return []
+        return default_storage.listdir('staging')[0]
+
+    def stored_names(self):
+        return sorted(default_storage.listdir(archive_directory(self.data_access))[1])
+
+    def run_queued(self):
+        return [run_job(job) for job in claim_jobs(10)]
+
+    def abandon(self, job, attempts):
+        # as left by a worker that stopped while running the job
+        Job.objects.filter(pk=job.pk).update(status=Job.RUNNING, attempts=attempts,
+                                             started=timezone.now() - timedelta(hours=2))
+
+    def test_staging_directories_are_removed(self):
+        queue_uploads(self.data_access, [SimpleUploadedFile('a.txt', b'a'), SimpleUploadedFile('b.txt', b'b')])
+        queue_inventory(self.retention_request, SimpleUploadedFile('inventory.csv', b'path,size'))
+        self.assertEqual(len(self.staging_contents()), 3)
+
+        self.assertEqual([job.status for job in self.run_queued()], [Job.DONE, Job.DONE])
+        self.assertEqual(self.staging_contents(), [])
+        self.assertEqual(self.stored_names(), ['a.txt', 'b.txt'])
+
+    def test_failed_inventory_is_discarded(self):
+        queue_inventory(self.retention_request, SimpleUploadedFile('inventory.csv', b'path,size'))
+        with mock.patch.object(RetentionRequest, 'save', side_effect=RuntimeError("storage is down")):
+            job, = self.run_queued()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertIn("storage is down", job.error)
+        self.assertEqual(self.staging_contents(), [])
+
+    @override_settings(DATACATALOG_JOB_TIMEOUT=3600, DATACATALOG_JOB_MAX_ATTEMPTS=3)
+    def test_abandoned_jobs_are_run_again(self):
+        job = queue_inventory(self.retention_request, SimpleUploadedFile('inventory.csv', b'path,size'))
+        self.abandon(job, attempts=2)
+        self.assertEqual(reclaim_stale_jobs(), (1, 0))
+
+        job, = self.run_queued()
+        self.assertEqual((job.status, Job.objects.get(pk=job.pk).attempts), (Job.DONE, 3))
+        self.assertEqual(self.staging_contents(), [])
+
+    @override_settings(DATACATALOG_JOB_TIMEOUT=3600, DATACATALOG_JOB_MAX_ATTEMPTS=3)
+    def test_jobs_abandoned_too_often_are_failed(self):
+        job = queue_inventory(self.retention_request, SimpleUploadedFile('inventory.csv', b'path,size'))
+        self.abandon(job, attempts=3)
+        self.assertEqual(self.run_queued(), [])
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(job.error, "Abandoned by its worker 3 times")
+        self.assertEqual(self.staging_contents(), [])
+
+    def test_worker_claims_jobs_as_workers_free_up(self):
+        jobs = [Job.objects.create(task='mark_archived', description=f'job {i}') for i in range(3)]
+        third_started = threading.Event()
+        finished = []
+
+        def run(job):
+            # the first job only finishes once the third has been claimed by the freed worker
+            if job.pk == jobs[0].pk:
+                third_started.wait(timeout=5)
+            elif job.pk == jobs[2].pk:
+                third_started.set()
+            job.status = Job.DONE
+            finished.append(job.pk)
+            return job
+
+        out = io.StringIO()
+        with mock.patch('datacatalog.management.commands.run_jobs.run_job', side_effect=run):
+            call_command('run_jobs', workers=2, once=True, interval=0.1, stdout=out)
+        self.assertEqual(finished, [jobs[1].pk, jobs[2].pk, jobs[0].pk])
+        self.assertTrue(third_started.is_set())
+        self.assertEqual(len(out.getvalue().splitlines()), 3)
+        self.assertEqual(Job.objects.filter(status=Job.RUNNING).count(), 3)
+
+    @override_settings(DATACATALOG_JOB_TIMEOUT=3600)
+    def test_running_jobs_are_left_alone(self):
+        job = queue_inventory(self.retention_request, SimpleUploadedFile('inventory.csv', b'path,size'))
+        Job.objects.filter(pk=job.pk).update(status=Job.RUNNING, attempts=1,
+                                             started=timezone.now() - timedelta(minutes=30))
+        self.assertEqual(reclaim_stale_jobs(), (0, 0))
+        self.assertEqual(self.run_queued(), [])
+        self.assertEqual(Job.objects.get(pk=job.pk).status, Job.RUNNING)
+
+
+class DataDictionaryTests(TemporaryMediaMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='dictionary-user')
+
+    def read(self, content, filename):
+        return list(read_dictionary(io.BytesIO(content), filename))
+
+    def test_delimited_files(self):
+        expected = [('age', 'Age at admission', 'years'), ('sex', 'Sex at birth', None)]
+        # headings are matched case-insensitively, with underscores as spaces, after a byte order mark
+        self.assertEqual(self.read('\ufeffVariable_Name,Label,Values\nage,Age at admission,years\n'
+                                   'sex,Sex at birth,\n,no name,\n'.encode(), 'dictionary.csv'), expected)
+        self.assertEqual(self.read(b'name;description;scope\nage;Age at admission;years\nsex;Sex at birth;\n',
+                                   'dictionary.csv'), expected)
+        self.assertEqual(self.read(b'field\tdefinition\tscope\nage\tAge at admission\tyears\n'
+                                   b'sex\tSex at birth\t\n', 'dictionary.tsv'), expected)
+
+    def test_json_files(self):
+        expected = [('age', 'Age at admission', None)]
+        self.assertEqual(self.read(b'{"fields": [{"name": "age", "description": "Age at admission"}]}',
+                                   'schema.json'), expected)
+        self.assertEqual(self.read(b'{"name": "age", "description": "Age at admission"}\n\n', 'fields.jsonl'),
+                         expected)
+
+    def test_unreadable_files(self):
+        for content, filename in ((b'%PDF-1.4', 'dictionary.pdf'),
+                                  (b'description,scope\nAge,years\n', 'dictionary.csv'),
+                                  (b'{"name": ', 'dictionary.json'),
+                                  (b'"a dictionary"', 'dictionary.json')):
+            with self.subTest(filename=filename, content=content), self.assertRaises(DictionaryError):
+                self.read(content, filename)
+
+    def test_parsed_on_upload(self):
+        for filename in ('dictionary.csv', 'DICTIONARY.TSV'):
+            self.assertTrue(parsed_on_upload(filename))
+        for filename in ('dictionary.pdf', 'dictionary.docx', 'dictionary.json', 'dictionary'):
+            self.assertFalse(parsed_on_upload(filename))
+
+    def dataset_with_dictionary(self, content, filename='dictionary.csv'):
+        dataset = Dataset.objects.create(title=f'Dictionary dataset {Dataset.objects.count()}',
+                                         record_author=self.user)
+        dataset.data_dictionary.save(filename, ContentFile(content))
+        return dataset
+
+    def test_import_and_reimport(self):
+        dataset = self.dataset_with_dictionary(b'name,description\nage,Age\nsex,Sex\n')
+        self.assertEqual(import_dictionary(dataset), (2, 2))
+        self.assertEqual(import_dictionary(dataset), (2, 0))
+        self.assertEqual(sorted(dataset.data_fields.values_list('name', 'description')),
+                         [('age', 'Age'), ('sex', 'Sex')])
+
+        # an updated dictionary updates the fields already linked, by name
+        dataset.data_dictionary.save('dictionary.csv', ContentFile(b'name,description\nage,Age in years\nbmi,BMI\n'))
+        self.assertEqual(import_dictionary(dataset), (2, 1))
+        self.assertEqual(sorted(dataset.data_fields.values_list('name', 'description')),
+                         [('age', 'Age in years'), ('bmi', 'BMI'), ('sex', 'Sex')])
+
+    def test_fields_of_other_datasets_are_not_shared(self):
+        first = self.dataset_with_dictionary(b'name,description\nage,Age\n')
+        second = self.dataset_with_dictionary(b'name,description\nage,Age of the patient\n')
+        import_dictionary(first)
+        self.assertEqual(import_dictionary(second), (1, 1))
+        self.assertEqual(first.data_fields.get().description, 'Age')
+        self.assertEqual(second.data_fields.get().description, 'Age of the patient')
+
+    def test_imported_fields_are_searchable(self):
+        backends = [InvertedIndexBackend()]
+        if connection.vendor == 'sqlite' and SQLiteFTSBackend.is_available():
+            backends.append(SQLiteFTSBackend())
+        for backend in backends:
+            with self.subTest(backend=type(backend).__name__), mock.patch('datacatalog.search._backend', backend):
+                backend.rebuild()
+                dataset = self.dataset_with_dictionary(b'name,description\nzzyxlevel,Level\nage,Age\n')
+                import_dictionary(dataset)
+                self.assertEqual([field.name for field in search_catalog('zzyxlevel')['datafield']], ['zzyxlevel'])
+
+                # updated descriptions are indexed too
+                dataset.data_dictionary.save('dictionary.csv', ContentFile(b'name,description\nage,Qwertyage\n'))
+                import_dictionary(dataset)
+                self.assertEqual([field.name for field in search_catalog('qwertyage')['datafield']], ['age'])
+                DataField.objects.all().delete()
+
+    def test_new_keys_are_fetched_back_by_name(self):
+        # a field of the same author and name, linked to another dataset, is not taken for a new one
+        other = self.dataset_with_dictionary(b'name,description\nage,Age\n')
+        import_dictionary(other)
+        dataset = self.dataset_with_dictionary(b'name,description\nsex,Sex\nage,Age of the patient\n')
+        with mock.patch.object(connection.features, 'can_return_rows_from_bulk_insert', False):
+            self.assertEqual(import_dictionary(dataset), (2, 2))
+        self.assertEqual(sorted(dataset.data_fields.values_list('name', 'description')),
+                         [('age', 'Age of the patient'), ('sex', 'Sex')])
+        self.assertEqual(list(other.data_fields.values_list('description', flat=True)), ['Age'])
+
+    def test_fields_are_written_in_bulk(self):
+        rows = "".join(f"field{i},Field {i}\n" for i in range(200))
+        dataset = self.dataset_with_dictionary(f"name,description\n{rows}".encode())
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(import_dictionary(dataset), (200, 200))
+        self.assertLess(len(queries), 15)
+        self.assertEqual(dataset.data_fields.count(), 200)
+
+
+class DATSImportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='dats-user')
+        cls.cil = ConfidentialityImpact.objects.create(record_author=cls.user, impact_level='High', impact_rank=1,
+                                                       standard='NIST', definition='High impact',
+                                                       link='https://example.org/nist')
+
+    def record(self, title, **extra):
+        return dict({'title': title}, **extra)
+
+    def run_import(self, records, **kwargs):
+        importer = DATSImporter(self.user, **kwargs)
+        for stats in importer.run(enumerate(records, 1)):
+            pass
+        return importer
+
+    def test_create(self):
+        importer = self.run_import([
+            self.record('Cohort study',
+                        identifier={'identifier': 'DS-1'},
+                        description='A cohort',
+                        dates=[{'date': '2020-01-31', 'type': {'value': 'release date'}}],
+                        creators=[{'name': 'Clinic'}],
+                        storedIn={'publishers': [{'name': 'Hospital'}]},
+                        keywords=[{'value': 'cohort'}, {'value': 'Cohort'}],
+                        distributions=[{'formats': ['text/csv'], 'access': {'landingPage': 'https://example.org'}}],
+                        privacy='NIST: High',
+                        extraProperties=[{'category': 'Number of records', 'values': [{'value': '12'}]}]),
+            self.record('Registry'),
+        ], publish=True)
+        self.assertEqual(importer.stats, {'created': 2, 'updated': 0, 'skipped': 0, 'rejected': 0})
+
+        dataset = Dataset.objects.get(ds_id='DS-1')
+        self.assertEqual((dataset.title, dataset.description, dataset.publication_date, dataset.num_records,
+                          dataset.landing_url, dataset.published),
+                         ('Cohort study', 'A cohort', date(2020, 1, 31), 12, 'https://example.org', True))
+        self.assertEqual((dataset.publisher.name, dataset.data_source.name), ('Hospital', 'Clinic'))
+        self.assertEqual([kw.keyword.lower() for kw in dataset.keywords.all()], ['cohort'])
+        self.assertEqual([str(m) for m in dataset.media_subtype.all()], ['text/csv'])
+        self.assertEqual(list(dataset.cil.all()), [self.cil])
+        self.assertEqual(Dataset.objects.get(title='Registry').keywords.count(), 0)
+
+    def test_skip_existing(self):
+        Dataset.objects.create(title='Cohort Study', ds_id='DS-1', record_author=self.user)
+        Dataset.objects.create(title='Registry', record_author=self.user)
+        importer = self.run_import([
+            self.record('Renamed', identifier={'identifier': 'DS-1'}),
+            # titles are matched ignoring case and whitespace
+            self.record(' registry\n', description='changed'),
+            self.record('New'),
+        ])
+        self.assertEqual(importer.stats, {'created': 1, 'updated': 0, 'skipped': 2, 'rejected': 0})
+        self.assertFalse(Dataset.objects.filter(title='Renamed').exists())
+        self.assertIsNone(Dataset.objects.get(title='Registry').description)
+
+    def test_update(self):
+        publisher = DataProvider.objects.create(name='Hospital', record_author=self.user)
+        dataset = Dataset.objects.create(title='Cohort Study', ds_id='DS-1', description='old', num_records=5,
+                                         publisher=publisher, record_author=self.user)
+        importer = self.run_import([
+            self.record('Cohort  study', description='new', keywords=[{'value': 'cohort'}]),
+        ], update=True)
+        self.assertEqual(importer.stats, {'created': 0, 'updated': 1, 'skipped': 0, 'rejected': 0})
+
+        dataset.refresh_from_db()
+        self.assertEqual((dataset.title, dataset.ds_id, dataset.description, dataset.num_records),
+                         ('Cohort  study', 'DS-1', 'new', 5))
+        # references left out of the record are kept
+        self.assertEqual(dataset.publisher, publisher)
+        self.assertEqual([kw.keyword for kw in dataset.keywords.all()], ['cohort'])
+
+    def test_reject(self):
+        Dataset.objects.create(title='Cohort', ds_id='DS-1', record_author=self.user)
+        Dataset.objects.create(title='Registry', ds_id='DS-2', record_author=self.user)
+        Dataset.objects.create(title='Study', ds_id='DS-3', record_author=self.user)
+        importer = self.run_import([
+            self.record('', description='no title'),
+            self.record('Trial', dates=[{'date': '2020-13-45', 'type': {'value': 'start date'}}]),
+            DATSError("invalid JSON"),
+            # takes the title of another dataset
+            self.record('Registry', identifier={'identifier': 'DS-1'}, keywords=[{'value': 'registry'}]),
+            self.record('Study update', identifier={'identifier': 'DS-3'}),
+            self.record('Trial'),
+        ], update=True)
+        self.assertEqual(importer.stats, {'created': 1, 'updated': 1, 'skipped': 0, 'rejected': 4})
+        self.assertEqual([line_number for line_number, message in importer.errors], [1, 2, 3, 4])
+        self.assertEqual(sorted(Dataset.objects.values_list('title', 'ds_id')),
+                         [('Cohort', 'DS-1'), ('Registry', 'DS-2'), ('Study update', 'DS-3'), ('Trial', None)])
+        self.assertEqual(Keyword.objects.filter(dataset__isnull=False).count(), 0)
+
+    def test_keys_are_fetched_back_by_value(self):
+        # as on databases that cannot return the keys of a bulk insert
+        Keyword.objects.create(keyword='older', definition='', record_author=self.user)
+        keywords = [Keyword(keyword=name, definition='', record_author=self.user) for name in ('second', 'first')]
+        with mock.patch.object(connection.features, 'can_return_rows_from_bulk_insert', False):
+            save_new(Keyword, keywords, 'keyword')
+        self.assertEqual({kw.keyword: kw.pk for kw in keywords},
+                         dict(Keyword.objects.filter(keyword__in=['first', 'second']).values_list('keyword', 'pk')))
+
+    def test_export_round_trip(self):
+        self.run_import([
+            self.record('Cohort study',
+                        identifier={'identifier': 'DS-1'},
+                        description='A cohort',
+                        dates=[{'date': '2020-01-31', 'type': {'value': 'publication date'}},
+                               {'date': '2019-01-01', 'type': {'value': 'start date'}}],
+                        creators=[{'name': 'Clinic'}],
+                        keywords=[{'value': 'cohort'}],
+                        distributions=[{'formats': ['text/csv']}],
+                        privacy='NIST: High',
+                        extraProperties=[{'category': 'comments', 'values': [{'value': 'none'}]}]),
+        ])
+        exported = "".join(export_lines('datasets', 'dats', Dataset.objects.all()))
+        Dataset.objects.all().delete()
+
+        importer = self.run_import([record for line_number, record in read_jsonl(io.StringIO(exported))])
+        self.assertEqual(importer.stats['created'], 1)
+        dataset = Dataset.objects.get()
+        self.assertEqual((dataset.ds_id, dataset.title, dataset.description, dataset.publication_date,
+                          dataset.period_start, dataset.comments, dataset.data_source.name, dataset.publisher),
+                         ('DS-1', 'Cohort study', 'A cohort', date(2020, 1, 31), date(2019, 1, 1), 'none',
+                          'Clinic', None))
+        self.assertEqual([kw.keyword for kw in dataset.keywords.all()], ['cohort'])
+        self.assertEqual([str(m) for m in dataset.media_subtype.all()], ['text/csv'])
+        self.assertEqual(list(dataset.cil.all()), [self.cil])
+
+
+class ApiTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='api-user')
+        cls.provider = DataProvider.objects.create(name='API provider', record_author=cls.user, published=True)
+        cls.keyword = Keyword.objects.create(keyword='cohort', definition='', record_author=cls.user, published=True)
+        for i in range(5):
+            dataset = Dataset.objects.create(title=f'API dataset {i}', description=f'Dataset {i}',
+                                             publisher=cls.provider, record_author=cls.user, published=True)
+            dataset.keywords.add(cls.keyword)
+        Dataset.objects.create(title='API draft', record_author=cls.user, published=False)
+        person = Person.objects.create(first_name='API', last_name='Person', cwid='api-person')
+        DataUseAgreement.objects.create(duaid='DUA-API', title='API agreement', publisher=cls.provider,
+                                        contact=person, pi=person, record_author=cls.user, published=True)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def get(self, resource, **params):
+        return self.client.get(reverse('datacatalog:api-list', kwargs={'resource': resource}), params)
+
+    def test_login_required(self):
+        self.client.logout()
+        self.assertEqual(self.get('datasets').status_code, 403)
+
+    def test_default_and_selected_fields(self):
+        results = self.get('datasets').json()['results']
+        self.assertEqual(len(results), 5)
+        self.assertEqual(set(results[0]), {'id', 'url', 'ds_id', 'title', 'description', 'publisher', 'record_update'})
+        self.assertEqual(results[0]['publisher'], self.provider.pk)
+
+        results = self.get('datasets', fields='title,description').json()['results']
+        self.assertEqual(set(results[0]), {'id', 'title', 'description'})
+
+    def test_includes_do_not_replace_fields(self):
+        result = self.get('datasets', fields='title,publisher', include='publisher,keywords').json()['results'][0]
+        self.assertEqual(result['publisher'], self.provider.pk)
+        self.assertEqual(result['included'], {'publisher': {'id': self.provider.pk, 'name': 'API provider'},
+                                              'keywords': [{'id': self.keyword.pk, 'keyword': 'cohort'}]})
+
+    def test_unknown_fields_and_includes(self):
+        for params in ({'fields': 'title,secret'}, {'include': 'owner'}):
+            with self.subTest(params=params):
+                response = self.get('datasets', **params)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('error', response.json())
+
+    def test_duas_require_permission(self):
+        self.assertEqual(self.get('duas').status_code, 403)
+        self.user.user_permissions.add(Permission.objects.get(codename='view_datauseagreement'))
+        self.client.force_login(User.objects.get(pk=self.user.pk))
+        self.assertEqual([dua['duaid'] for dua in self.get('duas').json()['results']], ['DUA-API'])
+
+    def test_cursor_pages(self):
+        response = self.get('datasets', fields='title', page_size=2).json()
+        titles = [ds['title'] for ds in response['results']]
+        while response['next']:
+            self.assertIn('fields=title', response['next'])
+            response = self.client.get(response['next']).json()
+            titles += [ds['title'] for ds in response['results']]
+        self.assertEqual(sorted(titles), [f'API dataset {i}' for i in range(5)])
+
+    def test_detail(self):
+        dataset = Dataset.objects.get(title='API dataset 0')
+        url = reverse('datacatalog:api-detail', kwargs={'resource': 'datasets', 'pk': dataset.pk})
+        self.assertEqual(self.client.get(url, {'fields': 'title'}).json(), {'id': dataset.pk, 'title': 'API dataset 0'})
+        draft = Dataset.objects.get(title='API draft')
+        url = reverse('datacatalog:api-detail', kwargs={'resource': 'datasets', 'pk': draft.pk})
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+@override_settings(DATACATALOG_SHARED_CACHE=True)
+class ConditionalRequestTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='conditional-user')
+        for i in range(3):
+            Dataset.objects.create(title=f'Conditional dataset {i}', record_author=cls.user, published=True)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def revalidate(self, url, **params):
+        """
+        requests the page, then requests it again with its ETag, returning both responses and
+        the queries run by the second request
+        """
+        first = self.client.get(url, params)
+        self.assertEqual(first.status_code, 200)
+        with CaptureQueriesContext(connection) as queries:
+            second = self.client.get(url, params, HTTP_IF_NONE_MATCH=first['ETag'])
+        return first, second, queries
+
+    def test_unchanged_list_is_not_modified(self):
+        first, second, queries = self.revalidate(reverse('datacatalog:datasets'))
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(second['ETag'], first['ETag'])
+        # the list's records are not read
+        self.assertFalse([q for q in queries if 'datacatalog_dataset' in q['sql']])
+
+    @override_settings(DATACATALOG_SHARED_CACHE=None,
+                       CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_no_etags_without_a_shared_cache(self):
+        response = self.client.get(reverse('datacatalog:datasets'))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('ETag'))
+
+    def test_list_parameters_change_the_etag(self):
+        url = reverse('datacatalog:datasets')
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, {'page_size': 1}, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_edit_invalidates_the_list(self):
+        url = reverse('datacatalog:datasets')
+        etag = self.client.get(url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            dataset = Dataset.objects.get(title='Conditional dataset 1')
+            dataset.description = 'edited'
+            dataset.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_edit_invalidates_the_detail_page(self):
+        dataset = Dataset.objects.get(title='Conditional dataset 0')
+        url = reverse('datacatalog:dataset-view', kwargs={'pk': dataset.pk})
+        first, second, queries = self.revalidate(url)
+        self.assertEqual(second.status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            dataset.keywords.add(Keyword.objects.create(keyword='conditional', definition='',
+                                                        record_author=self.user))
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag']).status_code, 200)
+
+
+class AutocompleteTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='autocomplete-user')
+        for i in range(12):
+            Keyword.objects.create(keyword=f'cohort {i:02d}', definition='', record_author=cls.user)
+        Keyword.objects.create(keyword='registry', definition='', record_author=cls.user)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def suggest(self, **params):
+        return self.client.get(reverse('datacatalog:autocomplete-keyword'), params).json()
+
+    def test_pages(self):
+        first = self.suggest(q='coh')
+        self.assertEqual([r['text'] for r in first['results']], [f'cohort {i:02d}' for i in range(10)])
+        self.assertTrue(first['pagination']['more'])
+        second = self.suggest(q='coh', page=2)
+        self.assertEqual([r['text'] for r in second['results']], ['cohort 10', 'cohort 11'])
+        self.assertFalse(second['pagination']['more'])
+
+    def test_suggestions_are_cached_until_a_save(self):
+        self.assertEqual(len(self.suggest(q='reg')['results']), 1)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(len(self.suggest(q='reg')['results']), 1)
+        self.assertFalse([q for q in queries if 'datacatalog_keyword' in q['sql']])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Keyword.objects.create(keyword='registries', definition='', record_author=self.user)
+        self.assertEqual([r['text'] for r in self.suggest(q='reg')['results']], ['registries', 'registry'])
+
+
+class FragmentCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser(username='fragment-user')
+        cls.dataset = Dataset.objects.create(title='Fragment dataset', record_author=cls.user, published=True)
+        cls.other = Dataset.objects.create(title='Other fragment dataset', record_author=cls.user, published=True)
+        cls.cil = ConfidentialityImpact.objects.create(record_author=cls.user, impact_level='Moderate', impact_rank=2,
+                                                       standard='NIST', definition='Moderate impact',
+                                                       link='https://example.org/nist')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def cil_queries(self):
+        """
+        returns the dataset page, and the number of queries for its confidentiality impact levels
+        """
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('datacatalog:dataset-view', kwargs={'pk': self.dataset.pk}))
+        return response, len([q for q in queries if 'datacatalog_confidentialityimpact' in q['sql']])
+
+    def test_fragment_is_cached_until_a_link_changes(self):
+        self.assertEqual(self.cil_queries()[1], 1)
+        self.assertEqual(self.cil_queries()[1], 0)
+
+        # saving another dataset leaves the fragment in place
+        with self.captureOnCommitCallbacks(execute=True):
+            self.other.save()
+        self.assertEqual(self.cil_queries()[1], 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.dataset.cil.add(self.cil)
+        response, queries = self.cil_queries()
+        self.assertEqual(queries, 1)
+        self.assertContains(response, 'NIST: Moderate')
+
+
+class DataUseAgreementDetailTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser(username='dua-detail-user')
+        provider = DataProvider.objects.create(name='DUA detail provider', record_author=cls.user)
+        person = Person.objects.create(first_name='DUA', last_name='Detail', cwid='dua-detail-person')
+        cls.dua = DataUseAgreement.objects.create(duaid='DUA-DETAIL', title='DUA detail agreement',
+                                                  publisher=provider, contact=person, pi=person,
+                                                  record_author=cls.user)
+        cls.published = Dataset.objects.create(title='Published DUA dataset', record_author=cls.user, published=True)
+        cls.draft = Dataset.objects.create(title='Draft DUA dataset', record_author=cls.user, published=False)
+        cls.dua.datasets.add(cls.published, cls.draft)
+
+    def test_datasets(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('datacatalog:dua-view', kwargs={'pk': self.dua.pk}))
+        # every dataset of the DUA is fetched, and the table shows the published ones, as it always has
+        self.assertEqual(sorted(ds.title for ds in response.context['dua_datasets']),
+                         ['Draft DUA dataset', 'Published DUA dataset'])
+        self.assertContains(response, 'Published DUA dataset')
+        self.assertNotContains(response, 'Draft DUA dataset')
@@ -0,0 +1,134 @@
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import F
+from django.db.models.functions import Collate
+
+from .versions import get_versions
+
+# number of suggestions returned per request (and per "load more" page)
+AUTOCOMPLETE_LIMIT = 10
+
+# seconds for which the suggestions for a term are cached. Suggestions are also replaced
+# as soon as a record of the model is saved, so this only bounds the cache size.
+DEFAULT_AUTOCOMPLETE_TIMEOUT = 60
+
+# below this length, terms are matched as prefixes even where trigram indexes allow
+# substring matching, since one or two characters match too many rows to be selective
+TRIGRAM_MIN_LENGTH = 3
+
+
+def match_lookup(term):
+    """
+    returns the lookup used to match a term: a substring match on PostgreSQL, where the
+    columns have pg_trgm indexes, and a prefix match elsewhere, where they have ordinary
+    (case-insensitive) indexes. See migrations/0046_autocomplete_indexes.py.
+    """
+    if connection.vendor == 'postgresql' and len(term) >= TRIGRAM_MIN_LENGTH:
+        return 'icontains'
+    return 'istartswith'
+
+
+def index_ordering(field):
+    """
+    orders matches on a field in the order of its autocomplete index, so that the database
+    can stop reading the index once the suggestions are found
+    """
+    if connection.vendor == 'sqlite':
+        return Collate(F(field), 'NOCASE')
+    return F(field)
+
+
+class IndexedAutocompleteMixin:
+    """
+    For Select2QuerySetView autocompletes. Suggestions are searched only on search_fields
+    (which should have autocomplete indexes), load only label_fields (the columns used by
+    the records' labels), are limited to AUTOCOMPLETE_LIMIT without counting the matches,
+    and are cached per term. The view's own get() renders them, so only get_queryset,
+    get_results and has_more are overridden.
+
+    search_fields listed in substring_fields are always matched as substrings; use this
+    only for searches that are already narrowed by another filter (eg. a project).
+    """
+    search_fields = ()
+    substring_fields = ()
+    label_fields = None
+    # set on autocompletes whose suggestions depend on the user
+    cache_per_user = False
+    # get_queryset returns a single page of suggestions, so the ListView must not paginate
+    # (or count) them again
+    paginate_by = None
+
+    def get_base_queryset(self):
+        return self.model.objects.all()
+
+    def get_search_queryset(self):
+        qs = self.get_base_queryset()
+        if self.label_fields is not None:
+            qs = qs.only('pk', *self.label_fields)
+        return qs
+
+    def get_matches(self, count):
+        """
+        returns the first count records matching the term: those matching the first search
+        field (in that field's order), then those matching the second, and so on. Each field
+        is searched with its own query, which can be answered from the field's index without
+        sorting every match.
+        """
+        qs = self.get_search_queryset()
+        if not self.q:
+            return list(qs.order_by('pk')[:count])
+
+        matches = {}
+        for field in self.search_fields:
+            lookup = 'icontains' if field in self.substring_fields else match_lookup(self.q)
+            # enough rows to make up the count after removing those already matched
+            found = qs.filter(**{f'{field}__{lookup}': self.q}
+                              ).order_by(index_ordering(field), 'pk')[:count + len(matches)]
+            for obj in found:
+                matches.setdefault(obj.pk, obj)
+            if len(matches) >= count:
+                break
+        return list(matches.values())[:count]
+
+    def get_page(self):
+        try:
+            return max(1, int(self.request.GET.get('page', 1)))
+        except ValueError:
+            return 1
+
+    def get_cache_key(self):
+        version = get_versions(self.model)
+        parts = [type(self).__name__, self.q, self.get_page(), sorted(self.forwarded.items()),
+                 sorted(version.items())]
+        if self.cache_per_user:
+            parts.append(self.request.user.pk)
+        digest = hashlib.sha1(json.dumps(parts, default=str).encode()).hexdigest()
+        return f'datacatalog:autocomplete:{digest}'
+
+    def get_queryset(self):
+        """
+        returns the suggestions for the requested page, plus the first suggestion of the
+        next page if there is one
+        """
+        key = self.get_cache_key()
+        suggestions = cache.get(key)
+        if suggestions is None:
+            offset = (self.get_page() - 1) * AUTOCOMPLETE_LIMIT
+            # one extra row tells whether there are more suggestions, without a count query
+            suggestions = self.get_matches(offset + AUTOCOMPLETE_LIMIT + 1)[offset:]
+            cache.set(key,
+                      suggestions,
+                      getattr(settings, 'DATACATALOG_AUTOCOMPLETE_TIMEOUT', DEFAULT_AUTOCOMPLETE_TIMEOUT),
+                      )
+        return suggestions
+
+    def get_results(self, context):
+        context = dict(context, object_list=context['object_list'][:AUTOCOMPLETE_LIMIT])
+        return super(IndexedAutocompleteMixin, self).get_results(context)
+
+    def has_more(self, context):
+        return len(context['object_list']) > AUTOCOMPLETE_LIMIT
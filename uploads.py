@@ -0,0 +1,171 @@
+import hashlib
+import posixpath
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+
+from .models import ArchiveFile
+
+# size of the blocks streamed from an uploaded file to storage
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# number of files written to storage concurrently
+DEFAULT_UPLOAD_WORKERS = 4
+
+
+def archive_directory(data_access):
+    """
+    returns the storage directory for files uploaded to a DataAccess record
+    """
+    return f'to_archive/DA{data_access.pk}'
+
+
+class ChecksumFile(File):
+    """
+    Wraps an uploaded file so that the SHA-256 checksum and size of its contents are
+    computed as the storage backend reads it chunk by chunk.
+    """
+    def __init__(self, file, name=None):
+        super(ChecksumFile, self).__init__(file, name)
+        self.checksum = hashlib.sha256()
+        self.bytes_read = 0
+        self.complete = False
+
+    def chunks(self, chunk_size=None):
+        for chunk in super(ChecksumFile, self).chunks(chunk_size or UPLOAD_CHUNK_SIZE):
+            self.checksum.update(chunk)
+            self.bytes_read += len(chunk)
+            yield chunk
+        self.complete = True
+
+    def hexdigest(self):
+        """
+        returns the checksum of the contents, reading the file again if the storage
+        backend did not consume it through chunks()
+        """
+        if not self.complete:
+            self.checksum = hashlib.sha256()
+            self.bytes_read = 0
+            for chunk in self.chunks():
+                pass
+        return self.checksum.hexdigest()
+
+
+def store_file(directory, uploaded_file):
+    """
+    streams one uploaded file into storage and returns an unsaved ArchiveFile recording
+    its stored path, size and checksum. Runs in a worker thread, so does not touch the
+    database.
+    """
+    content = ChecksumFile(uploaded_file, name=uploaded_file.name)
+    path = default_storage.save(f'{directory}/{uploaded_file.name}', content)
+    # the checksum first: it counts the bytes again if the storage did not read through chunks()
+    sha256 = content.hexdigest()
+    return ArchiveFile(name=uploaded_file.name,
+                       path=path,
+                       size=content.bytes_read,
+                       sha256=sha256,
+                       )
+
+
+def store_uploads(data_access, filelist):
+    """
+    stores the uploaded files of a DataAccess record and returns the list of ArchiveFile
+    records created for them, in upload order.
+
+    Files are written to storage concurrently, DATACATALOG_UPLOAD_WORKERS (default 4) at a
+    time, and checksummed while they are written. A file whose contents match a file
+    already stored (in any data location, or earlier in the same upload) is removed again,
+    and its record points to the existing copy.
+    """
+    if not filelist:
+        return []
+
+    directory = archive_directory(data_access)
+    workers = getattr(settings, 'DATACATALOG_UPLOAD_WORKERS', DEFAULT_UPLOAD_WORKERS)
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(filelist)))) as executor:
+        archive_files = list(executor.map(lambda f: store_file(directory, f), filelist))
+
+    # originals already in storage, found with one query
+    originals = {}
+    for original in ArchiveFile.objects.filter(sha256__in={af.sha256 for af in archive_files},
+                                               duplicate_of__isnull=True,
+                                               ).order_by('pk'):
+        originals.setdefault(original.sha256, original)
+
+    new_originals = {}
+    for archive_file in archive_files:
+        archive_file.data_access = data_access
+        original = originals.get(archive_file.sha256)
+        if original is None and archive_file.sha256 in new_originals:
+            # the same content appears more than once in this upload
+            original = new_originals[archive_file.sha256]
+        if original is None:
+            new_originals[archive_file.sha256] = archive_file
+            continue
+
+        default_storage.delete(archive_file.path)
+        archive_file.path = original.path
+        archive_file.duplicate_of = original
+
+    # originals must have primary keys before the duplicates that refer to them are saved
+    ArchiveFile.objects.bulk_create(new_originals.values())
+    if any(af.pk is None for af in new_originals.values()):
+        # the database backend does not return primary keys from bulk inserts
+        pks = dict(ArchiveFile.objects.filter(data_access=data_access,
+                                              path__in=[af.path for af in new_originals.values()],
+                                              ).values_list('path', 'pk'))
+        for af in new_originals.values():
+            af.pk = pks[af.path]
+    ArchiveFile.objects.bulk_create([af for af in archive_files if af.duplicate_of is not None])
+    return archive_files
+
+
+def stage_upload(uploaded_file):
+    """
+    keeps an uploaded file in storage until a background job processes it, and returns
+    its storage name. With the file system storage, large uploads (already written to a
+    temporary file) are moved rather than copied.
+    """
+    return default_storage.save(f'staging/{uuid.uuid4().hex}/{uploaded_file.name}', uploaded_file)
+
+
+def discard_staged(path):
+    """
+    removes a file staged by stage_upload, together with the directory created for it
+    """
+    default_storage.delete(path)
+    directory = posixpath.dirname(path)
+    try:
+        directories, files = default_storage.listdir(directory)
+    except (FileNotFoundError, NotImplementedError):
+        return
+    if not directories and not files:
+        default_storage.delete(directory)
+
+
+def store_staged_uploads(data_access, staged):
+    """
+    stores files staged by stage_upload as uploads of the DataAccess record (see
+    store_uploads), then removes the staged copies. staged is a list of
+    (storage name, uploaded file name) pairs.
+    """
+    files = [File(default_storage.open(path, 'rb'), name=name) for path, name in staged]
+    try:
+        archive_files = store_uploads(data_access, files)
+    finally:
+        for f in files:
+            f.close()
+    for path, name in staged:
+        discard_staged(path)
+    return archive_files
+
+
+def upload_log(archive_files):
+    """
+    returns the newline separated list of file names recorded in DataAccess.fileupload_log
+    """
+    return "\n".join(af.name for af in archive_files)
@@ -2,7 +2,7 @@ from django.conf.urls.static import static
 from django.conf import settings
 from django.urls import path
 
-from . import views
+from . import views, api
 
 app_name = 'datacatalog'
 urlpatterns = [ 
@@ -78,6 +78,13 @@ urlpatterns = [
     path('retention/methods/<int:pk>', views.methodfile_view, name='methodfile-view'),
     path('retention/inventory/<int:pk>', views.inventoryfile_view, name='inventory-view'),
 
+    # read-only JSON API, eg. api/datasets?fields=title,publisher&include=keywords
+    path('api/<str:resource>', api.ApiListView.as_view(), name='api-list'),
+    path('api/<str:resource>/<int:pk>', api.ApiDetailView.as_view(), name='api-detail'),
+
+    # bulk export, eg. export/datasets/csv
+    path('export/<str:kind>/<str:fmt>', views.export_view, name='export'),
+
     # create views
     path('project/add', views.ProjectCreateView.as_view(), name='project-add'),
     path('datasets/add', views.DatasetCreateView.as_view(), name='dataset-add'),
@@ -119,6 +126,9 @@ urlpatterns = [
 
                   # search view:
     path('search/all', views.FullSearch.as_view(), name="full-search"),
+
+    # request metrics recorded by InstrumentationMiddleware (staff only)
+    path('stats', views.InstrumentationStatsView.as_view(), name='instrumentation-stats'),
     
 
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
@@ -0,0 +1,75 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+
+VERSION_KEY = 'datacatalog:version:{}'
+
+# pseudo-model bumped when group memberships or permissions change
+PERMISSIONS = 'auth.permissions'
+
+
+def version_label(model):
+    """
+    returns the name a model's version is stored under: its label (eg. 'datacatalog.dataset'),
+    or the string itself for pseudo-models such as PERMISSIONS
+    """
+    return model if isinstance(model, str) else model._meta.label_lower
+
+
+def versions_shared():
+    """
+    returns True if the versions are held in a cache that every server process shares, so
+    that a version bumped by one process is seen by all. DATACATALOG_SHARED_CACHE in
+    settings.py overrides the guess made from the default cache backend (eg. set it to
+    True for a single-process server using the local memory cache).
+    """
+    shared = getattr(settings, 'DATACATALOG_SHARED_CACHE', None)
+    if shared is not None:
+        return shared
+    return not isinstance(caches['default'], (LocMemCache, DummyCache))
+
+
+def get_versions(*models):
+    """
+    returns the current version of each model, as a dict by label. A version changes
+    whenever a record of the model is saved or deleted, so cached pages and fragments
+    that include the versions of the models they show are invalidated by any change.
+    """
+    labels = [version_label(m) for m in models]
+    found = cache.get_many([VERSION_KEY.format(label) for label in labels])
+
+    versions = {}
+    for label in labels:
+        key = VERSION_KEY.format(label)
+        if key not in found:
+            # start from the clock rather than 1, so that a version evicted from the
+            # cache cannot come back with a number that was already used
+            cache.add(key, int(time.time() * 1000), None)
+            found[key] = cache.get(key)
+        versions[label] = found[key]
+    return versions
+
+
+def bump_versions(*models):
+    """
+    changes the versions of the models once the current transaction commits, so that no
+    page can be cached under the new versions from data that is about to change.
+    Updates that bypass model signals (queryset.update(), bulk_create() and bulk_update())
+    must call this for the models they change.
+    """
+    labels = {version_label(m) for m in models}
+    transaction.on_commit(lambda: _bump(labels))
+
+
+def _bump(labels):
+    for label in labels:
+        key = VERSION_KEY.format(label)
+        try:
+            cache.incr(key)
+        except ValueError:
+            # not in the cache (yet, or any longer)
+            cache.set(key, int(time.time() * 1000), None)
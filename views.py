@@ -4,24 +4,23 @@ from mimetypes import guess_type
 
 from dal import autocomplete
 from django.contrib import messages
-from django.http import HttpResponseRedirect, FileResponse, Http404, HttpResponse
+from django.http import HttpResponseRedirect, Http404, StreamingHttpResponse
 
 from django.shortcuts import render, get_object_or_404
-from django.core.files.storage import default_storage
 from django.core.files.base import ContentFile
 
 from django.views import generic
 from django.views.generic.edit import CreateView, UpdateView
 from django.db.models import Q
 
-from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin
+from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin, UserPassesTestMixin
 from django.contrib.auth.decorators import login_required
 
 from django.urls import reverse
 
 from .models import Dataset, DataUseAgreement, DataAccess, Keyword, DataProvider
 from .models import MediaSubType, DataField, ConfidentialityImpact, Project
-from .models import RetentionRequest
+from .models import RetentionRequest, Job
 
 from persons.models import Person
 
@@ -30,173 +29,141 @@ from .forms import RetentionWorkflowExistingProjectForm, RetentionWorkflowNewPro
 from .forms import RetentionWorkflowDataForm, RetentionWorkflowNewDataForm, RetentionWorkflowMilestoneForm
 from .forms import RetentionInventoryForm
 
+from .conditional import ConditionalDetailMixin, ConditionalListMixin
+from .counters import get_dashboard_counts
+from .dictionary import parsed_on_upload
+from .export import EXPORTS, FORMATS, export_lines, supports
+from .fileserving import serve_file
+from .instrumentation import get_stats, repeat_threshold, reset_stats
+from .pagination import KeysetPaginationMixin
+from .permissions import get_permission_resolver, get_person, get_person_id, get_request_person
+from .search import search_catalog
+from .tasks import queue_archiving, queue_dictionary, queue_inventory, queue_uploads
+from .typeahead import IndexedAutocompleteMixin
+
 # ################################## #
 # #####  AUTOCOMPLETE  VIEWS   ##### #
 # ################################## #
 
 
-class DatasetAutocomplete(LoginRequiredMixin, autocomplete.Select2QuerySetView):
-    def get_queryset(self):
-        qs = Dataset.objects.all()
-
-        if self.q:
-            qs = qs.filter(
-                            Q(ds_id__istartswith=self.q) |
-                            Q(title__istartswith=self.q)
-                            )
-        return qs
+class DatasetAutocomplete(LoginRequiredMixin, IndexedAutocompleteMixin, autocomplete.Select2QuerySetView):
+    model = Dataset
+    search_fields = ('ds_id', 'title')
+    label_fields = ('title',)
 
 
-class PublisherAutocomplete(LoginRequiredMixin, autocomplete.Select2QuerySetView):
-    def get_queryset(self):
-        qs = DataProvider.objects.all()
-
-        if self.q:
-            qs = qs.filter(name__icontains=self.q)
-        return qs
+class PublisherAutocomplete(LoginRequiredMixin, IndexedAutocompleteMixin, autocomplete.Select2QuerySetView):
+    model = DataProvider
+    search_fields = ('name',)
+    label_fields = ('name',)
 
 
-class AccessAutocomplete(LoginRequiredMixin, autocomplete.Select2QuerySetView):
-    def get_queryset(self):
-        qs = DataAccess.objects.all()
+class AccessAutocomplete(LoginRequiredMixin, IndexedAutocompleteMixin, autocomplete.Select2QuerySetView):
+    model = DataAccess
+    search_fields = ('name',)
+    label_fields = ('name',)
+    # only the data locations the user may view are offered
+    cache_per_user = True
 
-        if self.q:
-            qs = qs.filter(name__icontains=self.q)
-        return qs
+    def get_base_queryset(self):
+        return get_permission_resolver(self.request).viewable(DataAccess.objects.all())
 
 
-class ProjectByUserAutocomplete(LoginRequiredMixin, autocomplete.Select2QuerySetView):
+class ProjectByUserAutocomplete(LoginRequiredMixin, IndexedAutocompleteMixin, autocomplete.Select2QuerySetView):
     """
     This autocomplete only offers Projects for which the selector is the record creator,
     the project pi, or the project admin.
     """
-    def get_queryset(self):
-        #user = self.request.user
-        user = Person.objects.get(cwid=self.request.user.username)
-        qs = Project.objects.filter(
-                            Q(pi=user) |
-                            Q(other_pis=user) |
-                            Q(other_editors=user)
-        ).distinct()
-
-        if self.q:
-            qs = qs.filter(name__icontains=self.q)
-        return qs
-
-
-class AccessByProjectAutocomplete(LoginRequiredMixin, autocomplete.Select2QuerySetView):
-    def get_queryset(self):
-        project = self.forwarded.get('project', None)
-        qs = DataAccess.objects.filter(project=project)
-
-        if self.q:
-            qs = qs.filter(
-                Q(name__icontains=self.q) |
-                Q(shareable_link__icontains=self.q) |
-                Q(unique_id__icontains=self.q) |
-                Q(filepaths__icontains=self.q)
-            )
-        return qs
+    model = Project
+    search_fields = ('name',)
+    # the user's projects are few, so their names are matched anywhere
+    substring_fields = ('name',)
+    label_fields = ('name',)
+    cache_per_user = True
 
+    def get_base_queryset(self):
+        # the user's memberships, as loaded once per request by the permission resolver
+        return Project.objects.filter(pk__in=get_permission_resolver(self.request).project_ids)
 
-class DUAAutocomplete(LoginRequiredMixin, autocomplete.Select2QuerySetView):
-    def get_queryset(self):
-        qs = DataUseAgreement.objects.all()
 
-        if self.q:
-            qs = qs.filter(
-                            Q(duaid__icontains=self.q) |
-                            Q(title__icontains=self.q)
-            )
-        return qs
+class AccessByProjectAutocomplete(LoginRequiredMixin, IndexedAutocompleteMixin, autocomplete.Select2QuerySetView):
+    model = DataAccess
+    search_fields = ('name', 'shareable_link', 'unique_id', 'filepaths')
+    # the search is limited to one project's data locations, so all fields are matched anywhere
+    substring_fields = search_fields
+    label_fields = ('name',)
+    cache_per_user = True
 
+    def get_base_queryset(self):
+        project = self.forwarded.get('project', None)
+        return get_permission_resolver(self.request).viewable(DataAccess.objects.filter(project=project))
 
-class KeywordAutocomplete(LoginRequiredMixin, autocomplete.Select2QuerySetView):
-    def get_queryset(self):
-        qs = Keyword.objects.all()
 
-        if self.q:
-            qs = qs.filter(
-                            Q(keyword__icontains=self.q) |
-                            Q(definition__icontains=self.q)
-            )
-        return qs
+class DUAAutocomplete(LoginRequiredMixin, IndexedAutocompleteMixin, autocomplete.Select2QuerySetView):
+    model = DataUseAgreement
+    search_fields = ('duaid', 'title')
+    label_fields = ('duaid', 'title')
 
 
-class DataFieldAutocomplete(LoginRequiredMixin, autocomplete.Select2QuerySetView):
-    def get_queryset(self):
-        qs = DataField.objects.all()
+class KeywordAutocomplete(LoginRequiredMixin, IndexedAutocompleteMixin, autocomplete.Select2QuerySetView):
+    model = Keyword
+    search_fields = ('keyword',)
+    label_fields = ('keyword',)
 
-        if self.q:
-            qs = qs.filter(
-                            Q(name__icontains=self.q) |
-                            Q(description__icontains=self.q)
-            )
-        return qs
 
+class DataFieldAutocomplete(LoginRequiredMixin, IndexedAutocompleteMixin, autocomplete.Select2QuerySetView):
+    model = DataField
+    search_fields = ('name', 'description')
+    label_fields = ('name', 'description', 'scope')
 
-class MediaSubTypeAutocomplete(LoginRequiredMixin, autocomplete.Select2QuerySetView):
-    def get_queryset(self):
-        qs = MediaSubType.objects.all()
 
-        if self.q:
-            qs = qs.filter(
-                            Q(name__icontains=self.q) |
-                            Q(template__istartswith=self.q)
-            )
-        return qs
+class MediaSubTypeAutocomplete(LoginRequiredMixin, IndexedAutocompleteMixin, autocomplete.Select2QuerySetView):
+    model = MediaSubType
+    search_fields = ('name', 'template')
+    # a short list of media types, matched anywhere
+    substring_fields = search_fields
+    label_fields = ('name', 'template')
 
 
-class CILAutocomplete(LoginRequiredMixin, autocomplete.Select2QuerySetView):
-    def get_queryset(self):
-        qs = ConfidentialityImpact.objects.all()
-
-        if self.q:
-            qs = qs.filter(
-                            Q(impact_level__icontains=self.q) |
-                            Q(standard__icontains=self.q) |
-                            Q(definition_level__icontains=self.q)
-            )
-        return qs
+class CILAutocomplete(LoginRequiredMixin, IndexedAutocompleteMixin, autocomplete.Select2QuerySetView):
+    model = ConfidentialityImpact
+    search_fields = ('impact_level', 'standard', 'definition')
+    # there are only a handful of levels, so they are matched anywhere
+    substring_fields = search_fields
+    label_fields = ('standard', 'impact_level')
 
 # ################# #
 # ## Index views ## #
 # ################# #
 
 
-class IndexView(LoginRequiredMixin, generic.ListView):
+class IndexView(LoginRequiredMixin, ConditionalListMixin, generic.ListView):
     template_name = 'datacatalog/index.html'
     context_object_name = 'dataset_list'
+    etag_models = (Dataset, Keyword, DataProvider, DataUseAgreement, DataAccess, RetentionRequest)
 
     def get_queryset(self):
         ds = Dataset.objects.filter(published=True
+                                    ).for_listing(
                                     ).order_by('-record_update'
                                                )[:5]
 
         return ds
 
     def get_context_data(self, **kwargs):
-        ds_count = Dataset.objects.filter(published=True).count()
-        dua_count = DataUseAgreement.objects.filter(published=True).count()
-        access_count = DataAccess.objects.filter(published=True).count()
-        unlocked_requests = RetentionRequest.objects.exclude(locked=True).count()
-
+        # record counts are cached, and invalidated whenever the counted models change
         context = super(IndexView, self).get_context_data(**kwargs)
-        context.update({'ds_count': ds_count,
-                        'dua_count': dua_count,
-                        'access_count': access_count,
-                        'unlocked_requests': unlocked_requests,
-                        })
+        context.update(get_dashboard_counts())
         return context
 
 
-class IndexDatasetView(LoginRequiredMixin, generic.ListView):
+class IndexDatasetView(LoginRequiredMixin, ConditionalListMixin, KeysetPaginationMixin, generic.ListView):
     template_name = 'datacatalog/index_datasets.html'
     context_object_name = 'dataset_list'
+    etag_models = (Dataset, Keyword, DataProvider)
 
     def get_queryset(self):
-        ds = Dataset.objects.filter(published=True)
-        # ds.sort()
+        ds = Dataset.objects.filter(published=True).for_listing()
         return ds
 
     def get_context_data(self, **kwargs):
@@ -207,13 +174,14 @@ class IndexDatasetView(LoginRequiredMixin, generic.ListView):
         return context
 
 
-class IndexDUAView(PermissionRequiredMixin, generic.ListView):
+class IndexDUAView(PermissionRequiredMixin, ConditionalListMixin, KeysetPaginationMixin, generic.ListView):
     template_name = 'datacatalog/index_duas.html'
     context_object_name = 'dua_list'
+    etag_models = (DataUseAgreement, DataProvider, Dataset)
     permission_required = 'datacatalog.view_datauseagreement'
 
     def get_queryset(self):
-        duas = DataUseAgreement.objects.filter(published=True)
+        duas = DataUseAgreement.objects.filter(published=True).for_listing()
         return duas
 
     def get_context_data(self, **kwargs):
@@ -224,9 +192,10 @@ class IndexDUAView(PermissionRequiredMixin, generic.ListView):
         return context
 
 
-class IndexKeywordView(LoginRequiredMixin, generic.ListView):
+class IndexKeywordView(LoginRequiredMixin, ConditionalListMixin, KeysetPaginationMixin, generic.ListView):
     template_name = 'datacatalog/index_keywords.html'
     context_object_name = 'keyword_list'
+    etag_models = (Keyword,)
 
     def get_queryset(self):
         kws = Keyword.objects.filter(published=True)
@@ -245,33 +214,22 @@ class IndexProjectByUserView(LoginRequiredMixin, generic.ListView):
     context_object_name = 'project_list'
 
     def get_queryset(self):
-        try:
-            user = Person.objects.get(cwid=self.request.user.username)
-        except Person.DoesNotExist:
-            user = -1
-
-        myprojects = Project.objects.filter(
-            Q(pi=user) |
-            Q(other_pis=user) |
-            Q(other_editors=user)
-        ).distinct()
-        return myprojects.order_by('record_creation',)
+        person = get_person_id(self.request)
+        if person is None:
+            return []
+        # all of the user's projects in one query, annotated with the user's roles
+        myprojects = Project.objects.for_member(person).for_cards()
+        return list(myprojects.order_by('record_creation', 'pk'))
 
     def get_context_data(self, **kwargs):
-        try:
-            user = Person.objects.get(cwid=self.request.user.username)
-        except Person.DoesNotExist:
-            user = -1
+        projects = self.object_list
 
-        mypiprojects = Project.objects.filter(pi=user).distinct().order_by('record_creation',)
-        myotherpisprojects = Project.objects.filter(other_pis=user).distinct().order_by('record_creation',)
-        myothereditorsprojects = Project.objects.filter(other_editors=user).distinct().order_by('record_creation',)
+        mypiprojects = [p for p in projects if p.is_pi]
+        myotherpisprojects = [p for p in projects if p.is_other_pi]
+        myothereditorsprojects = [p for p in projects if p.is_other_editor]
 
-        retention_requests = RetentionRequest.objects.filter(
-            Q(project__pi=user) |
-            Q(project__other_pis=user) |
-            Q(project__other_editors=user)
-        ).distinct()
+        retention_requests = {rr.pk: rr for p in projects for rr in p.retentionrequest_set.all()}
+        retention_requests = [retention_requests[pk] for pk in sorted(retention_requests)]
 
         context = super(IndexProjectByUserView, self).get_context_data(**kwargs)
         context.update({
@@ -283,13 +241,15 @@ class IndexProjectByUserView(LoginRequiredMixin, generic.ListView):
         return context
 
 
-class IndexDataAccessView(PermissionRequiredMixin, generic.ListView):
+class IndexDataAccessView(LoginRequiredMixin, KeysetPaginationMixin, generic.ListView):
     template_name = 'datacatalog/index_dataaccess.html'
     context_object_name = 'access_list'
-    permission_required = 'datacatalog.view_dataaccess'
 
     def get_queryset(self):
-        ins = DataAccess.objects.filter(published=True)
+        # users without the view_dataaccess permission see the data locations of their
+        # projects, the public ones and those they are given restricted access to
+        ins = get_permission_resolver(self.request).viewable(DataAccess.objects.filter(published=True)
+                                                             ).select_related('project__pi')
         # ins.sort()
         return ins
 
@@ -301,25 +261,16 @@ class IndexDataAccessView(PermissionRequiredMixin, generic.ListView):
         return context
 
 
-class IndexDataProviderView(LoginRequiredMixin, generic.ListView):
+class IndexDataProviderView(LoginRequiredMixin, ConditionalListMixin, KeysetPaginationMixin, generic.ListView):
     template_name = 'datacatalog/index_dataproviders.html'
     context_object_name = 'provider_list'
+    etag_models = (DataProvider, Dataset)
 
     def get_queryset(self):
-        pvs = DataProvider.objects.filter(published=True)
-
-        # only show published providers that themselves have published datasets
-        pvs_with_data = []
-        for pv in pvs:
-            # see if provider has any published datasets which it is related to 
-            # either as publisher or as source
-            as_source = pv.dataset_source.filter(published=True).count()
-            as_publisher = pv.dataset_publisher.filter(published=True).count()
-
-            if as_source > 0 or as_publisher > 0:
-                pvs_with_data.append(pv)
-
-        return pvs_with_data
+        # only show published providers that themselves have published datasets,
+        # either as publisher or as source
+        pvs = DataProvider.objects.filter(published=True).with_published_datasets().with_published_counts()
+        return pvs
 
     def get_context_data(self, **kwargs):
         context = super(IndexDataProviderView, self).get_context_data(**kwargs)
@@ -329,13 +280,15 @@ class IndexDataProviderView(LoginRequiredMixin, generic.ListView):
         return context
 
 
-class IndexRetentionRequestView(PermissionRequiredMixin, generic.ListView):
+class IndexRetentionRequestView(LoginRequiredMixin, KeysetPaginationMixin, generic.ListView):
     template_name = 'datacatalog/index_retentionrequests.html'
     context_object_name = 'retention_requests'
-    permission_required = 'datacatalog.view_retentionrequest'
+    keyset_ordering = ('record_update', 'pk')
 
     def get_queryset(self):
-        qs = RetentionRequest.objects.order_by('record_update')
+        # users without the view_retentionrequest permission see the requests of their projects
+        qs = get_permission_resolver(self.request).viewable(RetentionRequest.objects.for_listing())
+        qs = qs.order_by('record_update')
         return qs
 
     def get_context_data(self, **kwargs):
@@ -346,13 +299,15 @@ class IndexRetentionRequestView(PermissionRequiredMixin, generic.ListView):
         return context
 
 
-class IndexActiveRetentionRequestView(PermissionRequiredMixin, generic.ListView):
+class IndexActiveRetentionRequestView(LoginRequiredMixin, KeysetPaginationMixin, generic.ListView):
     template_name = 'datacatalog/index_retentionrequests_active.html'
     context_object_name = 'retention_requests'
-    permission_required = 'datacatalog.view_retentionrequest'
+    keyset_ordering = ('record_update', 'pk')
 
     def get_queryset(self):
-        qs = RetentionRequest.objects.filter(verified="False").order_by('record_update')
+        qs = RetentionRequest.objects.filter(verified="False").for_listing()
+        qs = get_permission_resolver(self.request).viewable(qs)
+        qs = qs.order_by('record_update')
         return qs
 
     def get_context_data(self, **kwargs):
@@ -375,18 +330,21 @@ class ProjectDetailView(LoginRequiredMixin, generic.DetailView):
         # check permission to view project details:
         if self.object.viewing_is_permitted(self.request):
             access_permission = True
-            metadata = Dataset.objects.filter(dataaccess__project=self.object).distinct()
+            metadata = Dataset.objects.filter(dataaccess__project=self.object).distinct().for_listing()
+            retention_requests = self.object.retentionrequest_set.for_listing().order_by('pk')
             project = self.object
             pi = self.object.pi
 
         else:
             access_permission = False
             metadata = None
+            retention_requests = []
             project = self.object.name
             pi = self.object.pi
 
         context = super(ProjectDetailView, self).get_context_data(**kwargs)
         context.update({'dataset_list': metadata,
+                        'retention_requests': retention_requests,
                         'access_permission': access_permission,
                         'project': project,
                         'pi': pi,
@@ -395,17 +353,28 @@ class ProjectDetailView(LoginRequiredMixin, generic.DetailView):
         return context
 
 
-class DatasetDetailView(LoginRequiredMixin, generic.DetailView):
+# number of data fields listed on the dataset page
+DATA_FIELDS_SHOWN = 50
+
+
+class DatasetDetailView(LoginRequiredMixin, ConditionalDetailMixin, generic.DetailView):
     model = Dataset
     template_name = 'datacatalog/detail_dataset.html'
+    etag_models = (Dataset, Keyword, DataProvider, ConfidentialityImpact, MediaSubType, DataField,
+                   DataUseAgreement, Person, Job)
 
     def get_context_data(self, **kwargs):
         published_data = Dataset.objects.filter(published=True)
-        published_duas = self.object.datauseagreement_set.filter(published=True)
+        published_duas = self.object.datauseagreement_set.filter(published=True).for_listing()
+
+        data_fields = self.object.data_fields.only('pk', 'name', 'description').order_by('name')
 
         context = super(DatasetDetailView, self).get_context_data(**kwargs)
         context.update({'published_data': published_data,
                         'published_duas': published_duas,
+                        'data_fields': data_fields[:DATA_FIELDS_SHOWN],
+                        'data_field_count': data_fields.count(),
+                        'jobs': self.object.jobs.order_by('-pk')[:5],
                         })
         return context
 
@@ -414,67 +383,77 @@ class DataAccessDetailView(LoginRequiredMixin, generic.DetailView):
     model = DataAccess
     template_name = 'datacatalog/detail_access.html'
 
+    def get_queryset(self):
+        return DataAccess.objects.select_related('storage_type', 'project')
+
     def get_context_data(self, **kwargs):
         da_obj = self.object
-        published_data = da_obj.metadata
-        dua_list = DataUseAgreement.objects.filter(datasets__in=[ma.pk for ma in da_obj.metadata.all()]
-                                                   ).distinct()
+        # the linked datasets, with everything table_metadata.html shows of them
+        published_data = list(da_obj.metadata.for_metadata())
+        dua_list = DataUseAgreement.objects.filter(datasets__in=[ma.pk for ma in published_data]
+                                                   ).distinct().for_listing()
         context = super(DataAccessDetailView, self).get_context_data(**kwargs)
         context.update({'published_data': published_data,
                         'dua_list': dua_list,
+                        'jobs': da_obj.jobs.order_by('-pk')[:5],
                         })
         return context
 
 
-class DataUseAgreementDetailView(PermissionRequiredMixin, generic.DetailView):
+class DataUseAgreementDetailView(PermissionRequiredMixin, ConditionalDetailMixin, generic.DetailView):
     model = DataUseAgreement
     template_name = 'datacatalog/detail_dua.html'
+    etag_models = (DataUseAgreement, DataProvider, Dataset, Keyword, Person)
     permission_required = 'datacatalog.view_datauseagreement'
 
     def get_context_data(self, **kwargs):
         dua_obj = self.object
-        published_data = dua_obj.datasets.filter(published=True)
+        # all the DUA's datasets, as before; table_datasets.html shows the published ones
+        dua_datasets = dua_obj.datasets.for_listing()
         context = super(DataUseAgreementDetailView, self).get_context_data(**kwargs)
-        context.update({'published_data': published_data,
+        context.update({'dua_datasets': dua_datasets,
                         })
         return context
 
 
-class KeywordDetailView(LoginRequiredMixin, generic.DetailView):
+class KeywordDetailView(LoginRequiredMixin, ConditionalDetailMixin, generic.DetailView):
     model = Keyword
     template_name = 'datacatalog/detail_keyword.html'
+    etag_models = (Keyword, Dataset, DataProvider)
 
     def get_context_data(self, **kwargs):
         kw_obj = self.object
-        published_data = kw_obj.dataset_set.filter(published=True)
+        published_data = kw_obj.dataset_set.filter(published=True).for_listing()
         context = super(KeywordDetailView, self).get_context_data(**kwargs)
         context.update({'published_data': published_data,
                         })
         return context
 
 
-class DataProviderDetailView(LoginRequiredMixin, generic.DetailView):
+class DataProviderDetailView(LoginRequiredMixin, ConditionalDetailMixin, generic.DetailView):
     model = DataProvider
     template_name = 'datacatalog/detail_dataprovider.html'
+    etag_models = (DataProvider, Dataset, Keyword)
 
     def get_context_data(self, **kwargs):
         dp_obj = self.object
         published_data = Dataset.objects.filter(published=True,
                                                 publisher=dp_obj.pk
-                                                )
+                                                ).for_listing()
         context = super(DataProviderDetailView, self).get_context_data(**kwargs)
         context.update({'published_data': published_data,
                         })
         return context
 
 
-class DataFieldDetailView(LoginRequiredMixin, generic.DetailView):
+class DataFieldDetailView(LoginRequiredMixin, ConditionalDetailMixin, generic.DetailView):
     model = DataField
     template_name = 'datacatalog/detail_datafield.html'
+    etag_models = (DataField, Dataset, Keyword, DataProvider)
 
     def get_context_data(self, **kwargs):
         df_obj = self.object
-        containing_datasets = df_obj.dataset_set.filter(published=True,)
+        containing_datasets = df_obj.dataset_set.filter(published=True,).for_listing()
 
         context = super(DataFieldDetailView, self).get_context_data(**kwargs)
         context.update({'containing_datasets': containing_datasets,
@@ -506,6 +485,7 @@ class RetentionDetailView(LoginRequiredMixin, generic.DetailView):
                         'retentionadmin': retentionadmin,
                         'accessdenied': accessdenied,
                         'form_inventory': RetentionInventoryForm(instance=retention_request),
+                        'jobs': retention_request.jobs.order_by('-pk')[:5] if not accessdenied else [],
                         })
         return context
 
@@ -548,125 +528,113 @@ class RetentionDetailView(LoginRequiredMixin, generic.DetailView):
         # update each data access model data_retained field to True
         elif 'markarchived' in request.POST:
             retention_request = get_object_or_404(RetentionRequest, pk=self.kwargs['pk'])
-            retention_request.archived = True
-            retention_request.locked = True
-            for da in retention_request.to_archive.all():
-                da.data_retained = True
-                da.save()
+            queue_archiving(retention_request, user=request.user)
 
             messages.add_message(request, messages.SUCCESS,
-                                 f"{retention_request.to_archive.count()} data locations marked as archived, request locked.")
+                                 f"Archiving of {retention_request.name} queued, the request will be locked once complete.")
 
         elif 'submitinventory' in request.POST:
             retention_request = get_object_or_404(RetentionRequest, pk=self.kwargs['pk'])
 
             rr_form = RetentionInventoryForm(instance=retention_request, data=request.POST, files=request.FILES)
-            if rr_form.is_bound and rr_form.is_valid():
-                retention_request = rr_form.save()
+            if rr_form.is_valid():
+                # the file is attached by a background job
+                queue_inventory(retention_request, request.FILES['inventory'], user=request.user)
                 messages.add_message(request,
                                      messages.SUCCESS,
-                                     f"Data inventory added to {retention_request.name}.")
+                                     f"Data inventory queued for upload to {retention_request.name}.")
             else:
-                messages.error(request, rr_form.errors)
+                messages.error(request, " ".join(error for errors in rr_form.errors.values() for error in errors))
 
         # return to detail view
         return HttpResponseRedirect(reverse('datacatalog:retention-view', kwargs={'pk': self.kwargs['pk']}))
 
 
-def get_file_response(dd_file, content_type):
-    try:
-        with open(str(dd_file), 'rb') as fh:
-            response = HttpResponse(fh.read(),
-                                    content_type=content_type,
-                                    )
-            response['Content-Disposition'] = 'inline; filename={}'.format(
-                                                        os.path.basename(str(dd_file))
-                                                                            )
-            return response
-
-    except FileNotFoundError:
-        raise Http404()
-
-
-def file_view_response(model_file):
+def file_view_response(request, model_file):
     """
     allows viewing or downloading of files
     """
     # check to see if file is associated:
-    try:
-        doc_file = model_file.file
-        doc_name = model_file.name
-    except ValueError:
+    if not model_file:
         raise Http404()
 
-
-    filename, extension_raw = os.path.splitext(doc_name)
+    filename, extension_raw = os.path.splitext(model_file.name)
     extension = extension_raw.lower()[1:]
 
+    # documents that the browser can display are shown inline, anything else is downloaded
     if extension == "pdf":
-        try:
-            return FileResponse(doc_file, content_type='application/pdf')
-        except FileNotFoundError:
-            raise Http404()
+        return serve_file(request, model_file, content_type='application/pdf')
     elif extension == "docx":
-        return get_file_response(doc_file, content_type="application/vnd.ms-word")
+        return serve_file(request, model_file, content_type="application/vnd.ms-word")
     elif extension == "xlsx":
-        return get_file_response(doc_file, content_type="application/vnd.ms-excel")
+        return serve_file(request, model_file, content_type="application/vnd.ms-excel")
     else:
-        mime_type = guess_type(doc_name)
-        with open(str(doc_file), 'rb') as fh:
-            response = HttpResponse(fh.read(),
-                                    content_type=mime_type,
-                                    )
-            response['Content-Disposition'] = f'attachment; filename={os.path.basename(str(doc_file))}'
-            return response
+        mime_type = guess_type(model_file.name)[0] or 'application/octet-stream'
+        return serve_file(request, model_file, content_type=mime_type, as_attachment=True)
+
+
+@login_required()
+def export_view(request, kind, fmt):
+    """
+    streams all the records of a kind (datasets, duas or access) that the user may view,
+    as CSV, JSON-lines or (for datasets) DATS JSON-lines.
+    """
+    if not supports(kind, fmt):
+        raise Http404()
+
+    queryset = EXPORTS[kind].viewable(request)
+    content_type, extension = FORMATS[fmt][1:]
+    response = StreamingHttpResponse(export_lines(kind, fmt, queryset), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{kind}.{extension}"'
+    return response
 
 
 @login_required()
 def datadict_view(request, pk):
     model_instance = get_object_or_404(Dataset, pk=pk)
-    response = file_view_response(model_file=model_instance.data_dictionary)
+    response = file_view_response(request, model_file=model_instance.data_dictionary)
     return response
 
 
 @login_required()
 def methodfile_view(request, pk):
     model_instance = get_object_or_404(RetentionRequest, pk=pk)
-    response = file_view_response(model_file=model_instance.methodfile)
+    response = file_view_response(request, model_file=model_instance.methodfile)
     return response
 
 @login_required()
 def inventoryfile_view(request, pk):
     model_instance = get_object_or_404(RetentionRequest, pk=pk)
-    response = file_view_response(model_file=model_instance.inventory)
+    response = file_view_response(request, model_file=model_instance.inventory)
     return response
 
 @login_required()
 def duadoc_view(request, pk):
     model_instance = get_object_or_404(DataUseAgreement, pk=pk)
-    response = file_view_response(model_file=model_instance.documentation)
+    response = file_view_response(request, model_file=model_instance.documentation)
     return response
 
 
 # ################## #
 # ## Create views ## #
 # ################## #
-def check_or_create_user(user):
+def check_or_create_user(request):
     """
     check if logged in user is in the persons database. If they are, return
     the user instance. If not, create a new person in the database, and then
     return the instance.
     """
     # 1st, check the user is in persons database:
-    try:
-        person = Person.objects.get(cwid=user.username)
-    except Person.DoesNotExist:
+    person = get_person(request)
+    if person is None:
         # if not in database, create new record
+        user = request.user
         person = Person(first_name=user.first_name,
                         last_name=user.last_name,
                         cwid=user.username,
                         )
         person.save()
+        get_request_person(request).set(person)
     return person
 
 def check_or_add_to_project(person, project):
@@ -706,7 +674,7 @@ class ProjectCreateView(LoginRequiredMixin, CreateView):
 
         # add record creator to other_editors field if not already added.
         # 1st, check the user is in persons database:
-        person = check_or_create_user(user)
+        person = check_or_create_user(self.request)
 
         # add the record creator to the other_editors field if not already in the project people lists:
         check_result = check_or_add_to_project(person, self.object)
@@ -731,7 +699,12 @@ class DatasetCreateView(LoginRequiredMixin, CreateView):
             self.object.published = False
 
         self.object.save()
-        return super(DatasetCreateView, self).form_valid(form)
+        response = super(DatasetCreateView, self).form_valid(form)
+
+        # parse the data dictionary into data fields in the background
+        if self.object.data_dictionary and parsed_on_upload(self.object.data_dictionary.name):
+            queue_dictionary(self.object, user=self.request.user)
+        return response
 
 
 class DataProviderCreateView(PermissionRequiredMixin, CreateView):
@@ -754,18 +727,6 @@ class DataProviderCreateView(PermissionRequiredMixin, CreateView):
         self.object.save()
         return super(DataProviderCreateView, self).form_valid(form)
 
-def save_multifiles(pk, filelist):
-    "function to save multiple upload files and update the filepath field"
-    storage_list = ""
-    for f in filelist:
-        print(f"FILE UPLOADED: {f.name}")
-        # save file to media/to_archive
-        file_path = default_storage.save(f'to_archive/DA{pk}/{f.name}', f)
-        storage_list += f"\n{f.name}"
-        print(file_path)
-    return storage_list.strip()
-
-
 class DataAccessCreateView(LoginRequiredMixin, CreateView):
     model = DataAccess
     form_class = DataAccessForm
@@ -777,13 +738,9 @@ class DataAccessCreateView(LoginRequiredMixin, CreateView):
         self.object.record_author = self.request.user
         self.object.save()
 
-        pk = self.object.pk
-
-        # identify if multifiles has been populated and save accordingly
+        # identify if multifiles has been populated and queue the files for storage
         if self.request.FILES:
-            storage_list = save_multifiles(pk, self.request.FILES.getlist('multifiles'))
-            self.object.fileupload_log = storage_list
-            self.object.save()
+            queue_uploads(self.object, self.request.FILES.getlist('multifiles'), user=self.request.user)
         return super(DataAccessCreateView, self).form_valid(form)
 
 
@@ -856,6 +813,15 @@ class DatasetUpdateView(LoginRequiredMixin, UpdateView):
     form_class = DatasetForm
     template_name = "datacatalog/basic_crispy_form.html"
 
+    def form_valid(self, form):
+        response = super(DatasetUpdateView, self).form_valid(form)
+
+        # parse a newly uploaded data dictionary into data fields in the background
+        if ('data_dictionary' in form.changed_data and self.object.data_dictionary and
+                parsed_on_upload(self.object.data_dictionary.name)):
+            queue_dictionary(self.object, user=self.request.user)
+        return response
+
 
 class DataAccessUpdateView(LoginRequiredMixin, UpdateView):
     model = DataAccess
@@ -970,7 +936,7 @@ class RetentionWorkflowProjectView(LoginRequiredMixin, generic.TemplateView):
                 new_project_form.save_m2m()
 
                 # add record creator to other_editors field if not already added.
-                person = check_or_create_user(request.user)
+                person = check_or_create_user(request)
                 check_result = check_or_add_to_project(person, new_project)
 
                 project_pk = new_project.pk
@@ -1041,13 +1007,10 @@ class RetentionWorkflowDataView(LoginRequiredMixin, generic.TemplateView):
                 new_da.record_author = request.user
                 new_da.project = project
                 new_da.save()
-                da_pk = new_da.pk
 
-                # identify if multifiles has been populated and save accordingly
+                # identify if multifiles has been populated and queue the files for storage
                 if request.FILES:
-                    storage_list = save_multifiles(da_pk, request.FILES.getlist('multifiles'))
-                    new_da.fileupload_log = storage_list
-                    new_da.save()
+                    queue_uploads(new_da, request.FILES.getlist('multifiles'), user=request.user)
 
                 # update retention request by appending new data access to existing in to_archive
                 retention_request.to_archive.add(new_da)
@@ -1082,27 +1045,17 @@ class FullSearch(LoginRequiredMixin, generic.TemplateView):
 
     def post(self, request, *args, **kwargs):
         st = request.POST['srch_term']
-        qs_ds = Dataset.objects.all()
-        qs_ds = qs_ds.filter(Q(ds_id__icontains=st) |
-                             Q(title__icontains=st) |
-                             Q(description__icontains=st) |
-                             Q(comments__icontains=st)
-                             ).filter(published=True
-                                      )
-        qs_dua = DataUseAgreement.objects.all()
-        qs_dua = qs_dua.filter(Q(duaid__icontains=st) |
-                               Q(title__icontains=st) |
-                               Q(description__icontains=st)
-                               ).filter(published=True
-                                        )
-        qs_kw = Keyword.objects.all()
-        qs_kw = qs_kw.filter(Q(keyword__icontains=st) |
-                             Q(definition__icontains=st)
-                             )
-        qs_df = DataField.objects.all()
-        qs_df = qs_df.filter(Q(name__icontains=st) |
-                             Q(description__icontains=st)
-                             )
+
+        # ranked results for all searchable models, from the configured search backend
+        results = search_catalog(st, querysets={
+                                    'dataset': Dataset.objects.filter(published=True).for_listing(),
+                                    'dua': DataUseAgreement.objects.filter(published=True).for_listing(),
+                                    })
+        qs_ds = results['dataset']
+        qs_dua = results['dua']
+        qs_kw = results['keyword']
+        qs_df = results['datafield']
+
         context = {"search_str": st,
                    "qs_ds": qs_ds,
                    "qs_dua": qs_dua,
@@ -1111,6 +1064,33 @@ class FullSearch(LoginRequiredMixin, generic.TemplateView):
                    }
         return render(request, self.template_name, context)
 
+# ############################ #
+# ## Instrumentation views  ## #
+# ############################ #
+
+class InstrumentationStatsView(UserPassesTestMixin, generic.TemplateView):
+    """
+    shows the per-view aggregates recorded by InstrumentationMiddleware; a POST resets them
+    """
+    template_name = 'datacatalog/instrumentation_stats.html'
+
+    def test_func(self):
+        return self.request.user.is_staff
+
+    def get_context_data(self, **kwargs):
+        context = super(InstrumentationStatsView, self).get_context_data(**kwargs)
+        context.update({
+            'stats': get_stats(),
+            'repeat_threshold': repeat_threshold(),
+        })
+        return context
+
+    def post(self, request, *args, **kwargs):
+        reset_stats()
+        messages.success(request, "The request statistics have been reset.")
+        return HttpResponseRedirect(reverse('datacatalog:instrumentation-stats'))
+
+
 # ########################## #
 # ## Error handling views ## #
 # ########################## #